@@ -0,0 +1,128 @@
+"""AI サーバーのスループットとメモリ使用量を計測する簡易ベンチマーク。
+
+    # 別ターミナルで: python serve.py --workers 2
+    python bench.py --endpoint embedding --image face.jpg --concurrency 8 --requests 200 \
+        --server-pid <serve.py の PID>
+
+--server-pid を指定すると、親プロセスと fork されたワーカーの RSS / PSS を集計して表示する。
+copy-on-write で共有されているページは PSS ではワーカー数で按分されるため、
+ワーカー追加時の実メモリ増加量は PSS の合計で比較する。
+"""
+
+import argparse
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+
+
+def _read_memory_kb(pid: int) -> dict[str, int]:
+    values = {"Rss": 0, "Pss": 0, "Shared_Clean": 0, "Shared_Dirty": 0}
+    path = Path(f"/proc/{pid}/smaps_rollup")
+    if not path.exists():
+        return values
+    for line in path.read_text().splitlines():
+        key, _, rest = line.partition(":")
+        if key in values:
+            values[key] = int(rest.split()[0])
+    return values
+
+
+def _child_pids(pid: int) -> list[int]:
+    children: list[int] = []
+    task_dir = Path(f"/proc/{pid}/task")
+    if not task_dir.exists():
+        return children
+    for task in task_dir.iterdir():
+        children_file = task / "children"
+        if children_file.exists():
+            children.extend(int(p) for p in children_file.read_text().split())
+    return children
+
+
+def memory_report(server_pid: int) -> dict[str, object]:
+    pids = [server_pid, *_child_pids(server_pid)]
+    per_process = {pid: _read_memory_kb(pid) for pid in pids}
+    return {
+        "processes": len(pids),
+        "rss_mb": sum(m["Rss"] for m in per_process.values()) / 1024,
+        "pss_mb": sum(m["Pss"] for m in per_process.values()) / 1024,
+        "shared_mb": sum(
+            m["Shared_Clean"] + m["Shared_Dirty"] for m in per_process.values()
+        ) / 1024,
+    }
+
+
+def _build_request(endpoint: str, image: bytes | None, prompt: str):
+    if endpoint == "generate-proposal":
+        return {"json": {"prompt": prompt}}
+    if image is None:
+        raise SystemExit(f"--image is required for /{endpoint}")
+    return {"files": {"file": ("image.jpg", image, "image/jpeg")}}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument(
+        "--endpoint",
+        choices=["embedding", "detect-faces", "generate-proposal"],
+        default="embedding",
+    )
+    parser.add_argument("--image", type=Path)
+    parser.add_argument("--prompt", default="カフェ")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--server-pid", type=int)
+    args = parser.parse_args()
+
+    image = args.image.read_bytes() if args.image else None
+    request_kwargs = _build_request(args.endpoint, image, args.prompt)
+    url = f"{args.url}/{args.endpoint}"
+
+    latencies: list[float] = []
+    errors = 0
+
+    with httpx.Client(timeout=300.0) as client:
+        # ウォームアップ
+        client.post(url, **request_kwargs).raise_for_status()
+
+        def _one(_: int) -> float | None:
+            start = time.perf_counter()
+            try:
+                client.post(url, **request_kwargs).raise_for_status()
+            except httpx.HTTPError:
+                return None
+            return time.perf_counter() - start
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for result in pool.map(_one, range(args.requests)):
+                if result is None:
+                    errors += 1
+                else:
+                    latencies.append(result)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    report: dict[str, object] = {
+        "endpoint": args.endpoint,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1)
+        if latencies
+        else None,
+    }
+    if args.server_pid:
+        report["memory"] = memory_report(args.server_pid)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,31 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile, Form
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from PIL import Image
 import torch
-from transformers import AutoImageProcessor, AutoModel, pipeline, set_seed
+from transformers import (
+    AutoImageProcessor,
+    AutoModel,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    pipeline,
+    set_seed,
+)
 from dotenv import load_dotenv
+import asyncio
 import os
 import io
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
 from typing import Optional
 import cv2
 import numpy as np
 import logging
 
+from title_latency import TokenLatency
+from title_templates import template_title
+
 # ロギング設定
 logging.basicConfig(
     level=logging.INFO,
@@ -58,12 +73,81 @@ set_seed(42) # 再現性のためのシード設定
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
 
 
+# バックエンドから渡される残り時間 (ミリ秒)。この時間を過ぎた処理は誰も待っていない
+BUDGET_HEADER = "X-Request-Budget-Ms"
+
+# 1プロセス内で同時に実行する推論の数。モデル内部の並列化は torch のスレッドに任せる
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "1"))
+_inference_slots: Optional[asyncio.Semaphore] = None
+
+
+@app.middleware("http")
+async def attach_deadline(request: Request, call_next):
+    """受信時刻と予算ヘッダーからリクエストの締め切りを計算して記録する"""
+    deadline = None
+    budget_ms = request.headers.get(BUDGET_HEADER)
+    if budget_ms is not None:
+        try:
+            deadline = time.monotonic() + int(budget_ms) / 1000
+        except ValueError:
+            logging.warning(f"Invalid {BUDGET_HEADER} header: {budget_ms}")
+    request.state.deadline = deadline
+    return await call_next(request)
+
+
+def _remaining(request: Request) -> Optional[float]:
+    deadline = getattr(request.state, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+async def run_inference(request: Request, func, *args, **kwargs):
+    """
+    推論スロットが空くまで待ってから func をスレッドプールで実行する。
+    待っている間に締め切りを過ぎたり、呼び出し元が切断した場合は実行せずに破棄する。
+    """
+    global _inference_slots
+    if _inference_slots is None:
+        _inference_slots = asyncio.Semaphore(INFERENCE_CONCURRENCY)
+
+    remaining = _remaining(request)
+    if remaining is not None and remaining <= 0:
+        raise HTTPException(status_code=504, detail="Deadline exceeded")
+    try:
+        await asyncio.wait_for(_inference_slots.acquire(), timeout=remaining)
+    except asyncio.TimeoutError:
+        logging.info(f"[{request.url.path}] Dropped queued request: deadline exceeded.")
+        raise HTTPException(status_code=504, detail="Deadline exceeded")
+    try:
+        remaining = _remaining(request)
+        if remaining is not None and remaining <= 0:
+            logging.info(f"[{request.url.path}] Dropped queued request: deadline exceeded.")
+            raise HTTPException(status_code=504, detail="Deadline exceeded")
+        if await request.is_disconnected():
+            logging.info(f"[{request.url.path}] Dropped queued request: client disconnected.")
+            raise HTTPException(status_code=499, detail="Client closed request")
+        return await run_in_threadpool(func, *args, **kwargs)
+    finally:
+        _inference_slots.release()
+
+
+# タイトルのみ生成する場合の設定
+TITLE_MAX_NEW_TOKENS = int(os.getenv("TITLE_MAX_NEW_TOKENS", "24"))
+TITLE_BUDGET_MS = int(os.getenv("TITLE_BUDGET_MS", "1500"))
+# 予算超過が見込まれていても、この間隔 (秒) ごとに一度はモデルを試して見積もりを更新する
+TITLE_PROBE_INTERVAL = float(os.getenv("TITLE_PROBE_INTERVAL", "30"))
+
+
 class ProposalRequest(BaseModel):
     prompt: str
+    title_only: bool = False # True ならタイトルだけを予算内で生成する
+    latency_budget_ms: Optional[int] = None
 
 class AIProposal(BaseModel):
     title: str
     description: str
+    source: str = "model" # "model" または "template"
 
 class FaceDetectionBox(BaseModel):
     box: list[int] # [x, y, w, h]
@@ -76,39 +160,100 @@ class FaceDetectionResponse(BaseModel):
 def read_root():
     return {"Hello": "World"}
 
+def _detect_faces(image_data: bytes):
+    nparr = np.frombuffer(image_data, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    # 顔検出の実行
+    return face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+
+
+@contextmanager
+def _shared_payload(name: str, size: int):
+    """バックエンドが共有メモリに書いた画像をコピーせずに memoryview として借りる。
+
+    セグメントの作成と削除はバックエンド側の責任なので、ここでは close だけ行う。
+    """
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        raise HTTPException(status_code=422, detail="Shared memory segment not found")
+    # attach しただけのセグメントを resource_tracker に終了時 unlink させない
+    resource_tracker.unregister(segment._name, "shared_memory")
+    if size > segment.size:
+        segment.close()
+        raise HTTPException(status_code=422, detail="shm_size exceeds the segment")
+    view = segment.buf[:size]
+    try:
+        yield view
+    finally:
+        view.release()
+        segment.close()
+
+
+@contextmanager
+def _image_payload(data: Optional[bytes], shm: Optional[str], shm_size: Optional[int]):
+    """multipart で届いたデータか共有メモリのハンドルのどちらかから画像データを取り出す。"""
+    if shm:
+        if shm_size is None or shm_size <= 0:
+            raise HTTPException(status_code=422, detail="shm_size is required with shm")
+        with _shared_payload(shm, shm_size) as view:
+            yield view
+        return
+    if data is None:
+        raise HTTPException(status_code=422, detail="file or shm is required")
+    yield data
+
+
 @app.post("/detect-faces", response_model=FaceDetectionResponse)
-async def detect_faces_endpoint(file: UploadFile = File(...)):
+async def detect_faces_endpoint(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    shm: Optional[str] = Form(None), # 同一ホストのバックエンドから共有メモリで受け取る場合のセグメント名
+    shm_size: Optional[int] = Form(None),
+):
     """
     アップロードされた画像から顔を検出し、バウンディングボックスを返すAPI
     """
     logging.info("[/detect-faces] Received request.")
     try:
-        image_data = await file.read()
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # 顔検出の実行
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        data = await file.read() if file is not None else None
+        with _image_payload(data, shm, shm_size) as image_data:
+            faces = await run_inference(request, _detect_faces, image_data)
         logging.info(f"[/detect-faces] Found {len(faces)} faces.")
         return FaceDetectionResponse(faces=[{"box": face.tolist()} for face in faces])
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"[/detect-faces] Error processing request: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+def _compute_embedding(image: Image.Image) -> list[float]:
+    with torch.no_grad():
+        inputs = processor(images=image, return_tensors="pt")
+        outputs = model(**inputs)
+        return outputs.last_hidden_state[:, 0].squeeze().tolist()
+
+
 @app.post("/embedding")
 async def create_embedding(
-    file: UploadFile = File(...),
+    request: Request,
+    file: Optional[UploadFile] = File(None),
     box: Optional[str] = Form(None), # JSON文字列として bounding box を受け取る e.g., '[x, y, w, h]'
+    shm: Optional[str] = Form(None),
+    shm_size: Optional[int] = Form(None),
 ):
     """
     画像からエンベディングを生成する。オプションで顔の領域(box)を指定可能。
     """
     logging.info(f"[/embedding] Received request. Box: {box}")
     try:
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        data = await file.read() if file is not None else None
+        with _image_payload(data, shm, shm_size) as image_data:
+            # convert() でデコードを済ませてから共有メモリを手放す
+            image = Image.open(io.BytesIO(image_data)).convert("RGB")
 
         # boxが指定されていれば、画像を切り抜く
         if box:
@@ -122,37 +267,135 @@ async def create_embedding(
                 pass
 
         # モデルでエンベディングを生成
-        with torch.no_grad():
-            inputs = processor(images=image, return_tensors="pt")
-            outputs = model(**inputs)
-            embedding = outputs.last_hidden_state[:, 0].squeeze().tolist()
-        
+        embedding = await run_inference(request, _compute_embedding, image)
+
         logging.info("[/embedding] Successfully generated embedding.")
         return {"embedding": embedding}
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"[/embedding] Error processing request: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+class _NewlineStoppingCriteria(StoppingCriteria):
+    """生成されたトークンに改行が現れた時点で生成を止める"""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.prompt_length: Optional[int] = None
+        self.steps = 0
+        self.hit_newline = False
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if self.prompt_length is None:
+            # 最初の呼び出し時点で新しいトークンが 1 つ追加されている
+            self.prompt_length = input_ids.shape[1] - 1
+        self.steps += 1
+        new_text = self.tokenizer.decode(input_ids[0, self.prompt_length:], skip_special_tokens=True)
+        if "\n" in new_text:
+            self.hit_newline = True
+        return self.hit_newline
+
+
+# 1トークンあたりの生成時間の見積もり。予算内に生成できるかの判断に使う
+_token_latency = TokenLatency(probe_interval=TITLE_PROBE_INTERVAL)
+
+
+def _generate_title(full_prompt: str, deadline: float) -> tuple[str, bool]:
+    """タイトルのみを生成する。(タイトル, 予算内に改行まで生成できたか) を返す"""
+    # 推論スロットの空き待ちで予算を使い切っていればモデルは動かさない
+    max_time = deadline - time.monotonic()
+    if max_time <= 0:
+        return "", False
+    criteria = _NewlineStoppingCriteria(proposal_generator.tokenizer)
+    started = time.monotonic()
+    outputs = proposal_generator(
+        full_prompt,
+        max_new_tokens=TITLE_MAX_NEW_TOKENS,
+        num_return_sequences=1,
+        do_sample=True,
+        top_k=50,
+        top_p=0.95,
+        temperature=0.8,
+        return_full_text=False,
+        stopping_criteria=StoppingCriteriaList([criteria]),
+        max_time=max_time,
+    )
+    elapsed = time.monotonic() - started
+    _token_latency.record(elapsed, criteria.steps)
+
+    title = outputs[0]["generated_text"].split("\n", 1)[0].strip()
+    # 改行に達したか、トークン上限まで生成できていれば完了とみなす
+    completed = criteria.hit_newline or criteria.steps >= TITLE_MAX_NEW_TOKENS
+    return title, completed
+
+
+def _generate_proposal_text(full_prompt: str, deadline: Optional[float]):
+    """提案の本文まで生成する"""
+    # 締め切りがある場合は max_time で生成を打ち切り、予算を使い切ったら途中までの結果を返す。
+    # 推論スロットの空き待ちの時間を差し引くため、残り時間はスロットを得てから計算する
+    generation_kwargs = {}
+    if deadline is not None:
+        generation_kwargs["max_time"] = max(deadline - time.monotonic(), 0.0)
+    return proposal_generator(
+        full_prompt,
+        max_length=100, # 生成するテキストの最大長
+        num_return_sequences=1,
+        do_sample=True,
+        top_k=50,
+        top_p=0.95,
+        temperature=0.8,
+        **generation_kwargs,
+    )
+
+
+async def _generate_title_proposal(request: ProposalRequest, http_request: Request) -> AIProposal:
+    full_prompt = f"新しい提案を考えてください。テーマは「{request.prompt}」です。\n提案のタイトル："
+
+    budget = (request.latency_budget_ms or TITLE_BUDGET_MS) / 1000
+    remaining = _remaining(http_request)
+    if remaining is not None:
+        budget = min(budget, remaining)
+
+    # これまでの生成速度から予算内に間に合わないと見込まれる場合はモデルを使わない
+    if _token_latency.should_try(TITLE_MAX_NEW_TOKENS, budget):
+        try:
+            title, completed = await run_inference(
+                http_request, _generate_title, full_prompt, time.monotonic() + budget
+            )
+        except HTTPException as exc:
+            if exc.status_code != 504:
+                raise
+            title, completed = "", False
+        if completed and title:
+            logging.info(f"[/generate-proposal] Model title: {title}")
+            return AIProposal(title=title, description="", source="model")
+
+    title = template_title(request.prompt)
+    logging.info(f"[/generate-proposal] Template title: {title}")
+    return AIProposal(title=title, description="", source="template")
+
+
 @app.post("/generate-proposal", response_model=AIProposal)
-async def generate_proposal_endpoint(request: ProposalRequest):
+async def generate_proposal_endpoint(request: ProposalRequest, http_request: Request):
     """
     プロンプトに基づいてAIが提案のアイデアを文章で生成する
     """
     logging.info(f"[/generate-proposal] Received request with prompt: {request.prompt}")
     try:
+        if request.title_only:
+            return await _generate_title_proposal(request, http_request)
+
         # モデルが生成しやすいようにプロンプトを整形
         full_prompt = f"新しい提案を考えてください。テーマは「{request.prompt}」です。\n提案のタイトル："
 
         # テキスト生成の実行
-        generated_outputs = proposal_generator(
+        generated_outputs = await run_inference(
+            http_request,
+            _generate_proposal_text,
             full_prompt,
-            max_length=100, # 生成するテキストの最大長
-            num_return_sequences=1,
-            do_sample=True,
-            top_k=50,
-            top_p=0.95,
-            temperature=0.8,
+            getattr(http_request.state, "deadline", None),
         )
         generated_text = generated_outputs[0]['generated_text']
         logging.info(f"[/generate-proposal] Generated text: {generated_text}")
@@ -169,6 +412,8 @@ async def generate_proposal_endpoint(request: ProposalRequest):
         
         logging.info(f"[/generate-proposal] Parsed title: {title}")
         return AIProposal(title=title, description=description)
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"[/generate-proposal] Error processing request: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -0,0 +1,189 @@
+"""モデルを親プロセスで一度だけロードし、fork した複数ワーカーで共有して配信するエントリポイント。
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+    python serve.py --workers 4 --uds /run/ai/ai.sock   # 同一ホストのバックエンド向け
+
+親プロセスで `main` を import して DINOv2 / GPT-2 をロードしたあとに fork するため、
+モデルの重みは copy-on-write で全ワーカーに共有される。各ワーカーは同じ listen
+ソケットを受け継いだ uvicorn サーバーとして動作する。
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+
+def _available_cpus() -> int:
+    # コンテナの CPU 制限 (cpuset) を考慮する
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Preforking AI server")
+    parser.add_argument("--host", default=os.getenv("AI_SERVER_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("AI_SERVER_PORT", "8000")))
+    parser.add_argument(
+        "--uds",
+        default=os.getenv("AI_SERVER_UDS", ""),
+        help="TCP の代わりに listen する Unix ドメインソケットのパス",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("AI_SERVER_WORKERS", "1")),
+        help="fork するワーカー数",
+    )
+    parser.add_argument(
+        "--torch-threads",
+        type=int,
+        default=int(os.getenv("AI_SERVER_TORCH_THREADS", "0")),
+        help="全ワーカー合計の torch スレッド数 (0 なら利用可能な CPU 数)",
+    )
+    parser.add_argument("--log-level", default=os.getenv("UVICORN_LOG_LEVEL", "info"))
+    return parser.parse_args(argv)
+
+
+def partition_threads(workers: int, total_threads: int) -> int:
+    """ワーカー 1 つあたりの torch intra-op スレッド数を返す。"""
+    return max(1, total_threads // max(1, workers))
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _bind_unix_socket(path: str) -> socket.socket:
+    # 前回の起動で残ったソケットファイルがあると bind できない
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    # バックエンドが別ユーザーのコンテナで動いていても接続できるようにする
+    os.chmod(path, 0o666)
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _configure_worker_threads(threads: int) -> None:
+    import torch
+
+    # ワーカー同士で CPU コアを奪い合わないようにスレッド数を分割する
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 親プロセスで既に並列処理が始まっている場合は変更できない
+        pass
+
+
+def _run_worker(index: int, sock: socket.socket, threads: int, args: argparse.Namespace) -> None:
+    import main as ai_main
+
+    _configure_worker_threads(threads)
+    logging.info(f"[serve] Worker {index} (pid={os.getpid()}) started with {threads} torch threads.")
+    config = uvicorn.Config(ai_main.app, log_level=args.log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def _spawn(index: int, sock: socket.socket, threads: int, args: argparse.Namespace) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            # 親のシグナルハンドラを引き継がないよう既定に戻す (uvicorn が再設定する)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            _run_worker(index, sock, threads, args)
+        except Exception:
+            logging.error(f"[serve] Worker {index} crashed.", exc_info=True)
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main(argv=None) -> None:
+    args = _parse_args(argv)
+    workers = max(1, args.workers)
+    total_threads = args.torch_threads or _available_cpus()
+    threads = partition_threads(workers, total_threads)
+
+    # ここで DINOv2 / GPT-2 / Haar Cascade がロードされる (fork 前に一度だけ)
+    import main as ai_main  # noqa: F401
+
+    # 親で作ったオブジェクトを GC の追跡対象から外し、子プロセスの GC 走査による
+    # ページ書き込み (= COW でのコピー発生) を抑える
+    gc.collect()
+    gc.freeze()
+
+    if args.uds:
+        sock = _bind_unix_socket(args.uds)
+        address = f"unix:{args.uds}"
+    else:
+        sock = _bind_socket(args.host, args.port)
+        address = f"{args.host}:{args.port}"
+    logging.info(
+        f"[serve] Listening on {address} with {workers} workers x {threads} torch threads."
+    )
+
+    children: dict[int, int] = {}
+    for index in range(workers):
+        children[_spawn(index, sock, threads, args)] = index
+
+    stopping = False
+
+    def _shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logging.warning(
+            f"[serve] Worker {index} (pid={pid}) exited with status {status}. Restarting."
+        )
+        # 連続クラッシュ時に fork し続けないよう少し待つ
+        time.sleep(1.0)
+        children[_spawn(index, sock, threads, args)] = index
+
+    sock.close()
+    if args.uds and os.path.exists(args.uds):
+        os.unlink(args.uds)
+    logging.info("[serve] All workers stopped.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+"""AI サーバーのモデルを読み込まない部分のテスト。"""
+
+import sys
+from pathlib import Path
+
+# serve.py と同じく AI_server ディレクトリ直下のモジュールをトップレベルとして import する
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
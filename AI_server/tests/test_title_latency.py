@@ -0,0 +1,37 @@
+from title_latency import TokenLatency
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_model_path_returns_after_a_slow_outlier() -> None:
+    clock = _Clock()
+    latency = TokenLatency(probe_interval=30.0, clock=clock)
+    latency.record(elapsed=0.24, steps=24)
+    assert latency.should_try(24, budget=1.5)
+
+    # コールドスタートの 1 回で見積もりが予算を大きく超える
+    latency.record(elapsed=120.0, steps=24)
+    assert not latency.should_try(24, budget=1.5)
+
+    # 間隔が空けば見積もりを取り直すために一度だけ試す
+    clock.now = 31.0
+    assert latency.should_try(24, budget=1.5)
+    assert not latency.should_try(24, budget=1.5)
+
+    # 試行のサンプルが速ければ、次からは毎回モデルを使う
+    latency.record(elapsed=0.3, steps=24)
+    assert all(latency.should_try(24, budget=1.5) for _ in range(3))
+
+
+def test_no_budget_never_tries_the_model() -> None:
+    latency = TokenLatency()
+    assert latency.should_try(24, budget=1.5)
+    assert not latency.should_try(24, budget=0)
+    latency.record(elapsed=1.0, steps=0)
+    assert latency.ewma is None
@@ -0,0 +1,15 @@
+from title_templates import TITLE_FALLBACK_THEMES, template_title
+
+
+def test_ascii_theme_is_kept_in_the_title() -> None:
+    assert "BBQ" in template_title("BBQ")
+    assert "Game night" in template_title("  Game   night ")
+    # 長いテーマは単語の途中で切らない
+    assert "board games" in template_title("board games and pizza")
+
+
+def test_japanese_theme_and_empty_theme() -> None:
+    assert "焼肉" in template_title("「焼肉」")
+    assert template_title("焼肉") == template_title("焼肉")
+    title = template_title("  ")
+    assert any(theme in title for theme in TITLE_FALLBACK_THEMES)
@@ -0,0 +1,56 @@
+"""タイトル生成の 1 トークンあたりの所要時間の見積もり。
+
+モデルを使うかどうかはこの見積もりで決めるが、見積もりはモデルを実行したときにしか
+更新されない。コールドスタートや GC の停止で一度だけ遅いサンプルが入ると予算超過の
+見込みが続き、テンプレートのパスから抜け出せなくなる。そのため予算超過が見込まれる
+場合でも、最後のサンプルから ``probe_interval`` 秒経っていればモデルを試し、その
+サンプルで見積もりを置き換える。
+"""
+
+import time
+from typing import Callable, Optional
+
+
+class TokenLatency:
+    """1 トークンあたりの生成時間 (秒) の指数移動平均"""
+
+    def __init__(
+        self,
+        *,
+        alpha: float = 0.2,
+        probe_interval: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.alpha = alpha
+        self.probe_interval = probe_interval
+        self._clock = clock
+        self.ewma: Optional[float] = None
+        self._sampled_at: Optional[float] = None
+        self._probing = False
+
+    def record(self, elapsed: float, steps: int) -> None:
+        if steps <= 0:
+            return
+        sample = elapsed / steps
+        self._sampled_at = self._clock()
+        if self.ewma is None or self._probing:
+            # 高止まりした見積もりは平均せずに新しいサンプルで置き換える
+            self.ewma = sample
+            self._probing = False
+        else:
+            self.ewma = (1 - self.alpha) * self.ewma + self.alpha * sample
+
+    def should_try(self, tokens: int, budget: float) -> bool:
+        """予算内に間に合う見込みか、見積もりを取り直す時期ならモデルを試す"""
+        if budget <= 0:
+            return False
+        if (self.ewma or 0.0) * tokens <= budget:
+            return True
+        # 見込みでは間に合わないが、古い見積もりのままにしないよう時々試す
+        now = self._clock()
+        if self._sampled_at is None or now - self._sampled_at >= self.probe_interval:
+            # 試行中の他のリクエストまで一斉にモデルへ流さない
+            self._sampled_at = now
+            self._probing = True
+            return True
+        return False
@@ -0,0 +1,37 @@
+"""テンプレートによる高速なタイトル生成 (モデルが予算内に間に合わない場合に使用)"""
+
+import random
+import zlib
+
+TITLE_TEMPLATES = [
+    "{theme}で集まろう",
+    "久しぶりに{theme}",
+    "みんなで{theme}",
+    "{theme}の会",
+    "週末に{theme}しませんか",
+    "{theme}でまた会おう",
+]
+TITLE_FALLBACK_THEMES = ["ごはん", "カフェ", "おでかけ", "散歩"]
+# タイトルに埋め込むテーマの最大文字数
+TITLE_KEYWORD_MAX_CHARS = 12
+
+
+def _shorten(keyword: str) -> str:
+    if len(keyword) <= TITLE_KEYWORD_MAX_CHARS:
+        return keyword
+    cut = keyword[:TITLE_KEYWORD_MAX_CHARS]
+    # 英語などのテーマは単語の途中で切らない
+    if keyword.isascii() and " " in cut and keyword[TITLE_KEYWORD_MAX_CHARS] != " ":
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.strip()
+
+
+def template_title(theme: str) -> str:
+    """テーマから決定的にタイトルを組み立てる (モデルを使わない高速パス)"""
+    seed = zlib.crc32(theme.encode("utf-8"))
+    rng = random.Random(seed)
+    keyword = " ".join(theme.strip().strip("「」。、").split())
+    if not keyword:
+        # テーマが空なら定番のテーマから選ぶ
+        keyword = rng.choice(TITLE_FALLBACK_THEMES)
+    return rng.choice(TITLE_TEMPLATES).format(theme=_shorten(keyword))
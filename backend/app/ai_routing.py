@@ -0,0 +1,342 @@
+"""Client-side load balancing and failure isolation for AI-server calls."""
+
+from __future__ import annotations
+
+import math
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Sequence
+
+from . import config
+
+
+# Which replica group serves each AI-server path.
+DETECTION = "detection"
+GENERATION = "generation"
+
+ENDPOINT_KINDS = {
+    "/detect-faces": DETECTION,
+    "/embedding": DETECTION,
+    "/generate-proposal": GENERATION,
+}
+
+
+@dataclass
+class Replica:
+    """Passive health and load state of one AI-server replica."""
+
+    url: str
+    outstanding: int = 0
+    consecutive_failures: int = 0
+    latency_ewma: float | None = None
+    ejected_until: float = 0.0
+    requests_total: int = 0
+    failures_total: int = 0
+    ejections_total: int = 0
+
+    def is_available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class ReplicaPool:
+    """Route requests to the replica with the fewest outstanding requests.
+
+    Replicas that fail repeatedly or whose latency average exceeds the slow
+    threshold are ejected for a cooldown period, after which they rejoin with
+    a clean slate. When every replica is ejected the pool keeps routing to the
+    one that recovers soonest rather than failing outright.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        urls: Sequence[str],
+        *,
+        max_failures: int = 3,
+        ejection_seconds: float = 30.0,
+        slow_seconds: float = 10.0,
+    ) -> None:
+        if not urls:
+            raise ValueError(f"No AI-server replicas configured for {kind}.")
+        self.kind = kind
+        self.replicas = [Replica(url=url.rstrip("/")) for url in urls]
+        self.max_failures = max_failures
+        self.ejection_seconds = ejection_seconds
+        self.slow_seconds = slow_seconds
+
+    def pick(self, exclude: Iterable[Replica] = ()) -> Replica:
+        """Return the least-loaded healthy replica, avoiding *exclude* if possible."""
+        now = time.monotonic()
+        excluded = {id(replica) for replica in exclude}
+        candidates = [r for r in self.replicas if id(r) not in excluded] or self.replicas
+        for replica in candidates:
+            if replica.ejected_until and replica.is_available(now):
+                self._readmit(replica)
+        healthy = [r for r in candidates if r.is_available(now)]
+        if not healthy:
+            return min(candidates, key=lambda r: r.ejected_until)
+        random.shuffle(healthy)
+        return min(healthy, key=lambda r: (r.outstanding, r.latency_ewma or 0.0))
+
+    @contextmanager
+    def track(self, replica: Replica) -> Iterator[None]:
+        """Count *replica* as busy for the duration of the block."""
+        replica.outstanding += 1
+        replica.requests_total += 1
+        try:
+            yield
+        finally:
+            replica.outstanding -= 1
+
+    def record_success(self, replica: Replica, elapsed: float) -> None:
+        replica.consecutive_failures = 0
+        if replica.latency_ewma is None:
+            replica.latency_ewma = elapsed
+        else:
+            replica.latency_ewma = 0.8 * replica.latency_ewma + 0.2 * elapsed
+        if replica.latency_ewma > self.slow_seconds:
+            self._eject(replica)
+
+    def record_failure(self, replica: Replica) -> None:
+        replica.consecutive_failures += 1
+        replica.failures_total += 1
+        if replica.consecutive_failures >= self.max_failures:
+            self._eject(replica)
+
+    def _eject(self, replica: Replica) -> None:
+        replica.ejected_until = time.monotonic() + self.ejection_seconds
+        replica.ejections_total += 1
+
+    @staticmethod
+    def _readmit(replica: Replica) -> None:
+        replica.ejected_until = 0.0
+        replica.consecutive_failures = 0
+        replica.latency_ewma = None
+
+    def stats(self) -> list[dict[str, object]]:
+        now = time.monotonic()
+        return [
+            {
+                "url": replica.url,
+                "healthy": replica.is_available(now),
+                "outstanding": replica.outstanding,
+                "latency_ewma_ms": None
+                if replica.latency_ewma is None
+                else round(replica.latency_ewma * 1000, 1),
+                "requests_total": replica.requests_total,
+                "failures_total": replica.failures_total,
+                "ejections_total": replica.ejections_total,
+            }
+            for replica in self.replicas
+        ]
+
+
+class CircuitOpen(RuntimeError):
+    """Raised instead of calling an AI endpoint whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Fail fast once an endpoint's recent error or slow-call rate is too high.
+
+    The breaker looks at the last ``window`` calls. Once at least
+    ``min_calls`` are recorded and either rate crosses its threshold, the
+    circuit opens and calls are rejected for ``open_seconds``. After that
+    the circuit is half-open: up to ``half_open_probes`` calls go through.
+    One success closes the circuit again; one failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        *,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_seconds: float = 10.0,
+        slow_rate: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1,
+    ) -> None:
+        self.outcomes: deque[tuple[bool, bool]] = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.rejected_total = 0
+
+    def before_call(self) -> None:
+        """Reserve permission for one call or raise :class:`CircuitOpen`."""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                self.rejected_total += 1
+                raise CircuitOpen("AI server circuit is open")
+            self.state = self.HALF_OPEN
+            self.probes_in_flight = 0
+        if self.state == self.HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_probes:
+                self.rejected_total += 1
+                raise CircuitOpen("AI server circuit is half-open")
+            self.probes_in_flight += 1
+
+    def record_success(self, elapsed: float) -> None:
+        if self.state == self.HALF_OPEN:
+            self._close()
+            return
+        self.outcomes.append((True, elapsed > self.slow_seconds))
+        self._evaluate()
+
+    def record_failure(self) -> None:
+        if self.state == self.HALF_OPEN:
+            self._open()
+            return
+        self.outcomes.append((False, False))
+        self._evaluate()
+
+    def abandon(self) -> None:
+        """Release a reserved call that finished without an outcome (cancelled)."""
+        if self.state == self.HALF_OPEN and self.probes_in_flight:
+            self.probes_in_flight -= 1
+
+    def _evaluate(self) -> None:
+        calls = len(self.outcomes)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for ok, _ in self.outcomes if not ok)
+        slow = sum(1 for _, is_slow in self.outcomes if is_slow)
+        if failures / calls >= self.failure_rate or slow / calls >= self.slow_rate:
+            self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.probes_in_flight = 0
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self.outcomes.clear()
+        self.probes_in_flight = 0
+
+    def stats(self) -> dict[str, object]:
+        calls = len(self.outcomes)
+        failures = sum(1 for ok, _ in self.outcomes if not ok)
+        return {
+            "state": self.state,
+            "window_calls": calls,
+            "failure_rate": round(failures / calls, 3) if calls else 0.0,
+            "rejected_total": self.rejected_total,
+        }
+
+
+@dataclass
+class Endpoint:
+    """Per-path breaker, latency history and hedging counters."""
+
+    path: str
+    breaker: CircuitBreaker
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=200))
+    hedges_sent: int = 0
+    hedges_won: int = 0
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, math.ceil(percentile / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def hedge_delay(self) -> float | None:
+        """Return how long to wait before hedging, or None if hedging is off."""
+        if self.path not in config.AI_HEDGE_ENDPOINTS:
+            return None
+        if len(self.latencies) < config.AI_HEDGE_MIN_SAMPLES:
+            return None
+        delay = self.latency_percentile(config.AI_HEDGE_PERCENTILE)
+        return max(delay or 0.0, config.AI_HEDGE_MIN_DELAY)
+
+    def stats(self) -> dict[str, object]:
+        def _ms(value: float | None) -> float | None:
+            return None if value is None else round(value * 1000, 1)
+
+        return {
+            **self.breaker.stats(),
+            "p50_ms": _ms(self.latency_percentile(50)),
+            "p95_ms": _ms(self.latency_percentile(95)),
+            "hedge_delay_ms": _ms(self.hedge_delay()),
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+        }
+
+
+_pools: dict[str, ReplicaPool] = {}
+_endpoints: dict[str, Endpoint] = {}
+
+
+def _configured_urls(kind: str) -> list[str]:
+    if kind == DETECTION and config.AI_DETECTION_SERVER_URLS:
+        return config.AI_DETECTION_SERVER_URLS
+    if kind == GENERATION and config.AI_GENERATION_SERVER_URLS:
+        return config.AI_GENERATION_SERVER_URLS
+    return config.AI_SERVER_URLS
+
+
+def get_pool(kind: str) -> ReplicaPool:
+    """Return the replica pool serving endpoints of the given kind."""
+    pool = _pools.get(kind)
+    if pool is None:
+        pool = ReplicaPool(
+            kind,
+            _configured_urls(kind),
+            max_failures=config.AI_REPLICA_MAX_FAILURES,
+            ejection_seconds=config.AI_REPLICA_EJECTION_SECONDS,
+            slow_seconds=config.AI_REPLICA_SLOW_SECONDS,
+        )
+        _pools[kind] = pool
+    return pool
+
+
+def pool_for_path(path: str) -> ReplicaPool:
+    return get_pool(ENDPOINT_KINDS.get(path, DETECTION))
+
+
+def get_endpoint(path: str) -> Endpoint:
+    """Return the breaker and latency state of an AI-server path."""
+    endpoint = _endpoints.get(path)
+    if endpoint is None:
+        endpoint = Endpoint(
+            path=path,
+            breaker=CircuitBreaker(
+                window=config.AI_BREAKER_WINDOW,
+                min_calls=config.AI_BREAKER_MIN_CALLS,
+                failure_rate=config.AI_BREAKER_FAILURE_RATE,
+                slow_seconds=config.AI_BREAKER_SLOW_SECONDS,
+                slow_rate=config.AI_BREAKER_SLOW_RATE,
+                open_seconds=config.AI_BREAKER_OPEN_SECONDS,
+            ),
+        )
+        _endpoints[path] = endpoint
+    return endpoint
+
+
+def reset_pools() -> None:
+    """Forget replica and endpoint state so the next request rebuilds it from config."""
+    _pools.clear()
+    _endpoints.clear()
+
+
+def stats() -> dict[str, list[dict[str, object]]]:
+    return {kind: pool.stats() for kind, pool in _pools.items()}
+
+
+def endpoint_stats() -> dict[str, dict[str, object]]:
+    return {path: endpoint.stats() for path, endpoint in _endpoints.items()}
@@ -1,21 +1,514 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any, Awaitable, Callable, Iterator, TypeVar
+
 import httpx
 from fastapi import UploadFile
 
-from . import config
+from . import ai_routing, assets, config, images
 
 
-async def generate_embedding_from_image(file: UploadFile) -> list[float] | None:
-    """Detects faces in an image and generates an embedding for the largest face."""
-    # aiohttpやstarletteのUploadFileはseekが必要
-    await file.seek(0)
-    image_content = await file.read()
-    await file.seek(0) # 他の処理で再利用するためにポインタを戻す
+# Header carrying the remaining time budget (in milliseconds) to the AI server.
+BUDGET_HEADER = "X-Request-Budget-Ms"
+
+_deadline: ContextVar[float | None] = ContextVar("ai_request_deadline", default=None)
+
+logger = logging.getLogger(__name__)
+
+# Application-scoped HTTP client, opened and closed by the FastAPI lifespan.
+_client: httpx.AsyncClient | None = None
+_http2_enabled = False
+_requests_total = 0
+_requests_in_flight = 0
+_shm_requests = 0
+_shm_bytes = 0
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(RuntimeError):
+    """Raised when the time budget for AI work has been used up."""
+
+
+class UpstreamDeadlineExceeded(DeadlineExceeded):
+    """The budget ran out while waiting on the AI server (not before sending)."""
+
+
+@contextmanager
+def request_deadline(budget: float | None = None) -> Iterator[float]:
+    """Bound all AI calls made inside the block by a shared time budget.
+
+    Nested blocks never extend an outer deadline; the tighter one wins.
+    """
+    budget = config.AI_REQUEST_TIMEOUT if budget is None else budget
+    deadline = time.monotonic() + budget
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> float:
+    """Return the seconds left before the active deadline expires."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return config.AI_REQUEST_TIMEOUT
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("AI request deadline exceeded")
+    return remaining
+
+
+# --- Shared HTTP client ----------------------------------------------------
+
+
+def _build_client() -> httpx.AsyncClient:
+    global _http2_enabled
+    http2 = config.AI_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("AI_HTTP2 is enabled but the 'h2' package is missing; using HTTP/1.1.")
+            http2 = False
+    limits = httpx.Limits(
+        max_connections=config.AI_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.AI_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=config.AI_HTTP_KEEPALIVE_EXPIRY,
+    )
+    _http2_enabled = http2
+    mounts = None
+    if config.AI_SERVER_UDS:
+        # Only the co-located AI server is reached over the socket; image
+        # downloads and remote replicas keep using TCP.
+        local = httpx.URL(config.AI_SERVER_URL)
+        pattern = f"all://{local.host}" if local.port is None else f"all://{local.host}:{local.port}"
+        mounts = {pattern: httpx.AsyncHTTPTransport(uds=config.AI_SERVER_UDS, limits=limits)}
+    return httpx.AsyncClient(
+        limits=limits, http2=http2, timeout=config.AI_REQUEST_TIMEOUT, mounts=mounts
+    )
+
+
+async def open_client() -> None:
+    """Create the shared HTTP client (called on application startup)."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+
+
+async def close_client() -> None:
+    """Close the shared HTTP client and its pooled connections."""
+    global _client
+    client, _client = _client, None
+    if client is not None:
+        await client.aclose()
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it lazily outside the app lifespan."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+def _pool_connections(transport: object) -> list[Any]:
+    # httpx does not expose its pool publicly; read it from the httpcore transport.
+    pool = getattr(transport, "_pool", None)
+    return list(getattr(pool, "connections", []) or [])
+
+
+def pool_stats() -> dict[str, object]:
+    """Return utilization figures for the shared connection pools.
+
+    With ``AI_SERVER_UDS`` the local AI server is reached through a mounted
+    socket transport with its own pool; the totals cover both, and
+    ``transports`` breaks them down.
+    """
+    transports: dict[str, object] = {}
+    if _client is not None:
+        transports["default"] = getattr(_client, "_transport", None)
+        for pattern, transport in (getattr(_client, "_mounts", None) or {}).items():
+            if transport is not None:
+                transports[pattern.pattern] = transport
+    breakdown = {}
+    for name, transport in transports.items():
+        connections = _pool_connections(transport)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        breakdown[name] = {"connections": len(connections), "idle_connections": idle}
+    total = sum(entry["connections"] for entry in breakdown.values())
+    idle = sum(entry["idle_connections"] for entry in breakdown.values())
+    return {
+        "open": _client is not None,
+        "http2": _http2_enabled,
+        "max_connections": config.AI_HTTP_MAX_CONNECTIONS,
+        "max_keepalive_connections": config.AI_HTTP_MAX_KEEPALIVE,
+        "connections": total,
+        "active_connections": total - idle,
+        "idle_connections": idle,
+        "transports": breakdown,
+        "requests_in_flight": _requests_in_flight,
+        "requests_total": _requests_total,
+        "uds": config.AI_SERVER_UDS or None,
+        "shm_requests": _shm_requests,
+        "shm_bytes": _shm_bytes,
+    }
+
+
+async def _send(method: str, url: str, **kwargs) -> httpx.Response:
+    global _requests_total, _requests_in_flight
+    _requests_total += 1
+    _requests_in_flight += 1
+    try:
+        return await get_client().request(method, url, **kwargs)
+    finally:
+        _requests_in_flight -= 1
+
+
+def _is_local(replica: ai_routing.Replica) -> bool:
+    return bool(config.AI_SERVER_UDS) and replica.url == config.AI_SERVER_URL.rstrip("/")
+
+
+@contextmanager
+def _shared_memory_files(
+    replica: ai_routing.Replica, kwargs: dict[str, Any]
+) -> Iterator[dict[str, Any]]:
+    """Replace a large uploaded file by a shared-memory handle for the local AI server.
+
+    The segment lives only for the duration of the request: the AI server
+    maps it read-only, and it is unlinked here once the response is in.
+    """
+    files = kwargs.get("files") or {}
+    spec = files.get("file")
+    content = spec[1] if isinstance(spec, tuple) else None
+    if (
+        not config.AI_SHM
+        or len(files) != 1
+        or not isinstance(content, bytes)
+        or len(content) < config.AI_SHM_MIN_BYTES
+        or not _is_local(replica)
+    ):
+        yield kwargs
+        return
+
+    global _shm_requests, _shm_bytes
+    segment = shared_memory.SharedMemory(create=True, size=len(content))
+    try:
+        segment.buf[: len(content)] = content
+        _shm_requests += 1
+        _shm_bytes += len(content)
+        data = {**(kwargs.get("data") or {}), "shm": segment.name, "shm_size": str(len(content))}
+        yield {**{key: value for key, value in kwargs.items() if key != "files"}, "data": data}
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+async def _post_replica(
+    pool: ai_routing.ReplicaPool,
+    replica: ai_routing.Replica,
+    path: str,
+    **kwargs,
+) -> httpx.Response:
+    """POST to one replica, feeding the outcome into its passive health state."""
+    remaining = remaining_budget()
+    headers = dict(kwargs.pop("headers", None) or {})
+    headers[BUDGET_HEADER] = str(int(remaining * 1000))
+    started = time.monotonic()
+    with pool.track(replica), _shared_memory_files(replica, kwargs) as request_kwargs:
+        try:
+            response = await _send(
+                "POST",
+                f"{replica.url}{path}",
+                headers=headers,
+                timeout=remaining,
+                **request_kwargs,
+            )
+        except httpx.TimeoutException as exc:
+            pool.record_failure(replica)
+            raise UpstreamDeadlineExceeded("AI request deadline exceeded") from exc
+        except httpx.RequestError:
+            pool.record_failure(replica)
+            raise
+    if response.status_code >= 500:
+        pool.record_failure(replica)
+    else:
+        pool.record_success(replica, time.monotonic() - started)
+    if response.status_code == 504:
+        raise UpstreamDeadlineExceeded("AI server dropped the request after its deadline")
+    response.raise_for_status()
+    return response
+
+
+# --- Single-flight coalescing ----------------------------------------------
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Future
+    waiters: int = 0
+
+
+_flights: dict[str, _Flight] = {}
+_flight_calls = 0
+_flight_coalesced = 0
+
+
+def _request_key(method: str, target: str, kwargs: dict[str, Any]) -> str:
+    """Hash everything that determines the upstream response (not the headers)."""
+    digest = hashlib.sha256(f"{method} {target}".encode())
+    if "json" in kwargs:
+        digest.update(json.dumps(kwargs["json"], sort_keys=True, ensure_ascii=False).encode())
+    for name, value in sorted((kwargs.get("data") or {}).items()):
+        digest.update(f"\0{name}={value}".encode())
+    for name, spec in sorted((kwargs.get("files") or {}).items()):
+        content = spec[1] if isinstance(spec, tuple) else spec
+        digest.update(f"\0{name}:".encode())
+        digest.update(content if isinstance(content, bytes) else str(content).encode())
+    return digest.hexdigest()
+
 
-    faces_response = await detect_faces_from_image_content(image_content)
+async def _single_flight(key: str, factory: Callable[[], Awaitable[T]]) -> T:
+    """Share one upstream call between all concurrent callers with the same key.
 
+    The upstream call is cancelled only when every caller waiting on it has
+    gone away, so one client disconnecting does not fail the others.
+    """
+    global _flight_calls, _flight_coalesced
+    _flight_calls += 1
+    flight = _flights.get(key)
+    if flight is None:
+        flight = _Flight(task=asyncio.ensure_future(factory()))
+        _flights[key] = flight
+
+        def _forget(_: asyncio.Future, flight: _Flight = flight) -> None:
+            if _flights.get(key) is flight:
+                del _flights[key]
+
+        flight.task.add_done_callback(_forget)
+    else:
+        _flight_coalesced += 1
+
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            flight.task.cancel()
+
+
+def singleflight_stats() -> dict[str, object]:
+    """Return how many AI calls were served by an already in-flight request."""
+    return {
+        "calls": _flight_calls,
+        "coalesced": _flight_coalesced,
+        "upstream": _flight_calls - _flight_coalesced,
+        "dedup_ratio": round(_flight_coalesced / _flight_calls, 3) if _flight_calls else 0.0,
+        "in_flight": len(_flights),
+    }
+
+
+async def _post_with_failover(
+    pool: ai_routing.ReplicaPool,
+    replica: ai_routing.Replica,
+    path: str,
+    **kwargs,
+) -> httpx.Response:
+    """POST to *replica*, retrying once elsewhere if it could not even connect."""
+    try:
+        return await _post_replica(pool, replica, path, **kwargs)
+    except httpx.ConnectError:
+        if len(pool.replicas) < 2:
+            raise
+        return await _post_replica(pool, pool.pick(exclude=[replica]), path, **kwargs)
+
+
+async def _post_hedged(endpoint: ai_routing.Endpoint, path: str, **kwargs) -> httpx.Response:
+    """Send the request and, if it outlives the hedge delay, a duplicate to another replica.
+
+    The first successful response wins and the other request is cancelled.
+    """
+    pool = ai_routing.pool_for_path(path)
+    replica = pool.pick()
+    primary = asyncio.ensure_future(_post_with_failover(pool, replica, path, **kwargs))
+    delay = endpoint.hedge_delay() if len(pool.replicas) > 1 else None
+    if delay is None:
+        return await primary
+
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge = asyncio.ensure_future(
+            _post_replica(pool, pool.pick(exclude=[replica]), path, **kwargs)
+        )
+        endpoint.hedges_sent += 1
+        pending.add(hedge)
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        endpoint.hedges_won += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _post_ai(path: str, **kwargs) -> httpx.Response:
+    """POST to the AI server, sharing identical concurrent requests."""
+    key = _request_key("POST", path, kwargs)
+    return await _single_flight(key, lambda: _post_ai_uncoalesced(path, **kwargs))
+
+
+async def _download(url: str) -> bytes:
+    """Download an image through the shared pool, sharing concurrent identical fetches."""
+
+    async def fetch() -> bytes:
+        response = await _send(
+            "GET",
+            url,
+            follow_redirects=True,
+            timeout=min(10.0, remaining_budget()),
+        )
+        response.raise_for_status()
+        return response.content
+
+    return await _single_flight(_request_key("GET", url, {}), fetch)
+
+
+async def _post_ai_uncoalesced(path: str, **kwargs) -> httpx.Response:
+    """POST to the AI server through the endpoint's circuit breaker.
+
+    Raises :class:`ai_routing.CircuitOpen` without any network traffic while
+    the endpoint's circuit is open. A budget that ran out before the request
+    was sent says nothing about the server, so it releases the reservation
+    instead of counting as a failure.
+    """
+    endpoint = ai_routing.get_endpoint(path)
+    breaker = endpoint.breaker
+    breaker.before_call()
+    started = time.monotonic()
+    recorded = False
+    try:
+        response = await _post_hedged(endpoint, path, **kwargs)
+    except httpx.HTTPStatusError as exc:
+        if exc.response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success(time.monotonic() - started)
+        recorded = True
+        raise
+    except (httpx.RequestError, UpstreamDeadlineExceeded):
+        breaker.record_failure()
+        recorded = True
+        raise
+    else:
+        elapsed = time.monotonic() - started
+        breaker.record_success(elapsed)
+        endpoint.latencies.append(elapsed)
+        recorded = True
+        return response
+    finally:
+        if not recorded:
+            breaker.abandon()
+
+
+# --- Image preprocessing ---------------------------------------------------
+
+
+_image_uploads = 0
+_image_raw_bytes = 0
+_image_sent_bytes = 0
+_match_latencies: deque[float] = deque(maxlen=500)
+
+
+def _count_upload(raw_size: int, sent_size: int) -> None:
+    global _image_uploads, _image_raw_bytes, _image_sent_bytes
+    _image_uploads += 1
+    _image_raw_bytes += raw_size
+    _image_sent_bytes += sent_size
+
+
+def record_match_latency(elapsed: float) -> None:
+    """Record the end-to-end latency of one face-match request."""
+    _match_latencies.append(elapsed)
+
+
+def image_stats() -> dict[str, object]:
+    """Return bytes sent to the AI server against the raw upload sizes."""
+    ordered = sorted(_match_latencies)
+
+    def _percentile(p: float) -> float | None:
+        if not ordered:
+            return None
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 1)
+
+    return {
+        "uploads": _image_uploads,
+        "raw_bytes": _image_raw_bytes,
+        "sent_bytes": _image_sent_bytes,
+        "wire_ratio": round(_image_sent_bytes / _image_raw_bytes, 3) if _image_raw_bytes else None,
+        "match_p50_ms": _percentile(0.5),
+        "match_p95_ms": _percentile(0.95),
+    }
+
+
+async def _prepare(image_content: bytes) -> images.PreparedImage | None:
+    return await asyncio.to_thread(
+        images.prepare_for_detection,
+        image_content,
+        max_side=config.AI_IMAGE_MAX_SIDE,
+        quality=config.AI_IMAGE_JPEG_QUALITY,
+    )
+
+
+async def _detect_prepared(
+    image_content: bytes, prepared: images.PreparedImage | None
+) -> list[dict]:
+    """Detect faces on the downscaled copy and return boxes in original pixels."""
+    payload = prepared.payload if prepared is not None else image_content
+    _count_upload(len(image_content), len(payload))
+    files = {"file": ("image.jpg", payload, "image/jpeg")}
+    response = await _post_ai("/detect-faces", files=files)
+    faces = response.json()["faces"]
+    if prepared is None or prepared.scale == 1.0:
+        return faces
+    return [
+        {**face, "box": images.scale_box(face["box"], prepared.scale, prepared.size)}
+        for face in faces
+    ]
+
+
+async def _embed_largest_face(
+    image_content: bytes,
+    filename: str | None = "image.jpg",
+    content_type: str | None = "image/jpeg",
+) -> list[float] | None:
+    """Decode once, detect on a downscaled copy and embed a crop of the largest face."""
+    prepared = await _prepare(image_content)
+    faces_response = await _detect_prepared(image_content, prepared)
     if not faces_response:
         return None
 
@@ -23,28 +516,55 @@ async def generate_embedding_from_image(file: UploadFile) -> list[float] | None:
     largest_face = max(faces_response, key=lambda f: f['box'][2] * f['box'][3])
     box = largest_face['box']
 
-    async with httpx.AsyncClient() as client:
-        import json
-        files = {"file": (file.filename, image_content, file.content_type)}
+    if prepared is None:
+        # デコードできない形式はAIサーバーに元画像ごと任せる
+        files = {"file": (filename, image_content, content_type)}
         data = {"box": json.dumps(box)}
+        _count_upload(len(image_content), len(image_content))
+    else:
+        # 顔部分だけを切り出して送る (DINOv2 は短辺 256px にリサイズするため、それ以上は不要)
+        crop = await asyncio.to_thread(
+            images.encode_crop,
+            prepared.image,
+            box,
+            short_side=config.AI_EMBED_CROP_SIDE,
+            quality=config.AI_IMAGE_JPEG_QUALITY,
+        )
+        files = {"file": ("face.jpg", crop, "image/jpeg")}
+        data = {}
+        _count_upload(len(image_content), len(crop))
+
+    response = await _post_ai("/embedding", files=files, data=data)
+    return response.json()["embedding"]
+
+
+async def generate_embedding_from_image(file: UploadFile) -> list[float] | None:
+    """Detects faces in an image and generates an embedding for the largest face."""
+    # aiohttpやstarletteのUploadFileはseekが必要
+    await file.seek(0)
+    image_content = await file.read()
+    await file.seek(0) # 他の処理で再利用するためにポインタを戻す
+
+    with request_deadline():
         try:
-            response = await client.post(f"{config.AI_SERVER_URL}/embedding", files=files, data=data, timeout=60.0)
-            response.raise_for_status()
-            return response.json()["embedding"]
+            return await _embed_largest_face(image_content, file.filename, file.content_type)
         except httpx.RequestError as exc:
             raise RuntimeError(f"Error connecting to AI server: {exc}") from exc
 
 
 async def get_ai_proposal_suggestion(prompt: str) -> dict:
     """Gets a proposal suggestion from the AI server."""
-    async with httpx.AsyncClient() as client:
+    with request_deadline():
         try:
-            response = await client.post(
-                f"{config.AI_SERVER_URL}/generate-proposal",
-                json={"prompt": prompt},
-                timeout=60.0
+            # タイトル以外は使わないため、タイトルだけを予算内で生成させる
+            response = await _post_ai(
+                "/generate-proposal",
+                json={
+                    "prompt": prompt,
+                    "title_only": True,
+                    "latency_budget_ms": config.AI_TITLE_BUDGET_MS,
+                },
             )
-            response.raise_for_status()
             ai_result = response.json()
 
             # AIからの応答をバックエンドの形式に変換
@@ -55,64 +575,36 @@ async def get_ai_proposal_suggestion(prompt: str) -> dict:
                 "event_date": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
                 "location": "オンライン",
                 "participant_ids": [], # 参加者は別途決定する必要がある
+                "source": ai_result.get("source", "model"),
             }
         except httpx.RequestError as exc:
             raise RuntimeError(f"Error connecting to AI server: {exc}") from exc
 
 
 async def detect_faces_from_image_content(image_content: bytes) -> list[dict]:
-    """Sends image content to the AI server to detect faces."""
-    async with httpx.AsyncClient() as client:
-        files = {"file": ("image.jpg", image_content, "image/jpeg")}
-        try:
-            response = await client.post(f"{config.AI_SERVER_URL}/detect-faces", files=files, timeout=60.0)
-            response.raise_for_status()
-            return response.json()["faces"]
-        except httpx.RequestError:
-            return []
+    """Sends image content to the AI server to detect faces.
+
+    Boxes are returned in the coordinates of the (EXIF-upright) original image.
+    """
+    try:
+        return await _detect_prepared(image_content, await _prepare(image_content))
+    except (httpx.RequestError, DeadlineExceeded, ai_routing.CircuitOpen):
+        return []
 
 
 async def generate_embedding_from_url(image_url: str) -> list[float] | None:
     """Downloads an image, detects the largest face, and generates an embedding for it."""
-    async with httpx.AsyncClient() as client:
+    with request_deadline():
         try:
-            # 1. Download image
-            download_response = await client.get(image_url, follow_redirects=True, timeout=10.0)
-            download_response.raise_for_status()
-            image_content = await download_response.aread()
-
-            # 2. Detect faces
-            faces_response = await detect_faces_from_image_content(image_content)
-            if not faces_response:
-                return None
-
-            # 3. Get embedding for the largest face
-            largest_face = max(faces_response, key=lambda f: f['box'][2] * f['box'][3])
-            box = largest_face['box']
-
-            import json
-            files = {"file": ("image.jpg", image_content, "image/jpeg")}
-            data = {"box": json.dumps(box)}
-            
-            embedding_response = await client.post(f"{config.AI_SERVER_URL}/embedding", files=files, data=data, timeout=60.0)
-            embedding_response.raise_for_status()
-            return embedding_response.json()["embedding"]
-
-        except httpx.RequestError:
+            digest = assets.digest_from_url(image_url)
+            if digest is not None:
+                # Our own uploads are read straight from the asset store.
+                image_content = await asyncio.to_thread(assets.read_bytes, digest)
+            else:
+                image_content = await _download(image_url)
+            return await _embed_largest_face(image_content)
+        except FileNotFoundError:
+            logger.warning("Asset %s is missing from the store.", image_url)
+            return None
+        except (httpx.RequestError, DeadlineExceeded, ai_routing.CircuitOpen):
             return None
-
-
-async def upload_image(file: UploadFile) -> str:
-    """Uploads an image and returns its URL."""
-    # In a real application, this would upload the file to a cloud storage
-    # and return the URL. For now, we'll just return a dummy path.
-    # To prevent overwriting, you might use a unique filename:
-    # import uuid
-    # filename = f"{uuid.uuid4()}.{file.filename.split('.')[-1] if '.' in file.filename else 'png'}"
-    # save_path = f"/assets/images/{filename}"
-    # with open(save_path, "wb") as buffer:
-    #     buffer.write(await file.read())
-    # return save_path
-
-    # For this prototype, we return a fixed path.
-    return f"/assets/images/{file.filename}"
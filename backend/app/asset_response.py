@@ -0,0 +1,200 @@
+"""HTTP response for content-addressed assets.
+
+Stored files never change, so the content digest doubles as a strong ETag and
+responses may be cached forever. The body is sent with the ASGI
+``http.response.zerocopysend`` / ``http.response.pathsend`` extensions when
+the server offers them (sendfile under the hood) and read in chunks otherwise.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Mapping
+
+import anyio
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+PATHSEND_EXTENSION = "http.response.pathsend"
+
+
+def etag_for(sha256: str) -> str:
+    return f'"{sha256}"'
+
+
+def cache_headers(etag: str) -> dict[str, str]:
+    return {"etag": etag, "cache-control": IMMUTABLE_CACHE_CONTROL}
+
+
+def content_headers(*, inline: bool) -> dict[str, str]:
+    """Stop browsers from sniffing a type other than the one served.
+
+    Only types the server vouches for are shown inline; anything else is
+    offered as a download.
+    """
+    return {
+        "x-content-type-options": "nosniff",
+        "content-disposition": "inline" if inline else "attachment",
+    }
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Return True if an ``If-None-Match`` header matches *etag*."""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or any(
+        value.removeprefix("W/") == etag for value in candidates
+    )
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Parse a single ``bytes=`` range into an inclusive ``(start, end)`` pair.
+
+    Returns None when the header is absent or not a single byte range, in
+    which case the whole file is served. Raises ValueError when the range
+    cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+    first, last = (part.strip() for part in spec.split("-", 1))
+    if (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    end = int(last) if last else size - 1
+    return start, min(end, size - 1)
+
+
+class AssetFileResponse(Response):
+    """Serve part or all of a stored file."""
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: str | os.PathLike[str],
+        *,
+        size: int,
+        etag: str,
+        media_type: str,
+        byte_range: tuple[int, int] | None = None,
+        headers: Mapping[str, str] | None = None,
+    ) -> None:
+        self.path = path
+        self.background = None
+        self.media_type = media_type
+        if byte_range is None:
+            self.status_code = 200
+            self.offset, self.count = 0, size
+        else:
+            start, end = byte_range
+            self.status_code = 206
+            self.offset, self.count = start, end - start + 1
+        self.init_headers(
+            {
+                **(headers or {}),
+                **cache_headers(etag),
+                "accept-ranges": "bytes",
+                "content-length": str(self.count),
+            }
+        )
+        if byte_range is not None:
+            self.headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers}
+        )
+        if scope["method"].upper() == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if ZEROCOPY_EXTENSION in extensions:
+            with open(self.path, "rb") as file:
+                await send(
+                    {
+                        "type": ZEROCOPY_EXTENSION,
+                        "file": file,
+                        "offset": self.offset,
+                        "count": self.count,
+                        "more_body": False,
+                    }
+                )
+            return
+        if PATHSEND_EXTENSION in extensions and self.status_code == 200:
+            await send({"type": PATHSEND_EXTENSION, "path": os.fspath(self.path)})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.offset)
+            remaining = self.count
+            while remaining:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": remaining > 0}
+                )
+            if remaining:
+                # The file shrank underneath us; close the body we promised.
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def serve(
+    request: Request,
+    path: Path,
+    *,
+    etag: str,
+    media_type: str,
+    headers: Mapping[str, str] | None = None,
+) -> Response:
+    """Answer a GET/HEAD for an immutable file: 304, 416, 206 or 200.
+
+    Raises FileNotFoundError if *path* does not exist.
+    """
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+
+    size = (await anyio.to_thread.run_sync(path.stat)).st_size
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(
+                status_code=416,
+                headers={**cache_headers(etag), "content-range": f"bytes */{size}"},
+            )
+    return AssetFileResponse(
+        path,
+        size=size,
+        etag=etag,
+        media_type=media_type,
+        byte_range=byte_range,
+        headers=headers,
+    )
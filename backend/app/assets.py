@@ -0,0 +1,149 @@
+"""Content-addressed storage for uploaded images.
+
+Files are stored once per SHA-256 digest under a two-level fan-out
+(``ab/cd/abcd…``) below ``ASSET_STORAGE_DIR``. Uploads are copied to disk in
+fixed-size chunks while being hashed, so memory use does not depend on the
+file size, and identical uploads share one file.
+
+The content type is sniffed from the stored bytes, never taken from the
+client: only raster images are served as images, and everything else as
+``application/octet-stream``, so an uploaded HTML or SVG file cannot run
+script on the API's origin.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from fastapi import UploadFile
+from PIL import Image, UnidentifiedImageError
+
+from . import config
+
+
+ASSET_URL_PREFIX = "/assets/images/"
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+# Pillow format -> content type of the image types served inline.
+RASTER_FORMATS = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif",
+}
+RASTER_CONTENT_TYPES = frozenset(RASTER_FORMATS.values())
+
+
+class AssetTooLarge(ValueError):
+    """Raised when an upload exceeds ``ASSET_MAX_BYTES``."""
+
+
+@dataclass(frozen=True)
+class StoredAsset:
+    """A file in the asset store, addressed by the SHA-256 of its content."""
+
+    sha256: str
+    content_type: str
+    size: int
+
+    @property
+    def storage_key(self) -> str:
+        return storage_key(self.sha256)
+
+    @property
+    def url(self) -> str:
+        return f"{ASSET_URL_PREFIX}{self.sha256}"
+
+
+def storage_root() -> Path:
+    return Path(config.ASSET_STORAGE_DIR)
+
+
+def storage_key(sha256: str) -> str:
+    """Return the fan-out key (``ab/cd/<digest>``) of a content digest."""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def path_for(sha256: str) -> Path:
+    return storage_root() / storage_key(sha256)
+
+
+def digest_from_url(url: str | None) -> str | None:
+    """Return the digest of a local asset URL, or None for any other URL."""
+    if not url or not url.startswith(ASSET_URL_PREFIX):
+        return None
+    digest = url[len(ASSET_URL_PREFIX):]
+    if len(digest) != 64 or any(char not in "0123456789abcdef" for char in digest):
+        return None
+    return digest
+
+
+def sniff_content_type(path: str | os.PathLike[str]) -> str:
+    """Return the content type of a stored raster image, or the octet-stream default."""
+    try:
+        with Image.open(path) as image:
+            return RASTER_FORMATS.get(image.format or "", DEFAULT_CONTENT_TYPE)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return DEFAULT_CONTENT_TYPE
+
+
+def store_stream(source: BinaryIO) -> StoredAsset:
+    """Copy *source* into the store chunk by chunk and return the stored asset.
+
+    The data is written to a temporary file next to its final location and
+    moved into place atomically, so readers never see a partial file. If the
+    digest is already stored the temporary copy is discarded.
+    """
+    root = storage_root()
+    staging = root / ".incoming"
+    staging.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_name = tempfile.mkstemp(dir=staging)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := source.read(config.ASSET_CHUNK_SIZE):
+                size += len(chunk)
+                if size > config.ASSET_MAX_BYTES:
+                    raise AssetTooLarge(
+                        f"Upload exceeds the {config.ASSET_MAX_BYTES}-byte limit."
+                    )
+                digest.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+
+        stored = StoredAsset(
+            sha256=digest.hexdigest(),
+            content_type=sniff_content_type(temp_name),
+            size=size,
+        )
+        target = path_for(stored.sha256)
+        if target.exists():
+            os.unlink(temp_name)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(temp_name, target)
+        return stored
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+
+
+async def save_upload(file: UploadFile) -> StoredAsset:
+    """Store an uploaded file without holding it in memory or blocking the loop."""
+    await file.seek(0)
+    stored = await asyncio.to_thread(store_stream, file.file)
+    await file.seek(0)
+    return stored
+
+
+def read_bytes(sha256: str) -> bytes:
+    """Return the content of a stored asset."""
+    return path_for(sha256).read_bytes()
@@ -0,0 +1,82 @@
+"""Data backfills run once at application startup.
+
+Columns that db._upgrade_schema adds to existing tables start out NULL, or at
+their server default, on rows written before they existed. Each backfill here
+fills such rows from the source tables and is a no-op once they are filled, so
+running it on every start is cheap. The work runs in the
+background; until it finishes, old rows look as they did before.
+
+``chat_members.unread_count`` starts at 0 on existing memberships, and a
+zero is not distinguishable from a counter that was never filled, so the
+counters are recounted from chat_messages on every start instead. With
+``JOBS_ENABLED`` that is a job for the worker (a single queued job however
+many API processes start), otherwise it runs here.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from . import config, db, jobs
+
+
+logger = logging.getLogger(__name__)
+
+_task: asyncio.Task | None = None
+
+
+def _fill_chat_group_last_messages() -> int:
+    session = db.SessionLocal()
+    try:
+        return db.backfill_chat_group_last_messages(session)
+    finally:
+        session.close()
+
+
+def _repair_unread_counts() -> int:
+    session = db.SessionLocal()
+    try:
+        return db.repair_unread_counts(session)
+    finally:
+        session.close()
+
+
+async def run() -> None:
+    """Run every backfill; failures are logged and retried on the next start."""
+    try:
+        filled = await asyncio.to_thread(_fill_chat_group_last_messages)
+        if filled:
+            logger.info("Backfilled the last message of %s chat groups", filled)
+    except Exception:
+        logger.exception("Backfilling chat group last messages failed")
+
+    try:
+        if config.JOBS_ENABLED:
+            await asyncio.to_thread(
+                jobs.submit,
+                "chat.repair_unread_counts",
+                {},
+                dedup_key="chat.repair_unread_counts",
+            )
+        else:
+            repaired = await asyncio.to_thread(_repair_unread_counts)
+            if repaired:
+                logger.info("Repaired %s unread counters", repaired)
+    except Exception:
+        logger.exception("Repairing unread counters failed")
+
+
+def start() -> None:
+    """Start the backfills in the background (called on application startup)."""
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.ensure_future(run())
+
+
+async def stop() -> None:
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
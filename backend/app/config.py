@@ -20,6 +20,26 @@ def _bool_env(name: str, default: bool = False) -> bool:
     return value.lower() in {"1", "true", "yes", "on"}
 
 
+def _float_env(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        return default
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
 def _clean_env(name: str) -> Optional[str]:
     value = os.getenv(name)
     if value is None:
@@ -28,6 +48,13 @@ def _clean_env(name: str) -> Optional[str]:
     return stripped or None
 
 
+def _list_env(name: str) -> list[str]:
+    value = _clean_env(name)
+    if value is None:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
 def _build_database_url() -> str:
     explicit_url = _clean_env("DATABASE_URL")
     if explicit_url:
@@ -80,4 +107,102 @@ DATABASE_URL = _build_database_url()
 DATABASE_ECHO = _bool_env("DATABASE_ECHO", default=False)
 
 
+# Content-addressed store for uploaded images (see app/assets.py).
+ASSET_STORAGE_DIR = _clean_env("ASSET_STORAGE_DIR") or str(
+    Path(__file__).resolve().parent.parent / "data" / "assets"
+)
+ASSET_CHUNK_SIZE = _int_env("ASSET_CHUNK_SIZE", 1024 * 1024)
+ASSET_MAX_BYTES = _int_env("ASSET_MAX_BYTES", 20 * 1024 * 1024)
+# Thumbnails (long side in pixels) rendered as JPEG and WebP for each stored
+# image; the smallest size is the one returned in album and chat responses.
+THUMBNAIL_SIZES = sorted({int(size) for size in _list_env("THUMBNAIL_SIZES")} or {256, 768})
+THUMBNAIL_WORKERS = _int_env("THUMBNAIL_WORKERS", 0)
+THUMBNAIL_JPEG_QUALITY = _int_env("THUMBNAIL_JPEG_QUALITY", 80)
+THUMBNAIL_WEBP_QUALITY = _int_env("THUMBNAIL_WEBP_QUALITY", 75)
+# Album photo ingestion: threads reading EXIF headers, and the UTC offset
+# assumed for capture times that carry no OffsetTime tag.
+EXIF_WORKERS = _int_env("EXIF_WORKERS", 8)
+PHOTO_DEFAULT_UTC_OFFSET = _clean_env("PHOTO_DEFAULT_UTC_OFFSET") or "+09:00"
+
+
 AI_SERVER_URL = _clean_env("AI_SERVER_URL") or "http://localhost:8000"
+# Replica lists (comma separated). Detection replicas serve /detect-faces and
+# /embedding, generation replicas serve /generate-proposal; both fall back to
+# AI_SERVER_URLS, which itself defaults to AI_SERVER_URL.
+AI_SERVER_URLS = _list_env("AI_SERVER_URLS") or [AI_SERVER_URL]
+AI_DETECTION_SERVER_URLS = _list_env("AI_DETECTION_SERVER_URLS")
+AI_GENERATION_SERVER_URLS = _list_env("AI_GENERATION_SERVER_URLS")
+AI_REPLICA_MAX_FAILURES = _int_env("AI_REPLICA_MAX_FAILURES", 3)
+AI_REPLICA_EJECTION_SECONDS = _float_env("AI_REPLICA_EJECTION_SECONDS", 30.0)
+AI_REPLICA_SLOW_SECONDS = _float_env("AI_REPLICA_SLOW_SECONDS", 10.0)
+
+# Per-endpoint circuit breaker.
+AI_BREAKER_WINDOW = _int_env("AI_BREAKER_WINDOW", 20)
+AI_BREAKER_MIN_CALLS = _int_env("AI_BREAKER_MIN_CALLS", 10)
+AI_BREAKER_FAILURE_RATE = _float_env("AI_BREAKER_FAILURE_RATE", 0.5)
+AI_BREAKER_SLOW_SECONDS = _float_env("AI_BREAKER_SLOW_SECONDS", 10.0)
+AI_BREAKER_SLOW_RATE = _float_env("AI_BREAKER_SLOW_RATE", 0.5)
+AI_BREAKER_OPEN_SECONDS = _float_env("AI_BREAKER_OPEN_SECONDS", 30.0)
+
+# Hedged requests: paths listed here get a duplicate request to another
+# replica once the primary is slower than the configured latency percentile.
+AI_HEDGE_ENDPOINTS = _list_env("AI_HEDGE_ENDPOINTS")
+AI_HEDGE_PERCENTILE = _float_env("AI_HEDGE_PERCENTILE", 95.0)
+AI_HEDGE_MIN_SAMPLES = _int_env("AI_HEDGE_MIN_SAMPLES", 20)
+AI_HEDGE_MIN_DELAY = _float_env("AI_HEDGE_MIN_DELAY", 0.05)
+
+# Total time budget for the AI-server work done on behalf of one API request.
+AI_REQUEST_TIMEOUT = _float_env("AI_REQUEST_TIMEOUT", 60.0)
+# Latency budget for AI proposal titles before the AI server falls back to templates.
+AI_TITLE_BUDGET_MS = _int_env("AI_TITLE_BUDGET_MS", 1500)
+# Precomputed AI proposal suggestions: stored suggestions older than the TTL
+# are still served but regenerated in the background. The producer wakes up
+# every interval (0 disables it) and refreshes up to a batch of users.
+AI_SUGGESTION_TTL_SECONDS = _float_env("AI_SUGGESTION_TTL_SECONDS", 6 * 3600.0)
+AI_SUGGESTION_PRODUCER_INTERVAL = _float_env("AI_SUGGESTION_PRODUCER_INTERVAL", 60.0)
+AI_SUGGESTION_BATCH = _int_env("AI_SUGGESTION_BATCH", 50)
+AI_SUGGESTION_CONCURRENCY = _int_env("AI_SUGGESTION_CONCURRENCY", 4)
+AI_SUGGESTION_HISTORY = _int_env("AI_SUGGESTION_HISTORY", 3)
+
+# Per-user cache of /api/notification counts. Entries are invalidated by the
+# writes that change them; the TTL covers writes made by other processes.
+NOTIFICATION_CACHE_TTL = _float_env("NOTIFICATION_CACHE_TTL", 30.0)
+NOTIFICATION_CACHE_MAX_ENTRIES = _int_env("NOTIFICATION_CACHE_MAX_ENTRIES", 100_000)
+
+# In-process typeahead index of users for friend search (see typeahead.py),
+# loaded at startup. Each caller's friends / friends-of-friends are cached for
+# TYPEAHEAD_PROXIMITY_TTL seconds.
+TYPEAHEAD_ENABLED = _bool_env("TYPEAHEAD_ENABLED", default=True)
+TYPEAHEAD_PROXIMITY_TTL = _float_env("TYPEAHEAD_PROXIMITY_TTL", 60.0)
+TYPEAHEAD_PROXIMITY_MAX_ENTRIES = _int_env("TYPEAHEAD_PROXIMITY_MAX_ENTRIES", 10_000)
+
+# Database-backed job queue (see jobs.py). With JOBS_ENABLED, thumbnails and
+# suggestion refreshes are enqueued for `python -m backend.app.worker` instead
+# of running inside the API process. JOB_QUEUES maps queue names to the number
+# of jobs one worker runs at once ("ai:2,thumbnails:2").
+JOBS_ENABLED = _bool_env("JOBS_ENABLED", default=False)
+JOB_QUEUES = _list_env("JOB_QUEUES") or ["ai:2", "thumbnails:2", "default:4"]
+JOB_POLL_INTERVAL = _float_env("JOB_POLL_INTERVAL", 1.0)
+JOB_LEASE_SECONDS = _float_env("JOB_LEASE_SECONDS", 60.0)
+JOB_MAX_ATTEMPTS = _int_env("JOB_MAX_ATTEMPTS", 5)
+JOB_RETRY_BASE_SECONDS = _float_env("JOB_RETRY_BASE_SECONDS", 5.0)
+JOB_RETRY_MAX_SECONDS = _float_env("JOB_RETRY_MAX_SECONDS", 600.0)
+JOB_RETENTION_SECONDS = _float_env("JOB_RETENTION_SECONDS", 86400.0)
+
+# Images are downscaled before detection and only the face crop is sent for embedding.
+AI_IMAGE_MAX_SIDE = _int_env("AI_IMAGE_MAX_SIDE", 640)
+AI_IMAGE_JPEG_QUALITY = _int_env("AI_IMAGE_JPEG_QUALITY", 85)
+AI_EMBED_CROP_SIDE = _int_env("AI_EMBED_CROP_SIDE", 256)
+
+# Connection pool shared by every backend -> AI server request and image download.
+AI_HTTP_MAX_CONNECTIONS = _int_env("AI_HTTP_MAX_CONNECTIONS", 100)
+AI_HTTP_MAX_KEEPALIVE = _int_env("AI_HTTP_MAX_KEEPALIVE", 20)
+AI_HTTP_KEEPALIVE_EXPIRY = _float_env("AI_HTTP_KEEPALIVE_EXPIRY", 30.0)
+AI_HTTP2 = _bool_env("AI_HTTP2", default=False)
+
+# Co-located AI server: requests to AI_SERVER_URL go over this Unix domain
+# socket, and image payloads of at least AI_SHM_MIN_BYTES are handed over
+# through shared memory instead of being multipart-encoded.
+AI_SERVER_UDS = _clean_env("AI_SERVER_UDS")
+AI_SHM = _bool_env("AI_SHM", default=True)
+AI_SHM_MIN_BYTES = _int_env("AI_SHM_MIN_BYTES", 64 * 1024)
@@ -3,37 +3,64 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
 import os
 from dataclasses import dataclass, field
-from itertools import combinations
 from datetime import date, datetime, timedelta, timezone
 import secrets
+import sqlite3
 from pathlib import Path
-from typing import Iterable, Iterator, List, Sequence
+from typing import Iterable, Iterator, List, Mapping, Sequence
 
 import numpy as np
 from sqlalchemy import (
+    DDL,
     JSON,
     Date,
     DateTime,
     ForeignKey,
+    Index,
     Integer,
     String,
     Text,
+    and_,
+    column,
     create_engine,
     delete,
+    event,
+    exists,
     func,
+    insert,
+    literal,
+    literal_column,
     or_,
     select,
+    table,
+    union,
+    update,
 )
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateColumn
 from sqlalchemy import inspect
 from sqlalchemy.orm import DeclarativeBase, Mapped, Session, aliased, mapped_column, sessionmaker
 
-from . import ai_service
+from . import ai_service, notification_cache, typeahead
+from .assets import StoredAsset
+from .exif import PhotoMetadata
 from .config import DATABASE_ECHO, DATABASE_URL
 
 
+# Characters of the newest message kept on chat_groupes for the chat list.
+CHAT_PREVIEW_LENGTH = 200
+
+# Initiating users per befriend_all_users statement (and transaction).
+BEFRIEND_CHUNK_USERS = 200
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE.
+_UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
 class Base(DeclarativeBase):
     """Base class for ORM models."""
 
@@ -134,6 +161,11 @@ class ProposalParticipant(Base):
     status: Mapped[str] = mapped_column(String(length=32))
     updated_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
 
+    __table_args__ = (
+        # A user's invitations (count_notifications, fetch_active_proposals).
+        Index("ix_proposal_participants_user_status", "user_id", "status"),
+    )
+
 
 class UserFriendship(Base):
     """ORM representation of the user_friendships table."""
@@ -145,6 +177,11 @@ class UserFriendship(Base):
     status: Mapped[str] = mapped_column(String(length=32))
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
 
+    __table_args__ = (
+        # Incoming requests; outgoing ones use the primary key.
+        Index("ix_user_friendships_friend_status", "friend_user_id", "status"),
+    )
+
 
 class ChatGroup(Base):
     """ORM representation of the chat_groupes table."""
@@ -155,6 +192,28 @@ class ChatGroup(Base):
     title: Mapped[str] = mapped_column(String)
     icon_url: Mapped[str | None] = mapped_column(String, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    # Copy of the newest message, maintained by create_chat_messages.
+    last_message_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    last_message_preview: Mapped[str | None] = mapped_column(
+        String(length=CHAT_PREVIEW_LENGTH), nullable=True
+    )
+    last_message_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
+
+
+# Chat list order: newest activity first, groups without messages last.
+# SQLite and MySQL sort NULLs last under DESC already; PostgreSQL needs it spelled out.
+Index(
+    "ix_chat_groupes_last_message_at",
+    ChatGroup.last_message_at.desc(),
+    ChatGroup.id.desc(),
+).ddl_if(callable_=lambda ddl, target, bind, **kw: bind.dialect.name != "postgresql")
+Index(
+    "ix_chat_groupes_last_message_at_pg",
+    ChatGroup.last_message_at.desc().nulls_last(),
+    ChatGroup.id.desc(),
+).ddl_if(dialect="postgresql")
 
 
 class ChatMember(Base):
@@ -167,6 +226,14 @@ class ChatMember(Base):
     )
     user_id: Mapped[int] = mapped_column(Integer, primary_key=True)
     last_viewed_message_id: Mapped[int] = mapped_column(Integer)
+    # Messages from others after last_viewed_message_id, maintained by
+    # create_chat_messages / mark_chat_read (see repair_unread_counts).
+    unread_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+
+    __table_args__ = (
+        # A user's memberships (chat list, unread totals).
+        Index("ix_chat_members_user", "user_id"),
+    )
 
 
 class ChatMessage(Base):
@@ -181,6 +248,11 @@ class ChatMessage(Base):
     image_url: Mapped[str | None] = mapped_column(String, nullable=True)
     posted_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
 
+    __table_args__ = (
+        # History pages and unread counts within one chat.
+        Index("ix_chat_messages_chat_id", "chat_id", "id"),
+    )
+
 
 class User(Base):
     """ORM representation of the users table."""
@@ -196,6 +268,70 @@ class User(Base):
     profile_text: Mapped[str | None] = mapped_column(Text, nullable=True)
 
 
+# User search (search_users) matches substrings, which no B-tree can serve.
+# PostgreSQL answers the ILIKE from pg_trgm GIN indexes; SQLite keeps an FTS5
+# trigram table in sync through triggers (_create_sqlite_user_search).
+event.listen(
+    User.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+Index(
+    "ix_users_display_name_trgm",
+    User.display_name,
+    postgresql_using="gin",
+    postgresql_ops={"display_name": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql")
+Index(
+    "ix_users_account_id_trgm",
+    User.account_id,
+    postgresql_using="gin",
+    postgresql_ops={"account_id": "gin_trgm_ops"},
+).ddl_if(dialect="postgresql")
+
+# The FTS5 trigram tokenizer needs SQLite 3.34.
+_SQLITE_USER_SEARCH = sqlite3.sqlite_version_info >= (3, 34, 0)
+_SQLITE_USER_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_search USING fts5("
+    "display_name, account_id, content='users', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS users_search_insert AFTER INSERT ON users BEGIN "
+    "INSERT INTO users_search(rowid, display_name, account_id) "
+    "VALUES (new.id, new.display_name, new.account_id); END",
+    "CREATE TRIGGER IF NOT EXISTS users_search_delete AFTER DELETE ON users BEGIN "
+    "INSERT INTO users_search(users_search, rowid, display_name, account_id) "
+    "VALUES ('delete', old.id, old.display_name, old.account_id); END",
+    "CREATE TRIGGER IF NOT EXISTS users_search_update "
+    "AFTER UPDATE OF id, display_name, account_id ON users BEGIN "
+    "INSERT INTO users_search(users_search, rowid, display_name, account_id) "
+    "VALUES ('delete', old.id, old.display_name, old.account_id); "
+    "INSERT INTO users_search(rowid, display_name, account_id) "
+    "VALUES (new.id, new.display_name, new.account_id); END",
+)
+_users_search = table("users_search", column("rowid"))
+
+
+def _create_sqlite_user_search(target, connection, **kw) -> None:
+    """Create the SQLite user search table and its triggers, indexing existing users."""
+    if connection.dialect.name != "sqlite" or not _SQLITE_USER_SEARCH:
+        return
+    existed = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE name = 'users_search'"
+    ).first()
+    for statement in _SQLITE_USER_SEARCH_DDL:
+        connection.exec_driver_sql(statement)
+    if existed is None:
+        connection.exec_driver_sql("INSERT INTO users_search(users_search) VALUES ('rebuild')")
+
+
+def _drop_sqlite_user_search(target, connection, **kw) -> None:
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql("DROP TABLE IF EXISTS users_search")
+
+
+event.listen(User.__table__, "after_create", _create_sqlite_user_search)
+event.listen(User.__table__, "before_drop", _drop_sqlite_user_search)
+
+
 class Asset(Base):
     """ORM representation of the assets table."""
 
@@ -218,6 +354,11 @@ class Album(Base):
     creator_id: Mapped[int] = mapped_column(Integer)
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
 
+    __table_args__ = (
+        # Album list keyset order (fetch_albums).
+        Index("ix_albums_creator_created", "creator_id", "created_at", "id"),
+    )
+
 
 class AlbumSharedUser(Base):
     """ORM representation of the album_shared_users table."""
@@ -229,6 +370,11 @@ class AlbumSharedUser(Base):
     role: Mapped[str | None] = mapped_column(String(length=64), nullable=True)
     added_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
 
+    __table_args__ = (
+        # Albums shared with a user (fetch_albums).
+        Index("ix_album_shared_users_user", "user_id"),
+    )
+
 
 class AlbumPhoto(Base):
     """ORM representation of the album_photos table."""
@@ -240,12 +386,26 @@ class AlbumPhoto(Base):
     id: Mapped[int] = mapped_column(Integer, nullable=False)
     captured_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     uploaded_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    width: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    height: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    orientation: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    __table_args__ = (
+        # Capture-time ordering within an album (fetch_album_photos(order="captured")).
+        Index("ix_album_photos_album_captured", "album_id", "captured_at", "id"),
+        # Latest upload per album (fetch_albums).
+        Index("ix_album_photos_album_uploaded", "album_id", "uploaded_at", "id"),
+    )
 
 
 class VLMObservation(Base):
     """ORM representation of the vlm_observations table."""
 
     __tablename__ = "vlm_observations"
+    __table_args__ = (
+        # Newest observation per initiator: backs the stored AI suggestions.
+        Index("ix_vlm_observations_initiator_created", "initiator_user_id", "created_at"),
+    )
 
     observation_id: Mapped[str] = mapped_column(String, primary_key=True)
     asset_id: Mapped[str | None] = mapped_column(String(length=64), nullable=True)
@@ -263,6 +423,31 @@ class VLMObservation(Base):
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
 
 
+class Job(Base):
+    """ORM representation of the jobs table (background work queue, see jobs.py)."""
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_queue_status_run_at", "queue", "status", "run_at"),
+        Index("ix_jobs_dedup_key", "dedup_key"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    queue: Mapped[str] = mapped_column(String(length=64))
+    kind: Mapped[str] = mapped_column(String(length=128))
+    payload: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    status: Mapped[str] = mapped_column(String(length=16), default="queued")
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    max_attempts: Mapped[int] = mapped_column(Integer)
+    dedup_key: Mapped[str | None] = mapped_column(String(length=255), nullable=True)
+    run_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    locked_by: Mapped[str | None] = mapped_column(String(length=128), nullable=True)
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
 # --- Data transfer helpers -------------------------------------------------
 
 
@@ -312,6 +497,15 @@ class NewChatMessage:
     image: str | None = None
 
 
+@dataclass(frozen=True)
+class NotificationCounts:
+    """Badge counts shown by the mobile app."""
+
+    proposal_num: int
+    friend_request_num: int
+    new_chat_num: int
+
+
 @dataclass
 class ChatGroupSummary:
     """Summary information for a chat group."""
@@ -342,6 +536,9 @@ class AlbumPhotoData:
     image_id: int
     image_url: str
     uploaded_at: datetime
+    captured_at: datetime | None = None
+    width: int | None = None
+    height: int | None = None
 
 
 @dataclass
@@ -363,11 +560,32 @@ class AIProposalSuggestion:
     event_date: datetime
     location: str | None
     participant_ids: List[int]
+    source: str | None = None
+    generated_at: datetime | None = None
+    latency_ms: int | None = None
 
 
 # --- Session utilities -----------------------------------------------------
 
 
+def _insert_returning_ids(session: Session, model: type[Base], rows: list[dict]) -> list[int]:
+    """Insert *rows* into *model*'s table and return the generated ids in row order.
+
+    Uses batched multi-row ``INSERT ... RETURNING`` where the dialect supports
+    it (PostgreSQL, SQLite 3.35+) and one INSERT per row otherwise.
+    """
+    if not rows:
+        return []
+    if session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = session.execute(
+            insert(model).returning(model.id, sort_by_parameter_order=True), rows
+        )
+        return list(result.scalars())
+    return [
+        session.execute(insert(model).values(**row)).inserted_primary_key[0] for row in rows
+    ]
+
+
 def get_session() -> Iterator[Session]:
     """FastAPI dependency that yields a SQLAlchemy session."""
     session: Session = SessionLocal()
@@ -402,6 +620,46 @@ def count_pending_friend_requests(session: Session, user_id: int) -> int:
     return session.scalar(stmt) or 0
 
 
+def count_notifications(session: Session, user_id: int) -> NotificationCounts:
+    """Return pending proposals, friend requests and unread messages in one statement."""
+    proposals = (
+        select(func.count())
+        .select_from(ProposalParticipant)
+        .where(
+            ProposalParticipant.user_id == user_id,
+            ProposalParticipant.status.in_(("invited", "pending")),
+        )
+        .scalar_subquery()
+    )
+    friend_requests = (
+        select(func.count())
+        .select_from(UserFriendship)
+        .where(UserFriendship.friend_user_id == user_id, UserFriendship.status == "requested")
+        .scalar_subquery()
+    )
+    unread = (
+        select(func.coalesce(func.sum(ChatMember.unread_count), 0))
+        .where(ChatMember.user_id == user_id)
+        .scalar_subquery()
+    )
+    row = session.execute(select(proposals, friend_requests, unread)).one()
+    return NotificationCounts(
+        proposal_num=row[0] or 0,
+        friend_request_num=row[1] or 0,
+        new_chat_num=int(row[2] or 0),
+    )
+
+
+def fetch_notification_counts(session: Session, user_id: int) -> NotificationCounts:
+    """Return the user's notification counts, from the per-user cache when possible."""
+    cached, token = notification_cache.counts.get(user_id)
+    if cached is not None:
+        return cached
+    counts = count_notifications(session, user_id)
+    notification_cache.counts.put(user_id, counts, token)
+    return counts
+
+
 def fetch_friend_overview(session: Session, user_id: int) -> dict[str, list[FriendEntryData]]:
     """Return categorized friend information for the specified user."""
     Initiator = aliased(User)
@@ -471,22 +729,39 @@ def fetch_friend_overview(session: Session, user_id: int) -> dict[str, list[Frie
 
 
 def search_users(session: Session, *, input_text: str, limit: int = 20) -> list[FriendEntryData]:
-    """Search users by account id or display name."""
+    """Search users by account id or display name.
+
+    The ILIKE filter alone decides the result; trigram indexes only narrow the
+    rows it has to check. On SQLite the FTS5 table is used for input of three or
+    more characters (shorter input has no trigram) without LIKE wildcards.
+    """
     text = (input_text or "").strip()
     if not text:
         return []
 
     pattern = f"%{text}%"
-    users = session.execute(
-        select(User)
-        .where(
-            or_(
-                User.display_name.ilike(pattern),
-                User.account_id.ilike(pattern),
+    stmt = select(User).where(
+        or_(
+            User.display_name.ilike(pattern),
+            User.account_id.ilike(pattern),
+        )
+    )
+    if (
+        _SQLITE_USER_SEARCH
+        and session.get_bind().dialect.name == "sqlite"
+        and len(text) >= 3
+        and not any(char in text for char in "%_")
+    ):
+        phrase = '"' + text.replace('"', '""') + '"'
+        stmt = stmt.where(
+            User.id.in_(
+                select(_users_search.c.rowid).where(
+                    literal_column("users_search").op("MATCH")(phrase)
+                )
             )
         )
-        .order_by(func.lower(User.display_name))
-        .limit(limit)
+    users = session.execute(
+        stmt.order_by(func.lower(User.display_name)).limit(limit)
     ).scalars().all()
 
     return [
@@ -501,6 +776,80 @@ def search_users(session: Session, *, input_text: str, limit: int = 20) -> list[
     ]
 
 
+def fetch_friend_proximity(session: Session, user_id: int) -> dict[int, int]:
+    """Map the user's friends to 1 and their friends to 2 (two indexed statements)."""
+    accepted = UserFriendship.status == "accepted"
+
+    def neighbours(user_ids):
+        return union(
+            select(UserFriendship.friend_user_id).where(
+                UserFriendship.user_id.in_(user_ids), accepted
+            ),
+            select(UserFriendship.user_id).where(
+                UserFriendship.friend_user_id.in_(user_ids), accepted
+            ),
+        )
+
+    friends = set(session.scalars(neighbours([user_id]))) - {user_id}
+    if not friends:
+        return {}
+    proximity = dict.fromkeys(
+        session.scalars(neighbours(neighbours([user_id]))), 2
+    )
+    proximity.pop(user_id, None)
+    proximity.update(dict.fromkeys(friends, 1))
+    return proximity
+
+
+def search_friends_typeahead(
+    session: Session, *, user_id: int, input_text: str, limit: int = 20
+) -> list[FriendEntryData]:
+    """Typeahead search for the friends screen, nearest users to *user_id* first.
+
+    Served from the in-process index (see typeahead.py); falls back to
+    :func:`search_users` while the index is loading.
+    """
+    text = (input_text or "").strip()
+    if not text:
+        return []
+    proximity, token = typeahead.proximity.get(user_id)
+    if proximity is None and typeahead.ready():
+        proximity = fetch_friend_proximity(session, user_id)
+        typeahead.proximity.put(user_id, proximity, token)
+    found = typeahead.search(text, proximity=proximity or {}, exclude=user_id, limit=limit)
+    if found is None:
+        return [
+            entry
+            for entry in search_users(session, input_text=text, limit=limit + 1)
+            if entry.user_id != user_id
+        ][:limit]
+    # The index keeps normalized keys only; load the rows by primary key.
+    users = {user.id: user for user in session.scalars(select(User).where(User.id.in_(found)))}
+    return [
+        FriendEntryData(
+            user_id=user.id,
+            account_id=user.account_id or "",
+            display_name=user.display_name or "",
+            icon_asset_url=getattr(user, "icon_asset_url", None),
+            updated_at=None,
+        )
+        for user in (users.get(found_id) for found_id in found)
+        if user is not None
+    ]
+
+
+def load_typeahead_index() -> int:
+    """Build the typeahead index from the users table; returns the number of users."""
+    session = SessionLocal()
+    try:
+        rows = session.execute(
+            select(User.id, User.account_id, User.display_name).execution_options(yield_per=10_000)
+        )
+        return typeahead.load(tuple(row) for row in rows)
+    finally:
+        session.close()
+
+
 _FRIEND_STATUS_NORMALIZATION = {
     "request": "requested",
     "requested": "requested",
@@ -592,58 +941,89 @@ def update_friend_status(
         )
 
     session.commit()
+    notification_cache.invalidate(user_id, friend_user_id)
+    typeahead.proximity.invalidate((user_id, friend_user_id))
 
 
 def befriend_all_users(session: Session) -> int:
-    """Ensure every user is friends with every other user."""
-    user_ids = session.scalars(select(User.id)).all()
+    """Ensure every user is friends with every other user.
+
+    Returns the number of friendships created or switched to accepted. The
+    pairs are generated in SQL, one upsert per chunk of
+    ``BEFRIEND_CHUNK_USERS`` initiating users, and each chunk is committed on
+    its own; the operation is idempotent, so an interrupted run can simply be
+    repeated.
+    """
+    user_ids = session.scalars(select(User.id).order_by(User.id)).all()
     if len(user_ids) < 2:
         return 0
 
     now = datetime.now(timezone.utc)
+    initiator = aliased(User)
+    target = aliased(User)
+    columns = ["user_id", "friend_user_id", "status", "updated_at"]
+    upsert_insert = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
     operations = 0
 
-    for first_id, second_id in combinations(user_ids, 2):
-        for initiator, target in ((first_id, second_id), (second_id, first_id)):
-            friendship = session.get(UserFriendship, (initiator, target))
-            if friendship is None:
-                session.add(
-                    UserFriendship(
-                        user_id=initiator,
-                        friend_user_id=target,
-                        status="accepted",
-                        updated_at=now,
-                    )
+    for start in range(0, len(user_ids), BEFRIEND_CHUNK_USERS):
+        chunk = user_ids[start : start + BEFRIEND_CHUNK_USERS]
+        pairs = (
+            select(
+                initiator.id,
+                target.id,
+                literal("accepted"),
+                literal(now, UserFriendship.updated_at.type),
+            )
+            .join(target, target.id != initiator.id)
+            .where(initiator.id.between(chunk[0], chunk[-1]))
+        )
+        if upsert_insert is not None:
+            stmt = upsert_insert(UserFriendship.__table__).from_select(columns, pairs)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["user_id", "friend_user_id"],
+                set_={"status": "accepted", "updated_at": stmt.excluded.updated_at},
+                where=UserFriendship.__table__.c.status != "accepted",
+            )
+            # Counts inserted rows plus rows the WHERE let through to the update.
+            operations += session.execute(stmt).rowcount
+        else:
+            operations += session.execute(
+                update(UserFriendship)
+                .where(
+                    UserFriendship.user_id.between(chunk[0], chunk[-1]),
+                    UserFriendship.user_id.in_(select(User.id)),
+                    UserFriendship.friend_user_id.in_(select(User.id)),
+                    UserFriendship.friend_user_id != UserFriendship.user_id,
+                    UserFriendship.status != "accepted",
+                )
+                .values(status="accepted", updated_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            missing = pairs.where(
+                ~exists().where(
+                    UserFriendship.user_id == initiator.id,
+                    UserFriendship.friend_user_id == target.id,
                 )
-                operations += 1
-            elif friendship.status != "accepted":
-                friendship.status = "accepted"
-                friendship.updated_at = now
-                operations += 1
+            )
+            operations += session.execute(
+                insert(UserFriendship.__table__).from_select(columns, missing)
+            ).rowcount
+        session.commit()
 
-    session.commit()
+    # Friendships loaded before the run were changed behind the ORM's back.
+    session.expire_all()
+    notification_cache.counts.clear()
+    typeahead.proximity.clear()
     return operations
 
 
 def count_unread_messages(session: Session, user_id: int) -> int:
     """Return the total number of unread chat messages for the user."""
-    memberships = session.execute(
-        select(ChatMember.chat_groupe_id, ChatMember.last_viewed_message_id)
-        .where(ChatMember.user_id == user_id)
-    ).all()
-
-    total = 0
-    for chat_id, last_viewed in memberships:
-        stmt = (
-            select(func.count())
-            .select_from(ChatMessage)
-            .where(ChatMessage.chat_id == chat_id)
-            .where(ChatMessage.sender_id != user_id)
+    return session.scalar(
+        select(func.coalesce(func.sum(ChatMember.unread_count), 0)).where(
+            ChatMember.user_id == user_id
         )
-        if last_viewed is not None:
-            stmt = stmt.where(ChatMessage.id > last_viewed)
-        total += session.scalar(stmt) or 0
-    return total
+    ) or 0
 
 
 # --- Proposal queries ------------------------------------------------------
@@ -720,27 +1100,31 @@ def create_proposal(
 
     participant_set = {pid for pid in participant_ids if pid != user_id}
 
+    # The proposal is new, so its participants are inserted in one batch.
     # Creator is considered accepted by default
-    session.merge(
-        ProposalParticipant(
-            proposal_id=proposal.id,
-            user_id=user_id,
-            status="accepted",
-            updated_at=now,
-        )
+    session.execute(
+        insert(ProposalParticipant),
+        [
+            {
+                "proposal_id": proposal.id,
+                "user_id": user_id,
+                "status": "accepted",
+                "updated_at": now,
+            },
+            *(
+                {
+                    "proposal_id": proposal.id,
+                    "user_id": participant_id,
+                    "status": "invited",
+                    "updated_at": now,
+                }
+                for participant_id in participant_set
+            ),
+        ],
     )
 
-    for participant_id in participant_set:
-        session.merge(
-            ProposalParticipant(
-                proposal_id=proposal.id,
-                user_id=participant_id,
-                status="invited",
-                updated_at=now,
-            )
-        )
-
     session.commit()
+    notification_cache.invalidate(user_id, *participant_set)
     return proposal.id
 
 
@@ -769,43 +1153,150 @@ def _parse_participants(raw: object) -> list[int]:
     return []
 
 
-def fetch_ai_proposal_suggestion(session: Session, user_id: int) -> AIProposalSuggestion:
-    """Return the latest AI proposal suggestion for the user."""
+def _suggestion_from_observation(
+    user_id: int, observation: VLMObservation, fallback_date: datetime
+) -> AIProposalSuggestion:
+    candidates = observation.schedule_candidates
+    if isinstance(candidates, list):
+        candidate = candidates[0] if candidates else {}
+    elif isinstance(candidates, dict):
+        candidate = next(iter(candidates.values()), {})
+    else:
+        candidate = {}
+    if not isinstance(candidate, dict):
+        candidate = {}
+    notes = observation.notes if isinstance(observation.notes, dict) else {}
+    return AIProposalSuggestion(
+        title=candidate.get("title") or "New Gathering",
+        event_date=_parse_datetime(candidate.get("event_date"), fallback_date),
+        location=candidate.get("location"),
+        participant_ids=_parse_participants(observation.member_candidates) or [user_id],
+        source=notes.get("source"),
+        generated_at=_ensure_timezone(observation.created_at),
+        latency_ms=observation.latency_ms,
+    )
+
+
+def fetch_stored_ai_proposal_suggestion(
+    session: Session, user_id: int
+) -> AIProposalSuggestion | None:
+    """Return the newest stored suggestion for the user, or None if there is none.
+
+    A single lookup on ``ix_vlm_observations_initiator_created``.
+    """
     observation = session.execute(
         select(VLMObservation)
         .where(VLMObservation.initiator_user_id == user_id)
         .order_by(VLMObservation.created_at.desc())
         .limit(1)
     ).scalar_one_or_none()
+    if observation is None or not observation.schedule_candidates:
+        return None
+    return _suggestion_from_observation(
+        user_id, observation, datetime.now(timezone.utc) + timedelta(days=3)
+    )
 
-    fallback_date = datetime.now(timezone.utc) + timedelta(days=3)
 
-    if observation and observation.schedule_candidates:
-        if isinstance(observation.schedule_candidates, list):
-            candidate = observation.schedule_candidates[0] if observation.schedule_candidates else {}
-        elif isinstance(observation.schedule_candidates, dict):
-            candidate = next(iter(observation.schedule_candidates.values()), {})
-        else:
-            candidate = {}
-        title = candidate.get("title") or "New Gathering"
-        location = candidate.get("location")
-        event_date = _parse_datetime(candidate.get("event_date"), fallback_date)
-        participant_ids = _parse_participants(observation.member_candidates)
-    else:
-        title = "Friendly Meetup"
-        location = "Local Cafe"
-        event_date = fallback_date
-        participant_ids = []
+def fetch_ai_proposal_suggestion(session: Session, user_id: int) -> AIProposalSuggestion:
+    """Return the latest AI proposal suggestion for the user."""
+    suggestion = fetch_stored_ai_proposal_suggestion(session, user_id)
+    if suggestion is not None:
+        return suggestion
+    return AIProposalSuggestion(
+        title="Friendly Meetup",
+        event_date=datetime.now(timezone.utc) + timedelta(days=3),
+        location="Local Cafe",
+        participant_ids=[user_id],
+    )
 
-    if not participant_ids:
-        participant_ids = [user_id]
 
-    return AIProposalSuggestion(
-        title=title,
-        event_date=event_date,
-        location=location,
-        participant_ids=participant_ids,
+def store_ai_proposal_suggestion(
+    session: Session,
+    *,
+    user_id: int,
+    prompt: str,
+    title: str,
+    event_date: datetime,
+    location: str | None,
+    participant_ids: Sequence[int],
+    source: str | None,
+    latency_ms: int,
+    model_version: str,
+    keep: int = 3,
+) -> AIProposalSuggestion:
+    """Store a freshly generated suggestion as a VLM observation.
+
+    Only the newest *keep* observations of *model_version* are kept per user,
+    so periodic regeneration does not grow the table without bound.
+    """
+    now = datetime.now(timezone.utc)
+    observation = VLMObservation(
+        observation_id=f"sug-{secrets.token_hex(16)}",
+        asset_id=None,
+        observation_hash=hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        model_version=model_version,
+        prompt_payload={"prompt": prompt},
+        initiator_user_id=user_id,
+        schedule_candidates=[
+            {"title": title, "event_date": event_date.isoformat(), "location": location}
+        ],
+        member_candidates=list(participant_ids),
+        notes={"source": source} if source else None,
+        extra_metadata=None,
+        latency_ms=latency_ms,
+        processed_at=now,
+        created_at=now,
+        updated_at=now,
+    )
+    session.add(observation)
+    session.flush()
+
+    expired = (
+        select(VLMObservation.observation_id)
+        .where(
+            VLMObservation.initiator_user_id == user_id,
+            VLMObservation.model_version == model_version,
+        )
+        .order_by(VLMObservation.created_at.desc())
+        .offset(keep)
+    )
+    expired_ids = session.execute(expired).scalars().all()
+    if expired_ids:
+        session.execute(
+            delete(VLMObservation).where(VLMObservation.observation_id.in_(expired_ids))
+        )
+    session.commit()
+    return _suggestion_from_observation(user_id, observation, event_date)
+
+
+def users_needing_ai_suggestion(
+    session: Session, *, stale_before: datetime, limit: int, model_version: str
+) -> list[int]:
+    """Return up to *limit* users without a *model_version* suggestion newer than *stale_before*.
+
+    Users that have never had one come first, then the stalest. Suggestions of
+    other model versions do not count, so a model change regenerates them all.
+    """
+    newest = (
+        select(
+            VLMObservation.initiator_user_id.label("user_id"),
+            func.max(VLMObservation.created_at).label("created_at"),
+        )
+        .where(
+            VLMObservation.initiator_user_id.is_not(None),
+            VLMObservation.model_version == model_version,
+        )
+        .group_by(VLMObservation.initiator_user_id)
+        .subquery()
+    )
+    stmt = (
+        select(User.id)
+        .outerjoin(newest, newest.c.user_id == User.id)
+        .where(or_(newest.c.created_at.is_(None), newest.c.created_at < stale_before))
+        .order_by(newest.c.created_at.is_not(None), newest.c.created_at, User.id)
+        .limit(limit)
     )
+    return list(session.execute(stmt).scalars())
 
 
 # --- Chat queries ----------------------------------------------------------
@@ -819,61 +1310,140 @@ def _ensure_timezone(dt: datetime | None) -> datetime | None:
     return dt.astimezone(timezone.utc)
 
 
-def fetch_chat_groups(session: Session, user_id: int) -> list[ChatGroupSummary]:
-    """Return chat groups for the user with unread counts."""
-    memberships = session.execute(
-        select(ChatGroup, ChatMember)
-        .join(ChatMember, ChatGroup.id == ChatMember.chat_groupe_id)
-        .where(ChatMember.user_id == user_id)
-    ).all()
+def _last_message_preview(body: str | None, image_url: str | None) -> str:
+    if body:
+        return body[:CHAT_PREVIEW_LENGTH]
+    if image_url:
+        return "[image]"
+    return ""
 
-    summaries: list[ChatGroupSummary] = []
-    for group, membership in memberships:
-        last_message = session.execute(
-            select(ChatMessage)
-            .where(ChatMessage.chat_id == group.id)
-            .order_by(ChatMessage.id.desc())
-            .limit(1)
-        ).scalar_one_or_none()
 
-        unread_stmt = (
-            select(func.count())
-            .select_from(ChatMessage)
-            .where(ChatMessage.chat_id == group.id)
-            .where(ChatMessage.sender_id != user_id)
+def fetch_chat_groups(
+    session: Session,
+    user_id: int,
+    *,
+    limit: int | None = None,
+    oldest_message_date: datetime | None = None,
+    oldest_chat_groupe_id: int | None = None,
+) -> list[ChatGroupSummary]:
+    """Return chat groups for the user with unread counts, newest activity first.
+
+    The last message comes from the columns create_chat_messages keeps on
+    ``chat_groupes`` and the unread count from ``chat_members.unread_count``,
+    so no message history is scanned. Pages continue after
+    the last item of the previous page: pass its ``last_message_date`` and
+    ``chat_groupe_id`` (only the id when its date was None, since groups
+    without messages are listed last).
+    """
+    stmt = (
+        select(
+            ChatGroup.id,
+            ChatGroup.title,
+            ChatGroup.icon_url,
+            ChatGroup.last_message_preview,
+            ChatGroup.last_message_at,
+            ChatMember.unread_count,
         )
-        if membership.last_viewed_message_id is not None:
-            unread_stmt = unread_stmt.where(
-                ChatMessage.id > membership.last_viewed_message_id
+        .join(ChatMember, ChatMember.chat_groupe_id == ChatGroup.id)
+        .where(ChatMember.user_id == user_id)
+    )
+    last_message_order = ChatGroup.last_message_at.desc()
+    if session.get_bind().dialect.name == "postgresql":
+        last_message_order = last_message_order.nulls_last()
+    stmt = stmt.order_by(last_message_order, ChatGroup.id.desc())
+    if oldest_chat_groupe_id is not None:
+        if oldest_message_date is None:
+            stmt = stmt.where(
+                ChatGroup.last_message_at.is_(None), ChatGroup.id < oldest_chat_groupe_id
             )
-        unread = session.scalar(unread_stmt) or 0
-
-        if last_message:
-            if last_message.body:
-                last_content = last_message.body
-            elif last_message.image_url:
-                last_content = "[image]"
-            else:
-                last_content = ""
-            last_date = _ensure_timezone(last_message.posted_at)
         else:
-            last_content = ""
-            last_date = None
-
-        summaries.append(
-            ChatGroupSummary(
-                chat_groupe_id=group.id,
-                title=group.title,
-                icon_url=group.icon_url,
-                last_message=last_content,
-                last_message_date=last_date,
-                new_chat_num=unread,
+            stmt = stmt.where(
+                or_(
+                    ChatGroup.last_message_at < oldest_message_date,
+                    and_(
+                        ChatGroup.last_message_at == oldest_message_date,
+                        ChatGroup.id < oldest_chat_groupe_id,
+                    ),
+                    ChatGroup.last_message_at.is_(None),
+                )
+            )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    return [
+        ChatGroupSummary(
+            chat_groupe_id=group_id,
+            title=title,
+            icon_url=icon_url,
+            last_message=preview or "",
+            last_message_date=_ensure_timezone(last_message_at),
+            new_chat_num=unread_count,
+        )
+        for group_id, title, icon_url, preview, last_message_at, unread_count in session.execute(
+            stmt
+        )
+    ]
+
+
+def refresh_chat_group_last_messages(
+    session: Session, chat_ids: Sequence[int] | None = None
+) -> int:
+    """Recompute the last-message columns of chat groups from chat_messages.
+
+    For groups created before the columns existed, or to repair them; returns
+    the number of groups updated.
+    """
+    newest = (
+        select(ChatMessage.chat_id, func.max(ChatMessage.id).label("last_id"))
+        .group_by(ChatMessage.chat_id)
+    )
+    if chat_ids is not None:
+        newest = newest.where(ChatMessage.chat_id.in_(chat_ids))
+    newest = newest.subquery()
+    rows = session.execute(
+        select(
+            ChatMessage.chat_id,
+            ChatMessage.id,
+            ChatMessage.body,
+            ChatMessage.image_url,
+            ChatMessage.posted_at,
+        ).join(newest, newest.c.last_id == ChatMessage.id)
+    ).all()
+    for chat_id, message_id, body, image_url, posted_at in rows:
+        session.execute(
+            update(ChatGroup)
+            .where(ChatGroup.id == chat_id)
+            .values(
+                last_message_id=message_id,
+                last_message_preview=_last_message_preview(body, image_url),
+                last_message_at=posted_at,
             )
         )
+    session.commit()
+    return len(rows)
 
-    tz_min = datetime.min.replace(tzinfo=timezone.utc)
-    summaries.sort(key=lambda item: item.last_message_date or tz_min, reverse=True)
-    return summaries
+
+def backfill_chat_group_last_messages(session: Session, *, batch_size: int = 500) -> int:
+    """Fill the last-message columns of groups that have messages but no ``last_message_id``.
+
+    Run once at startup (see backfills.py) for groups created before the
+    columns existed; a no-op once every such group is filled. Returns the
+    number of groups updated.
+    """
+    has_messages = (
+        select(ChatMessage.id).where(ChatMessage.chat_id == ChatGroup.id).exists()
+    )
+    filled = 0
+    while True:
+        chat_ids = session.scalars(
+            select(ChatGroup.id)
+            .where(ChatGroup.last_message_id.is_(None), has_messages)
+            .order_by(ChatGroup.id)
+            .limit(batch_size)
+        ).all()
+        if not chat_ids:
+            return filled
+        filled += refresh_chat_group_last_messages(session, chat_ids)
 
 
 def create_chat_group(
@@ -889,18 +1459,20 @@ def create_chat_group(
     session.add(group)
     session.flush()
 
-    inserted_members: set[int] = set()
-    for member_id in member_ids:
-        if member_id in inserted_members:
-            continue
-        session.merge(
-            ChatMember(
-                chat_groupe_id=group.id,
-                user_id=member_id,
-                last_viewed_message_id=0,
-            )
+    unique_member_ids = list(dict.fromkeys(member_ids))
+    if unique_member_ids:
+        session.execute(
+            insert(ChatMember),
+            [
+                {
+                    "chat_groupe_id": group.id,
+                    "user_id": member_id,
+                    "last_viewed_message_id": 0,
+                    "unread_count": 0,
+                }
+                for member_id in unique_member_ids
+            ],
         )
-        inserted_members.add(member_id)
 
     session.commit()
     return group.id
@@ -951,42 +1523,59 @@ def create_chat_messages(
     sender_id: int,
     messages: Iterable[NewChatMessage],
 ) -> list[ChatMessageData]:
-    """Persist chat messages and return the created records."""
-    created: list[ChatMessageData] = []
-    last_message_id: int | None = None
+    """Persist chat messages and return the created records.
 
+    The whole batch is written with one multi-row INSERT and the sender's
+    profile is read once.
+    """
+    rows: list[dict] = []
     for payload in messages:
         if not payload.body and not payload.image:
             raise ValueError("Each message requires either body or image content.")
+        rows.append(
+            {
+                "chat_id": chat_id,
+                "sender_id": sender_id,
+                "body": payload.body,
+                "image_url": payload.image,
+                "posted_at": datetime.now(timezone.utc),
+            }
+        )
 
-        posted_at = datetime.now(timezone.utc)
-        message = ChatMessage(
+    message_ids = _insert_returning_ids(session, ChatMessage, rows)
+    sender = session.get(User, sender_id) if rows else None
+    created = [
+        ChatMessageData(
+            id=message_id,
             chat_id=chat_id,
             sender_id=sender_id,
-            body=payload.body,
-            image_url=payload.image,
-            posted_at=posted_at,
+            sender_name=sender.display_name if sender else "",
+            sender_icon_url=sender.icon_asset_url if sender else None,
+            body=row["body"],
+            image_url=row["image_url"],
+            posted_at=row["posted_at"],
         )
-        session.add(message)
-        session.flush()
-
-        user_obj = session.get(User, sender_id)
+        for message_id, row in zip(message_ids, rows)
+    ]
+    last_message_id = message_ids[-1] if message_ids else None
 
-        created.append(
-            ChatMessageData(
-                id=message.id,
-                chat_id=message.chat_id,
-                sender_id=message.sender_id,
-                sender_name=user_obj.display_name if user_obj else "",
-                sender_icon_url=getattr(user_obj, "icon_asset_url", None) if user_obj else None,
-                body=message.body,
-                image_url=message.image_url,
-                posted_at=message.posted_at,
+    if last_message_id is not None:
+        last = created[-1]
+        session.execute(
+            update(ChatGroup)
+            .where(ChatGroup.id == chat_id)
+            .values(
+                last_message_id=last.id,
+                last_message_preview=_last_message_preview(last.body, last.image_url),
+                last_message_at=last.posted_at,
             )
         )
-        last_message_id = message.id
-
-    if last_message_id is not None:
+        # One statement for every other member, however large the group.
+        session.execute(
+            update(ChatMember)
+            .where(ChatMember.chat_groupe_id == chat_id, ChatMember.user_id != sender_id)
+            .values(unread_count=ChatMember.unread_count + len(created))
+        )
         membership = session.get(ChatMember, (chat_id, sender_id))
         if membership is None:
             session.add(
@@ -994,15 +1583,34 @@ def create_chat_messages(
                     chat_groupe_id=chat_id,
                     user_id=sender_id,
                     last_viewed_message_id=last_message_id or 0,
+                    unread_count=0,
                 )
             )
         else:
             membership.last_viewed_message_id = last_message_id
+            membership.unread_count = 0
 
     session.commit()
+    if created:
+        notification_cache.invalidate(
+            *session.scalars(
+                select(ChatMember.user_id).where(ChatMember.chat_groupe_id == chat_id)
+            )
+        )
     return created
 
 
+def _count_unread(session: Session, chat_id: int, user_id: int, after_id: int | None) -> int:
+    stmt = (
+        select(func.count())
+        .select_from(ChatMessage)
+        .where(ChatMessage.chat_id == chat_id, ChatMessage.sender_id != user_id)
+    )
+    if after_id is not None:
+        stmt = stmt.where(ChatMessage.id > after_id)
+    return session.scalar(stmt) or 0
+
+
 def add_chat_member(session: Session, chat_id: int, user_id: int) -> None:
     """Add a user to a chat group if not already a member."""
     existing = session.get(ChatMember, (chat_id, user_id))
@@ -1012,9 +1620,96 @@ def add_chat_member(session: Session, chat_id: int, user_id: int) -> None:
                 chat_groupe_id=chat_id,
                 user_id=user_id,
                 last_viewed_message_id=0,
+                # The existing history counts as unread for a new member.
+                unread_count=_count_unread(session, chat_id, user_id, 0),
             )
         )
         session.commit()
+        notification_cache.invalidate(user_id)
+
+
+def mark_chat_read(
+    session: Session, *, chat_id: int, user_id: int, message_id: int | None = None
+) -> int:
+    """Advance the user's read position in a chat and return the remaining unread count.
+
+    Without *message_id* everything up to the newest message is read; a
+    *message_id* past the chat's newest message is clamped to it. The position
+    never moves backwards. The position and the recounted unread count are
+    written by one conditional UPDATE, so concurrent increments from
+    create_chat_messages are not overwritten with a stale value.
+    """
+    is_member = and_(ChatMember.chat_groupe_id == chat_id, ChatMember.user_id == user_id)
+    newest = session.scalar(select(ChatGroup.last_message_id).where(ChatGroup.id == chat_id))
+    target = newest if message_id is None or newest is None else min(message_id, newest)
+    if target is not None:
+        unread = (
+            select(func.count())
+            .select_from(ChatMessage)
+            .where(
+                ChatMessage.chat_id == chat_id,
+                ChatMessage.sender_id != user_id,
+                ChatMessage.id > target,
+            )
+            .scalar_subquery()
+        )
+        advanced = session.execute(
+            update(ChatMember)
+            .where(
+                is_member,
+                or_(
+                    ChatMember.last_viewed_message_id.is_(None),
+                    ChatMember.last_viewed_message_id < target,
+                ),
+            )
+            .values(last_viewed_message_id=target, unread_count=unread)
+        ).rowcount
+    else:
+        advanced = 0
+    count = session.scalar(select(ChatMember.unread_count).where(is_member))
+    if count is None:
+        session.rollback()
+        raise ValueError("User is not a member of this chat.")
+    session.commit()
+    if advanced:
+        notification_cache.invalidate(user_id)
+    return count
+
+
+def repair_unread_counts(session: Session, *, chat_ids: Sequence[int] | None = None) -> int:
+    """Recompute ``chat_members.unread_count`` from chat_messages and fix drifted rows.
+
+    Returns the number of memberships that were corrected.
+    """
+    actual = (
+        select(func.count())
+        .select_from(ChatMessage)
+        .where(
+            ChatMessage.chat_id == ChatMember.chat_groupe_id,
+            ChatMessage.sender_id != ChatMember.user_id,
+            or_(
+                ChatMember.last_viewed_message_id.is_(None),
+                ChatMessage.id > ChatMember.last_viewed_message_id,
+            ),
+        )
+        .correlate(ChatMember)
+        .scalar_subquery()
+    )
+    stmt = select(ChatMember.chat_groupe_id, ChatMember.user_id, actual).where(
+        ChatMember.unread_count != actual
+    )
+    if chat_ids is not None:
+        stmt = stmt.where(ChatMember.chat_groupe_id.in_(chat_ids))
+    drifted = session.execute(stmt).all()
+    for chat_id, user_id, count in drifted:
+        session.execute(
+            update(ChatMember)
+            .where(ChatMember.chat_groupe_id == chat_id, ChatMember.user_id == user_id)
+            .values(unread_count=count)
+        )
+    session.commit()
+    notification_cache.invalidate(*(user_id for _, user_id, _ in drifted))
+    return len(drifted)
 
 
 # --- Album queries ---------------------------------------------------------
@@ -1040,53 +1735,86 @@ def fetch_albums(
     oldest_album_id: int | None,
     limit: int = 10,
 ) -> list[AlbumSummary]:
-    """Return accessible albums for the user."""
+    """Return accessible albums for the user, newest first.
+
+    One statement: the page of albums is selected first and only its photos
+    and shares are aggregated. Pages are ordered by ``(created_at, id)`` and
+    continue after the album *oldest_album_id*.
+    """
     _assert_album_support()
-    albums_stmt = (
-        select(Album)
-        .outerjoin(AlbumSharedUser, Album.id == AlbumSharedUser.album_id)
-        .where(
+    shared_with_user = select(AlbumSharedUser.album_id).where(AlbumSharedUser.user_id == user_id)
+    page_stmt = select(Album.id, Album.title, Album.created_at).where(
+        or_(Album.creator_id == user_id, Album.id.in_(shared_with_user))
+    )
+    if oldest_album_id is not None:
+        anchor = select(Album.created_at).where(Album.id == oldest_album_id).scalar_subquery()
+        page_stmt = page_stmt.where(
             or_(
-                Album.creator_id == user_id,
-                AlbumSharedUser.user_id == user_id,
+                Album.created_at < anchor,
+                and_(Album.created_at == anchor, Album.id < oldest_album_id),
             )
         )
-        .distinct()
+    page = (
+        page_stmt.order_by(Album.created_at.desc(), Album.id.desc()).limit(limit).cte("album_page")
     )
-    if oldest_album_id is not None:
-        albums_stmt = albums_stmt.where(Album.id < oldest_album_id)
+    page_ids = select(page.c.id)
 
-    albums = session.execute(
-        albums_stmt.order_by(Album.created_at.desc()).limit(limit)
-    ).scalars().all()
-
-    summaries: list[AlbumSummary] = []
-    for album in albums:
-        last_photo = session.execute(
-            select(AlbumPhoto)
-            .where(AlbumPhoto.album_id == album.id)
-            .order_by(AlbumPhoto.uploaded_at.desc())
-            .limit(1)
-        ).scalar_one_or_none()
-
-        image_count = session.scalar(
-            select(func.count()).where(AlbumPhoto.album_id == album.id)
-        ) or 0
-        shared_count = session.scalar(
-            select(func.count()).where(AlbumSharedUser.album_id == album.id)
-        ) or 0
-
-        summaries.append(
-            AlbumSummary(
-                album_id=album.id,
-                title=album.title,
-                last_uploaded_image_url=last_photo.photo_url if last_photo else None,
-                image_num=image_count,
-                shared_user_num=shared_count,
+    photo_counts = (
+        select(AlbumPhoto.album_id, func.count().label("image_num"))
+        .where(AlbumPhoto.album_id.in_(page_ids))
+        .group_by(AlbumPhoto.album_id)
+        .subquery()
+    )
+    share_counts = (
+        select(AlbumSharedUser.album_id, func.count().label("shared_user_num"))
+        .where(AlbumSharedUser.album_id.in_(page_ids))
+        .group_by(AlbumSharedUser.album_id)
+        .subquery()
+    )
+    ranked_photos = (
+        select(
+            AlbumPhoto.album_id,
+            AlbumPhoto.photo_url,
+            func.row_number()
+            .over(
+                partition_by=AlbumPhoto.album_id,
+                order_by=(AlbumPhoto.uploaded_at.desc(), AlbumPhoto.id.desc()),
             )
+            .label("rank"),
         )
+        .where(AlbumPhoto.album_id.in_(page_ids))
+        .subquery()
+    )
+    last_photos = (
+        select(ranked_photos.c.album_id, ranked_photos.c.photo_url)
+        .where(ranked_photos.c.rank == 1)
+        .subquery()
+    )
 
-    return summaries
+    rows = session.execute(
+        select(
+            page.c.id,
+            page.c.title,
+            last_photos.c.photo_url,
+            func.coalesce(photo_counts.c.image_num, 0),
+            func.coalesce(share_counts.c.shared_user_num, 0),
+        )
+        .outerjoin(last_photos, last_photos.c.album_id == page.c.id)
+        .outerjoin(photo_counts, photo_counts.c.album_id == page.c.id)
+        .outerjoin(share_counts, share_counts.c.album_id == page.c.id)
+        .order_by(page.c.created_at.desc(), page.c.id.desc())
+    ).all()
+
+    return [
+        AlbumSummary(
+            album_id=album_id,
+            title=title,
+            last_uploaded_image_url=photo_url,
+            image_num=image_num,
+            shared_user_num=shared_user_num,
+        )
+        for album_id, title, photo_url, image_num, shared_user_num in rows
+    ]
 
 
 def create_album(session: Session, *, user_id: int, title: str) -> int:
@@ -1109,6 +1837,75 @@ def create_album(session: Session, *, user_id: int, title: str) -> int:
     return album.id
 
 
+def _album_photo_data(photo: AlbumPhoto) -> AlbumPhotoData:
+    return AlbumPhotoData(
+        image_id=photo.id,
+        image_url=photo.photo_url,
+        uploaded_at=photo.uploaded_at,
+        captured_at=_ensure_timezone(photo.captured_at),
+        width=photo.width,
+        height=photo.height,
+    )
+
+
+def _photos_by_capture_time(
+    session: Session,
+    album_id: int,
+    anchor: AlbumPhoto | None,
+    limit: int,
+) -> list[AlbumPhoto]:
+    """Newest capture first; photos without a capture time follow, newest upload first.
+
+    Photo ids are random, so photos without EXIF are ordered by
+    ``(uploaded_at, id)`` like the default upload order. Each part is a plain
+    keyset scan (of ix_album_photos_album_captured, then
+    ix_album_photos_album_uploaded), which keeps the query portable (MySQL has
+    no NULLS LAST) and index-ordered.
+    """
+    photos: list[AlbumPhoto] = []
+    if anchor is None or anchor.captured_at is not None:
+        stmt = select(AlbumPhoto).where(
+            AlbumPhoto.album_id == album_id, AlbumPhoto.captured_at.isnot(None)
+        )
+        if anchor is not None:
+            stmt = stmt.where(
+                or_(
+                    AlbumPhoto.captured_at < anchor.captured_at,
+                    and_(
+                        AlbumPhoto.captured_at == anchor.captured_at,
+                        AlbumPhoto.id < anchor.id,
+                    ),
+                )
+            )
+        photos = list(
+            session.execute(
+                stmt.order_by(AlbumPhoto.captured_at.desc(), AlbumPhoto.id.desc()).limit(limit)
+            ).scalars()
+        )
+    if len(photos) < limit:
+        stmt = select(AlbumPhoto).where(
+            AlbumPhoto.album_id == album_id, AlbumPhoto.captured_at.is_(None)
+        )
+        if anchor is not None and anchor.captured_at is None:
+            stmt = stmt.where(
+                or_(
+                    AlbumPhoto.uploaded_at < anchor.uploaded_at,
+                    and_(
+                        AlbumPhoto.uploaded_at == anchor.uploaded_at,
+                        AlbumPhoto.id < anchor.id,
+                    ),
+                )
+            )
+        photos.extend(
+            session.execute(
+                stmt.order_by(AlbumPhoto.uploaded_at.desc(), AlbumPhoto.id.desc()).limit(
+                    limit - len(photos)
+                )
+            ).scalars()
+        )
+    return photos
+
+
 def fetch_album_photos(
     session: Session,
     *,
@@ -1116,31 +1913,38 @@ def fetch_album_photos(
     user_id: int,
     oldest_image_id: int | None,
     limit: int = 30,
+    order: str = "uploaded",
 ) -> tuple[bool, list[AlbumPhotoData]]:
-    """Return album photos with newest first along with ownership."""
+    """Return album photos with newest first along with ownership.
+
+    ``order="captured"`` sorts by EXIF capture time instead of upload order;
+    ``oldest_image_id`` is then the last photo of the previous page.
+    """
     _assert_album_support()
     album = session.get(Album, album_id)
     if album is None:
         raise ValueError("Album not found.")
 
-    stmt = select(AlbumPhoto).where(AlbumPhoto.album_id == album_id)
-    if oldest_image_id is not None:
-        stmt = stmt.where(AlbumPhoto.id < oldest_image_id)
-
-    photos = session.execute(
-        stmt.order_by(AlbumPhoto.id.desc()).limit(limit)
-    ).scalars().all()
-
-    data = [
-        AlbumPhotoData(
-            image_id=photo.id,
-            image_url=photo.photo_url,
-            uploaded_at=photo.uploaded_at,
-        )
-        for photo in photos
-    ]
+    if order == "captured":
+        anchor = None
+        if oldest_image_id is not None:
+            anchor = session.execute(
+                select(AlbumPhoto).where(
+                    AlbumPhoto.album_id == album_id, AlbumPhoto.id == oldest_image_id
+                )
+            ).scalar_one_or_none()
+            if anchor is None:
+                return album.creator_id == user_id, []
+        photos = _photos_by_capture_time(session, album_id, anchor, limit)
+    else:
+        stmt = select(AlbumPhoto).where(AlbumPhoto.album_id == album_id)
+        if oldest_image_id is not None:
+            stmt = stmt.where(AlbumPhoto.id < oldest_image_id)
+        photos = session.execute(
+            stmt.order_by(AlbumPhoto.id.desc()).limit(limit)
+        ).scalars().all()
 
-    return album.creator_id == user_id, data
+    return album.creator_id == user_id, [_album_photo_data(photo) for photo in photos]
 
 
 def add_album_photos(
@@ -1148,31 +1952,38 @@ def add_album_photos(
     *,
     album_id: int,
     photo_urls: Sequence[str],
+    metadata: Mapping[str, PhotoMetadata] | None = None,
 ) -> list[AlbumPhotoData]:
-    """Insert new album photos and return their metadata."""
+    """Insert new album photos and return their metadata.
+
+    *metadata* maps photo URLs to header data read by :mod:`app.exif`.
+    """
     _assert_album_support()
     now = datetime.now(timezone.utc)
-    created: list[AlbumPhotoData] = []
+    metadata = metadata or {}
+    rows: list[dict] = []
     for url in photo_urls:
-        photo = AlbumPhoto(
-            id=_generate_album_photo_id(),
-            album_id=album_id,
-            photo_url=url,
-            captured_at=None,
-            uploaded_at=now,
-        )
-        session.add(photo)
-        session.flush()
-        created.append(
-            AlbumPhotoData(
-                image_id=photo.id,
-                image_url=photo.photo_url,
-                uploaded_at=photo.uploaded_at,
-            )
+        info = metadata.get(url)
+        rows.append(
+            {
+                "id": _generate_album_photo_id(),
+                "album_id": album_id,
+                "photo_url": url,
+                "captured_at": info.captured_at if info else None,
+                "uploaded_at": now,
+                "width": info.width if info else None,
+                "height": info.height if info else None,
+                "orientation": info.orientation if info else None,
+            }
         )
 
+    # Ids are generated client-side, so nothing has to be read back and the
+    # whole upload is a single executemany.
+    if rows:
+        session.execute(insert(AlbumPhoto), rows)
+
     session.commit()
-    return created
+    return [_album_photo_data(AlbumPhoto(**row)) for row in rows]
 
 
 def update_album(
@@ -1223,11 +2034,42 @@ def update_album(
     session.commit()
 
 
+# Columns added to tables that existing databases already have. create_all only
+# creates missing tables, so _upgrade_schema adds these with ALTER TABLE, along
+# with the indexes of these tables (the PostgreSQL DDL is listed in database.md).
+_ADDED_COLUMNS: dict[str, tuple[str, ...]] = {
+    "album_photos": ("width", "height", "orientation"),
+    "chat_groupes": ("last_message_id", "last_message_preview", "last_message_at"),
+    "chat_members": ("unread_count",),
+}
+
+
+def _upgrade_schema(connection) -> None:
+    """Add missing columns and indexes to tables created by older versions.
+
+    Idempotent: only what the inspector does not find is created.
+    """
+    inspector = inspect(connection)
+    for table_name, column_names in _ADDED_COLUMNS.items():
+        table_obj = Base.metadata.tables[table_name]
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        for name in column_names:
+            if name in existing:
+                continue
+            column_ddl = CreateColumn(table_obj.c[name]).compile(dialect=connection.dialect)
+            connection.execute(DDL(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}"))
+        for index in table_obj.indexes:
+            index.create(bind=connection, checkfirst=True)
+
+
 def _initialize_sqlite_schema() -> None:
     """Ensure SQLite databases used in tests have the expected schema."""
     if engine.url.get_backend_name() != "sqlite":
         return
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        _upgrade_schema(connection)
+        _create_sqlite_user_search(User.__table__, connection)
     global ALBUM_PHOTOS_AVAILABLE
     ALBUM_PHOTOS_AVAILABLE = True
 
@@ -1285,8 +2127,13 @@ def create_user(
     icon_image: str | None,
     face_image: str,
     profile_text: str | None,
+    assets: Iterable[StoredAsset] = (),
 ) -> int:
-    """Create or update a user and return the user ID."""
+    """Create or update a user and return the user ID.
+
+    Rows for ``assets`` (the uploaded icon and face files) are written in the
+    same transaction as the user.
+    """
     user = session.execute(
         select(User).where(User.account_id == account_id)
     ).scalar_one_or_none()
@@ -1310,11 +2157,61 @@ def create_user(
             assets_id="",  # This might need a better default
         )
         session.add(user)
+        session.flush()
 
+    _insert_assets(session, user.id, assets)
     session.commit()
+    typeahead.put(user.id, user.account_id, user.display_name)
     return user.id
 
 
+def _insert_assets(session: Session, owner_id: int, assets: Iterable[StoredAsset]) -> None:
+    """Add rows for stored files to the current transaction.
+
+    Content already recorded, including by a concurrent upload of the same
+    file, is left untouched (ON CONFLICT DO NOTHING where supported).
+    """
+    pending = {stored.sha256: stored for stored in assets}
+    if not pending:
+        return
+    now = datetime.now(timezone.utc)
+    rows = [
+        {
+            "id": sha256,
+            "owner_id": owner_id,
+            "content_type": stored.content_type,
+            "storage_key": stored.storage_key,
+            "created_at": now,
+        }
+        for sha256, stored in pending.items()
+    ]
+    upsert_insert = _UPSERT_INSERTS.get(session.get_bind().dialect.name)
+    if upsert_insert is not None:
+        session.execute(
+            upsert_insert(Asset.__table__).values(rows).on_conflict_do_nothing(
+                index_elements=["id"]
+            )
+        )
+        return
+    existing = set(
+        session.execute(select(Asset.id).where(Asset.id.in_(pending))).scalars()
+    )
+    missing = [row for row in rows if row["id"] not in existing]
+    if missing:
+        session.execute(insert(Asset.__table__).values(missing))
+
+
+def record_assets(
+    session: Session,
+    *,
+    owner_id: int,
+    assets: Iterable[StoredAsset],
+) -> None:
+    """Insert rows for stored files; content already recorded is left untouched."""
+    _insert_assets(session, owner_id, assets)
+    session.commit()
+
+
 def update_user(
     session: Session,
     *,
@@ -1324,8 +2221,9 @@ def update_user(
     icon_image: str | None,
     face_image: str | None,
     profile_text: str | None,
+    assets: Iterable[StoredAsset] = (),
 ) -> None:
-    """Update a user's profile."""
+    """Update a user's profile, recording ``assets`` in the same transaction."""
     user = session.get(User, user_id)
     if not user:
         raise ValueError("User not found.")
@@ -1338,4 +2236,6 @@ def update_user(
     if face_image:
         user.face_asset_url = face_image
 
+    _insert_assets(session, user.id, assets)
     session.commit()
+    typeahead.put(user.id, user.account_id, user.display_name)
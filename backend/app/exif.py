@@ -0,0 +1,131 @@
+"""Capture time, orientation and dimensions read from image headers.
+
+Pillow opens images lazily: ``Image.open`` parses the container up to the
+start of the pixel data, which is enough for the size and the EXIF block, and
+nothing here ever triggers a decode. Batches are read on a thread pool since
+the work is dominated by small file reads.
+"""
+
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Sequence
+
+from PIL import ExifTags, Image, UnidentifiedImageError
+
+from . import assets, config
+
+
+logger = logging.getLogger(__name__)
+
+# EXIF tags (see ExifTags.Base).
+_ORIENTATION = 0x0112
+_DATETIME = 0x0132
+_DATETIME_ORIGINAL = 0x9003
+_DATETIME_DIGITIZED = 0x9004
+_OFFSET_TIME_ORIGINAL = 0x9011
+_OFFSET_TIME = 0x9010
+
+# Orientations 5-8 are rotated by 90 degrees, so width and height swap.
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+@dataclass(frozen=True)
+class PhotoMetadata:
+    """Header metadata of one photo; width and height are as displayed (upright)."""
+
+    captured_at: datetime | None
+    width: int
+    height: int
+    orientation: int | None
+
+
+def _parse_offset(value: object) -> timezone | None:
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if len(value) != 6 or value[0] not in "+-" or value[3] != ":":
+        return None
+    try:
+        hours, minutes = int(value[1:3]), int(value[4:6])
+    except ValueError:
+        return None
+    sign = -1 if value[0] == "-" else 1
+    return timezone(sign * timedelta(hours=hours, minutes=minutes))
+
+
+def _default_offset() -> timezone:
+    return _parse_offset(config.PHOTO_DEFAULT_UTC_OFFSET) or timezone.utc
+
+
+def parse_exif_datetime(value: object, offset: object = None) -> datetime | None:
+    """Parse an EXIF ``YYYY:MM:DD HH:MM:SS`` timestamp into an aware datetime.
+
+    EXIF stores local camera time; the ``OffsetTime*`` tag gives its UTC
+    offset when present, otherwise ``PHOTO_DEFAULT_UTC_OFFSET`` is assumed.
+    """
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.strptime(value.strip().rstrip("\x00")[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=_parse_offset(offset) or _default_offset())
+
+
+def read_metadata(path: str | Path) -> PhotoMetadata | None:
+    """Read the header of one image file, or return None if it is not an image."""
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            exif = image.getexif()
+    except (FileNotFoundError, UnidentifiedImageError, OSError, ValueError) as exc:
+        logger.debug("No metadata for %s: %s", path, exc)
+        return None
+
+    details = exif.get_ifd(ExifTags.IFD.Exif) if exif else {}
+    captured_at = parse_exif_datetime(
+        details.get(_DATETIME_ORIGINAL), details.get(_OFFSET_TIME_ORIGINAL)
+    ) or parse_exif_datetime(
+        details.get(_DATETIME_DIGITIZED), details.get(_OFFSET_TIME_ORIGINAL)
+    ) or parse_exif_datetime(exif.get(_DATETIME), details.get(_OFFSET_TIME))
+
+    orientation = exif.get(_ORIENTATION)
+    if not isinstance(orientation, int) or not 1 <= orientation <= 8:
+        orientation = None
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return PhotoMetadata(
+        captured_at=captured_at, width=width, height=height, orientation=orientation
+    )
+
+
+def read_many(paths: Sequence[str | Path]) -> list[PhotoMetadata | None]:
+    """Read headers of several files concurrently, preserving order."""
+    if len(paths) <= 1:
+        return [read_metadata(path) for path in paths]
+    workers = min(len(paths), config.EXIF_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exif") as pool:
+        return list(pool.map(read_metadata, paths))
+
+
+def metadata_for_urls(urls: Sequence[str]) -> dict[str, PhotoMetadata]:
+    """Return metadata for the URLs that point into the local asset store.
+
+    Remote URLs are skipped; their photos are ordered by upload time only.
+    """
+    local = {
+        url: assets.path_for(digest)
+        for url in urls
+        if (digest := assets.digest_from_url(url)) is not None
+    }
+    results = read_many(list(local.values()))
+    return {
+        url: metadata
+        for url, metadata in zip(local, results)
+        if metadata is not None
+    }
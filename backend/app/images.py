@@ -0,0 +1,84 @@
+"""Image decoding and resizing helpers shared by the AI and asset code paths."""
+
+from __future__ import annotations
+
+import io
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+@dataclass
+class PreparedImage:
+    """An upright decoded image plus the downscaled copy sent for detection.
+
+    ``scale`` converts coordinates in ``payload`` back to ``image``
+    (original = sent * scale).
+    """
+
+    image: Image.Image
+    payload: bytes
+    scale: float
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.image.size
+
+
+def decode(content: bytes) -> Image.Image | None:
+    """Decode image bytes into an upright RGB image, or None if undecodable.
+
+    Images over Pillow's pixel limit (decompression bombs) count as undecodable.
+    """
+    try:
+        with Image.open(io.BytesIO(content)) as raw:
+            image = ImageOps.exif_transpose(raw)
+            return image.convert("RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        return None
+
+
+def encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def prepare_for_detection(content: bytes, *, max_side: int, quality: int) -> PreparedImage | None:
+    """Decode once and produce a JPEG whose long side is at most *max_side*."""
+    image = decode(content)
+    if image is None:
+        return None
+    width, height = image.size
+    scale = max(width, height) / max_side if max(width, height) > max_side else 1.0
+    if scale > 1.0:
+        small = image.resize(
+            (max(1, round(width / scale)), max(1, round(height / scale))),
+            Image.Resampling.BILINEAR,
+        )
+    else:
+        small = image
+    return PreparedImage(image=image, payload=encode_jpeg(small, quality), scale=scale)
+
+
+def scale_box(box: list[int], scale: float, size: tuple[int, int]) -> list[int]:
+    """Map an ``[x, y, w, h]`` box from the sent image back to original pixels."""
+    width, height = size
+    x, y, w, h = (round(value * scale) for value in box)
+    x = min(max(x, 0), width - 1)
+    y = min(max(y, 0), height - 1)
+    return [x, y, min(w, width - x), min(h, height - y)]
+
+
+def encode_crop(image: Image.Image, box: list[int], *, short_side: int, quality: int) -> bytes:
+    """Crop *box* and shrink it so its short side is at most *short_side*."""
+    x, y, w, h = box
+    crop = image.crop((x, y, x + w, y + h))
+    shortest = min(crop.size)
+    if shortest > short_side:
+        factor = short_side / shortest
+        crop = crop.resize(
+            (max(1, round(crop.width * factor)), max(1, round(crop.height * factor))),
+            Image.Resampling.BICUBIC,
+        )
+    return encode_jpeg(crop, quality)
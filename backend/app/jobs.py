@@ -0,0 +1,423 @@
+"""Database-backed background job queue.
+
+Jobs are rows in ``jobs`` and go ``queued -> running -> done`` (or ``failed``
+once ``max_attempts`` is used up). A worker claims a job by taking a lease:
+``locked_by`` / ``locked_until`` are set and the lease is renewed while the
+job runs, so the job of a crashed worker becomes claimable again once its
+lease runs out.
+
+On PostgreSQL and MySQL the candidates are selected ``FOR UPDATE SKIP LOCKED``
+so concurrent workers never wait on each other. Other databases (SQLite) claim
+each candidate with a conditional UPDATE that only succeeds while the job is
+still claimable; the database serializes those writes. Failed jobs are retried
+with exponential backoff and jitter.
+
+Handlers are registered with :func:`handler`; ``python -m backend.app.worker``
+runs them.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import socket
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Mapping, Sequence
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import config, db
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+Handler = Callable[[dict], Awaitable[None]]
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict[str, Handler] = {}
+
+# Dialects whose row locks support SKIP LOCKED.
+_SKIP_LOCKED_DIALECTS = {"postgresql", "mysql", "mariadb"}
+
+
+@dataclass(frozen=True)
+class ClaimedJob:
+    """A job leased to one worker."""
+
+    id: int
+    queue: str
+    kind: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+
+
+def handler(kind: str) -> Callable[[Handler], Handler]:
+    """Register the coroutine that runs jobs of *kind*."""
+
+    def register(func: Handler) -> Handler:
+        _handlers[kind] = func
+        return func
+
+    return register
+
+
+def parse_queues(specs: Sequence[str]) -> dict[str, int]:
+    """Parse ``name:concurrency`` entries (concurrency defaults to 1)."""
+    queues: dict[str, int] = {}
+    for spec in specs:
+        name, _, limit = spec.partition(":")
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            queues[name] = max(1, int(limit)) if limit else 1
+        except ValueError as exc:
+            raise ValueError(f"Invalid queue concurrency in {spec!r}.") from exc
+    return queues
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def enqueue(
+    session: Session,
+    kind: str,
+    payload: dict | None = None,
+    *,
+    queue: str = "default",
+    delay: float = 0.0,
+    max_attempts: int | None = None,
+    dedup_key: str | None = None,
+) -> int:
+    """Add a job and commit; return its id.
+
+    With *dedup_key*, a queued or running job with the same key is reused
+    instead of adding another one.
+    """
+    if dedup_key is not None:
+        existing = session.execute(
+            select(db.Job.id)
+            .where(db.Job.dedup_key == dedup_key, db.Job.status.in_((QUEUED, RUNNING)))
+            .limit(1)
+        ).scalar_one_or_none()
+        if existing is not None:
+            return existing
+
+    now = _now()
+    job = db.Job(
+        queue=queue,
+        kind=kind,
+        payload=payload or {},
+        status=QUEUED,
+        attempts=0,
+        max_attempts=max_attempts or config.JOB_MAX_ATTEMPTS,
+        dedup_key=dedup_key,
+        run_at=now + timedelta(seconds=delay),
+        created_at=now,
+        updated_at=now,
+    )
+    session.add(job)
+    session.commit()
+    return job.id
+
+
+def submit(kind: str, payload: dict | None = None, **options) -> int:
+    """Enqueue a job in a session of its own (for callers without one)."""
+    session = db.SessionLocal()
+    try:
+        return enqueue(session, kind, payload, **options)
+    finally:
+        session.close()
+
+
+def _claimable(now: datetime):
+    return or_(
+        and_(db.Job.status == QUEUED, db.Job.run_at <= now),
+        and_(db.Job.status == RUNNING, db.Job.locked_until < now),
+    )
+
+
+def claim(
+    session: Session,
+    queue: str,
+    worker_id: str,
+    limit: int,
+    *,
+    lease_seconds: float | None = None,
+) -> list[ClaimedJob]:
+    """Lease up to *limit* due jobs of *queue* to *worker_id*."""
+    if limit <= 0:
+        return []
+    now = _now()
+    lease = timedelta(seconds=lease_seconds or config.JOB_LEASE_SECONDS)
+
+    # Jobs whose worker died on the last attempt are not retried.
+    session.execute(
+        update(db.Job)
+        .where(
+            db.Job.queue == queue,
+            db.Job.status == RUNNING,
+            db.Job.locked_until < now,
+            db.Job.attempts >= db.Job.max_attempts,
+        )
+        .values(status=FAILED, locked_by=None, last_error="lease expired", updated_at=now)
+    )
+
+    candidates = (
+        select(db.Job.id)
+        .where(db.Job.queue == queue, _claimable(now))
+        .order_by(db.Job.run_at, db.Job.id)
+        .limit(limit)
+    )
+    claim_values = {
+        "status": RUNNING,
+        "locked_by": worker_id,
+        "locked_until": now + lease,
+        "attempts": db.Job.attempts + 1,
+        "updated_at": now,
+    }
+    if session.get_bind().dialect.name in _SKIP_LOCKED_DIALECTS:
+        ids = list(session.execute(candidates.with_for_update(skip_locked=True)).scalars())
+        if ids:
+            session.execute(update(db.Job).where(db.Job.id.in_(ids)).values(**claim_values))
+    else:
+        ids = []
+        for job_id in session.execute(candidates).scalars().all():
+            result = session.execute(
+                update(db.Job).where(db.Job.id == job_id, _claimable(now)).values(**claim_values)
+            )
+            if result.rowcount == 1:
+                ids.append(job_id)
+    session.commit()
+    if not ids:
+        return []
+
+    rows = session.execute(
+        select(db.Job).where(db.Job.id.in_(ids)).order_by(db.Job.run_at, db.Job.id)
+    ).scalars()
+    return [
+        ClaimedJob(
+            id=row.id,
+            queue=row.queue,
+            kind=row.kind,
+            payload=row.payload or {},
+            attempts=row.attempts,
+            max_attempts=row.max_attempts,
+        )
+        for row in rows
+    ]
+
+
+def renew_leases(
+    session: Session, worker_id: str, job_ids: Sequence[int], *, lease_seconds: float | None = None
+) -> None:
+    """Extend the leases *worker_id* holds on running jobs."""
+    if not job_ids:
+        return
+    now = _now()
+    session.execute(
+        update(db.Job)
+        .where(db.Job.id.in_(job_ids), db.Job.locked_by == worker_id, db.Job.status == RUNNING)
+        .values(
+            locked_until=now + timedelta(seconds=lease_seconds or config.JOB_LEASE_SECONDS),
+            updated_at=now,
+        )
+    )
+    session.commit()
+
+
+def complete(session: Session, job: ClaimedJob, worker_id: str) -> None:
+    """Mark a job done, unless its lease was lost to another worker."""
+    session.execute(
+        update(db.Job)
+        .where(db.Job.id == job.id, db.Job.locked_by == worker_id, db.Job.status == RUNNING)
+        .values(status=DONE, locked_by=None, locked_until=None, last_error=None, updated_at=_now())
+    )
+    session.commit()
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff before attempt ``attempts + 1``: exponential, capped, with jitter."""
+    ceiling = min(
+        config.JOB_RETRY_MAX_SECONDS, config.JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1)
+    )
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def fail(session: Session, job: ClaimedJob, worker_id: str, error: str) -> str:
+    """Schedule a retry of a failed job, or give up; return the new status."""
+    now = _now()
+    values: dict[str, object] = {
+        "locked_by": None,
+        "locked_until": None,
+        "last_error": error[:2000],
+        "updated_at": now,
+    }
+    if job.attempts >= job.max_attempts:
+        values["status"] = FAILED
+    else:
+        values["status"] = QUEUED
+        values["run_at"] = now + timedelta(seconds=retry_delay(job.attempts))
+    session.execute(
+        update(db.Job)
+        .where(db.Job.id == job.id, db.Job.locked_by == worker_id, db.Job.status == RUNNING)
+        .values(**values)
+    )
+    session.commit()
+    return values["status"]
+
+
+def purge_finished(session: Session, *, older_than: float | None = None) -> int:
+    """Delete done jobs older than *older_than* seconds; failed jobs are kept."""
+    cutoff = _now() - timedelta(seconds=older_than or config.JOB_RETENTION_SECONDS)
+    result = session.execute(
+        delete(db.Job).where(db.Job.status == DONE, db.Job.updated_at < cutoff)
+    )
+    session.commit()
+    return result.rowcount or 0
+
+
+def queue_depths(session: Session) -> dict[str, dict[str, int]]:
+    """Return job counts per queue and status."""
+    depths: dict[str, dict[str, int]] = {}
+    rows = session.execute(
+        select(db.Job.queue, db.Job.status, func.count()).group_by(db.Job.queue, db.Job.status)
+    )
+    for queue, status, count in rows:
+        depths.setdefault(queue, {})[status] = count
+    return depths
+
+
+def _with_session(func: Callable[..., object], *args, **kwargs):
+    session = db.SessionLocal()
+    try:
+        return func(session, *args, **kwargs)
+    finally:
+        session.close()
+
+
+class Worker:
+    """Runs registered handlers for jobs claimed from the configured queues.
+
+    ``queues`` maps each queue to the number of its jobs this worker runs at
+    once; run several workers to scale out.
+    """
+
+    def __init__(
+        self,
+        queues: Mapping[str, int],
+        *,
+        worker_id: str | None = None,
+        poll_interval: float | None = None,
+        lease_seconds: float | None = None,
+    ) -> None:
+        self.queues = dict(queues)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self.poll_interval = poll_interval or config.JOB_POLL_INTERVAL
+        self.lease_seconds = lease_seconds or config.JOB_LEASE_SECONDS
+        self._running: dict[int, asyncio.Task] = {}
+        self._per_queue: dict[str, int] = {queue: 0 for queue in self.queues}
+        self.counts = {"claimed": 0, "succeeded": 0, "retried": 0, "failed": 0}
+
+    async def _execute(self, job: ClaimedJob) -> None:
+        try:
+            func = _handlers.get(job.kind)
+            if func is None:
+                raise LookupError(f"No handler registered for job kind {job.kind!r}.")
+            await func(job.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("Job %s (%s) attempt %s failed: %s", job.id, job.kind, job.attempts, exc)
+            status = await asyncio.to_thread(
+                _with_session, fail, job, self.worker_id, f"{type(exc).__name__}: {exc}"
+            )
+            self.counts["failed" if status == FAILED else "retried"] += 1
+        else:
+            await asyncio.to_thread(_with_session, complete, job, self.worker_id)
+            self.counts["succeeded"] += 1
+
+    def _start(self, job: ClaimedJob) -> None:
+        self.counts["claimed"] += 1
+        self._per_queue[job.queue] += 1
+        task = asyncio.ensure_future(self._execute(job))
+        self._running[job.id] = task
+
+        def _done(_: asyncio.Task) -> None:
+            self._running.pop(job.id, None)
+            self._per_queue[job.queue] -= 1
+
+        task.add_done_callback(_done)
+
+    async def run_once(self) -> int:
+        """Claim due jobs for every queue with free slots; return how many were started."""
+        started = 0
+        for queue, concurrency in self.queues.items():
+            free = concurrency - self._per_queue[queue]
+            if free <= 0:
+                continue
+            claimed = await asyncio.to_thread(
+                _with_session,
+                claim,
+                queue,
+                self.worker_id,
+                free,
+                lease_seconds=self.lease_seconds,
+            )
+            for job in claimed:
+                self._start(job)
+            started += len(claimed)
+        return started
+
+    async def drain(self) -> None:
+        """Wait for the jobs already started."""
+        while self._running:
+            await asyncio.gather(*list(self._running.values()), return_exceptions=True)
+
+    async def run(self, stop: asyncio.Event | None = None) -> None:
+        """Poll until *stop* is set, then let running jobs finish."""
+        stop = stop or asyncio.Event()
+        last_purge = last_renewal = 0.0
+        loop = asyncio.get_running_loop()
+        try:
+            while not stop.is_set():
+                try:
+                    if self._running and loop.time() - last_renewal > self.lease_seconds / 3:
+                        last_renewal = loop.time()
+                        await asyncio.to_thread(
+                            _with_session,
+                            renew_leases,
+                            self.worker_id,
+                            list(self._running),
+                            lease_seconds=self.lease_seconds,
+                        )
+                    await self.run_once()
+                    if loop.time() - last_purge > 60:
+                        last_purge = loop.time()
+                        await asyncio.to_thread(_with_session, purge_finished)
+                except Exception:
+                    logger.exception("Job worker poll failed")
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self.drain()
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "worker_id": self.worker_id,
+            "running": dict(self._per_queue),
+            "limits": dict(self.queues),
+            **self.counts,
+        }
@@ -2,15 +2,33 @@
 
 from __future__ import annotations
 
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from datetime import date, datetime
-from typing import List
+from typing import AsyncIterator, Awaitable, List, TypeVar
 
-from fastapi import Body, Depends, FastAPI, HTTPException, Path, Query, status, UploadFile, File, Form
+from fastapi import Body, Depends, FastAPI, HTTPException, Path, Query, Request, Response, status, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field, field_validator, model_validator
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
-from . import ai_service, db
+from . import (
+    ai_routing,
+    ai_service,
+    asset_response,
+    assets,
+    backfills,
+    config,
+    db,
+    exif,
+    jobs,
+    notification_cache,
+    suggestions,
+    thumbnails,
+    typeahead,
+)
 
 
 # --- Pydantic schemas ------------------------------------------------------
@@ -68,6 +86,7 @@ class AIProposalResponse(BaseModel):
     event_date: datetime
     location: str | None = None
     participant_ids: List[int]
+    source: str | None = None
 
 
 class ChatMessageRequest(BaseModel):
@@ -108,6 +127,7 @@ class ChatMessageResponse(BaseModel):
     sender_icon_url: str | None = None
     body: str | None = None
     image_url: str | None = None
+    image_thumbnail_url: str | None = None
     posted_at: datetime
 
     @field_validator("posted_at", mode="before")
@@ -168,10 +188,20 @@ class ChatMemberInviteRequest(BaseModel):
     invite_user_id: int
 
 
+class ChatReadRequest(BaseModel):
+    user_id: int
+    last_viewed_message_id: int | None = None
+
+
+class ChatReadResponse(BaseModel):
+    new_chat_num: int
+
+
 class AlbumListItem(BaseModel):
     albam_id: int
     title: str
     last_uploaded_image_url: str | None = None
+    last_uploaded_thumbnail_url: str | None = None
     image_num: int
     shared_user_num: int
 
@@ -185,6 +215,15 @@ class AlbumPhotoResponse(BaseModel):
     is_creator: bool
     image_id: int
     image_url: str
+    thumbnail_url: str | None = None
+    captured_at: datetime | None = None
+    width: int | None = None
+    height: int | None = None
+
+
+class AssetUploadResponse(BaseModel):
+    url: str
+    thumbnail_url: str | None = None
 
 
 class AlbumPhotoUploadRequest(BaseModel):
@@ -243,6 +282,8 @@ class FriendSearchResult(BaseModel):
 
 class FriendSearchRequest(BaseModel):
     input_text: str
+    # The searching user; enables the typeahead index and friend-first ranking.
+    user_id: int | None = None
 
     @field_validator("input_text")
     @classmethod
@@ -265,17 +306,95 @@ class FriendRequestUpdate(BaseModel):
         return value.strip()
 
 
+# --- Request helpers -------------------------------------------------------
+
+
+T = TypeVar("T")
+
+_DISCONNECT_POLL_INTERVAL = 0.5
+
+
+async def _cancel_on_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """Await *awaitable*, cancelling it as soon as the client goes away.
+
+    Cancelling the task closes the in-flight AI-server connections, which lets
+    the AI server skip work nobody is waiting for.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=_DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+async def _store_upload(file: UploadFile) -> assets.StoredAsset:
+    try:
+        stored = await assets.save_upload(file)
+    except assets.AssetTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc)) from exc
+    thumbnails.schedule(stored)
+    return stored
+
+
 # --- FastAPI factory -------------------------------------------------------
 
 
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    await ai_service.open_client()
+    suggestions.start()
+    typeahead.start(db.load_typeahead_index)
+    backfills.start()
+    try:
+        yield
+    finally:
+        await backfills.stop()
+        await suggestions.stop()
+        await ai_service.close_client()
+        thumbnails.shutdown()
+
+
 def create_app() -> FastAPI:
     """Create and configure the FastAPI application instance."""
-    app = FastAPI(title="ng_2512 backend")
+    app = FastAPI(title="ng_2512 backend", lifespan=_lifespan)
 
     @app.get("/health", tags=["health"])
     def healthcheck() -> dict[str, str]:
         return {"status": "ok"}
 
+    @app.get("/health/ai", tags=["health"])
+    def ai_client_stats() -> dict[str, object]:
+        return {
+            "pool": ai_service.pool_stats(),
+            "replicas": ai_routing.stats(),
+            "endpoints": ai_routing.endpoint_stats(),
+            "singleflight": ai_service.singleflight_stats(),
+            "images": ai_service.image_stats(),
+            "suggestions": suggestions.stats(),
+        }
+
+    @app.get("/health/notifications", tags=["health"])
+    def notification_stats() -> dict[str, object]:
+        return notification_cache.stats()
+
+    @app.get("/health/typeahead", tags=["health"])
+    def typeahead_stats() -> dict[str, object]:
+        return typeahead.stats()
+
+    @app.get("/health/jobs", tags=["health"])
+    def job_stats(session: Session = Depends(db.get_session)) -> dict[str, object]:
+        return {"enabled": config.JOBS_ENABLED, "queues": jobs.queue_depths(session)}
+
+    @app.get("/health/assets", tags=["health"])
+    def asset_stats() -> dict[str, object]:
+        return {"thumbnails": thumbnails.stats()}
+
     # Notifications ---------------------------------------------------------
 
     @app.get(
@@ -288,18 +407,16 @@ def create_app() -> FastAPI:
         session: Session = Depends(db.get_session),
     ) -> NotificationResponse:
         try:
-            proposal_count = db.count_pending_proposal_invites(session, user_id)
-            friend_request_count = db.count_pending_friend_requests(session, user_id)
-            new_chat_count = db.count_unread_messages(session, user_id)
+            counts = db.fetch_notification_counts(session, user_id)
         except SQLAlchemyError as exc:  # pragma: no cover - defensive
             raise HTTPException(
                 status_code=503, detail="Database temporarily unavailable"
             ) from exc
 
         return NotificationResponse(
-            proposal_num=proposal_count,
-            friend_request_num=friend_request_count,
-            new_chat_num=new_chat_count,
+            proposal_num=counts.proposal_num,
+            friend_request_num=counts.friend_request_num,
+            new_chat_num=counts.new_chat_num,
         )
 
     # Proposals -------------------------------------------------------------
@@ -373,21 +490,29 @@ def create_app() -> FastAPI:
         tags=["proposal"],
     )
     async def get_ai_proposal(
+        request: Request,
         user_id: int = Query(..., description="User identifier"),
         session: Session = Depends(db.get_session),
     ) -> AIProposalResponse:
-        # Here you could generate a more specific prompt based on user data
-        prompt = f"Create a proposal for user {user_id}"
+        # Served from the stored suggestion; the AI server is only waited on
+        # for a user who has none yet.
         try:
-            suggestion = await ai_service.get_ai_proposal_suggestion(prompt)
+            suggestion = await _cancel_on_disconnect(
+                request, suggestions.get_suggestion(session, user_id)
+            )
         except RuntimeError as exc:
             raise HTTPException(status_code=503, detail=str(exc)) from exc
+        except SQLAlchemyError as exc:  # pragma: no cover - defensive
+            raise HTTPException(
+                status_code=503, detail="Database temporarily unavailable"
+            ) from exc
 
         return AIProposalResponse(
-            title=suggestion["title"],
-            event_date=suggestion["event_date"],
-            location=suggestion["location"],
-            participant_ids=suggestion["participant_ids"],
+            title=suggestion.title,
+            event_date=suggestion.event_date,
+            location=suggestion.location,
+            participant_ids=suggestion.participant_ids,
+            source=suggestion.source,
         )
 
     # Chats -----------------------------------------------------------------
@@ -399,10 +524,23 @@ def create_app() -> FastAPI:
     )
     def list_chat_groups(
         user_id: int = Query(..., description="User identifier"),
+        limit: int | None = Query(None, ge=1, le=500, description="Page size"),
+        oldest_chat_groupe_id: int | None = Query(
+            None, description="chat_groupe_id of the last item of the previous page"
+        ),
+        oldest_message_date: datetime | None = Query(
+            None, description="last_message_date of the last item of the previous page"
+        ),
         session: Session = Depends(db.get_session),
     ) -> list[ChatSummaryResponse]:
         try:
-            summaries = db.fetch_chat_groups(session, user_id)
+            summaries = db.fetch_chat_groups(
+                session,
+                user_id,
+                limit=limit,
+                oldest_message_date=oldest_message_date,
+                oldest_chat_groupe_id=oldest_chat_groupe_id,
+            )
         except SQLAlchemyError as exc:  # pragma: no cover - defensive
             raise HTTPException(
                 status_code=503, detail="Database temporarily unavailable"
@@ -471,6 +609,7 @@ def create_app() -> FastAPI:
                 sender_icon_url=message.sender_icon_url,
                 body=message.body,
                 image_url=message.image_url,
+                image_thumbnail_url=thumbnails.thumbnail_url_for(message.image_url),
                 posted_at=message.posted_at,
             )
             for message in messages
@@ -512,6 +651,7 @@ def create_app() -> FastAPI:
                 sender_icon_url=message.sender_icon_url,
                 body=message.body,
                 image_url=message.image_url,
+                image_thumbnail_url=thumbnails.thumbnail_url_for(message.image_url),
                 posted_at=message.posted_at,
             )
             for message in created
@@ -534,6 +674,31 @@ def create_app() -> FastAPI:
                 status_code=503, detail="Database temporarily unavailable"
             ) from exc
 
+    @app.post(
+        "/api/chat/{group_id}/read",
+        response_model=ChatReadResponse,
+        tags=["chat"],
+    )
+    def mark_chat_read(
+        group_id: int = Path(..., description="Chat group identifier"),
+        payload: ChatReadRequest = Body(...),
+        session: Session = Depends(db.get_session),
+    ) -> ChatReadResponse:
+        try:
+            unread = db.mark_chat_read(
+                session,
+                chat_id=group_id,
+                user_id=payload.user_id,
+                message_id=payload.last_viewed_message_id,
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=404, detail=str(exc)) from exc
+        except SQLAlchemyError as exc:  # pragma: no cover - defensive
+            raise HTTPException(
+                status_code=503, detail="Database temporarily unavailable"
+            ) from exc
+        return ChatReadResponse(new_chat_num=unread)
+
     # Albums ----------------------------------------------------------------
 
     @app.get("/api/albam", response_model=list[AlbumListItem], tags=["album"])
@@ -561,6 +726,9 @@ def create_app() -> FastAPI:
                 albam_id=album.album_id,
                 title=album.title,
                 last_uploaded_image_url=album.last_uploaded_image_url,
+                last_uploaded_thumbnail_url=thumbnails.thumbnail_url_for(
+                    album.last_uploaded_image_url
+                ),
                 image_num=album.image_num,
                 shared_user_num=album.shared_user_num,
             )
@@ -590,6 +758,11 @@ def create_app() -> FastAPI:
         oldest_image_id: int | None = Query(
             None, description="Pagination anchor – fetch images older than this id"
         ),
+        order: str = Query(
+            "uploaded",
+            pattern="^(uploaded|captured)$",
+            description="Sort by upload order or by capture time (EXIF)",
+        ),
         session: Session = Depends(db.get_session),
     ) -> list[AlbumPhotoResponse]:
         try:
@@ -598,6 +771,7 @@ def create_app() -> FastAPI:
                 album_id=album_id,
                 user_id=user_id,
                 oldest_image_id=oldest_image_id,
+                order=order,
             )
         except ValueError as exc:
             raise HTTPException(status_code=404, detail=str(exc)) from exc
@@ -611,6 +785,10 @@ def create_app() -> FastAPI:
                 is_creator=is_creator,
                 image_id=photo.image_id,
                 image_url=photo.image_url,
+                thumbnail_url=thumbnails.thumbnail_url_for(photo.image_url),
+                captured_at=photo.captured_at,
+                width=photo.width,
+                height=photo.height,
             )
             for photo in photos
         ]
@@ -622,11 +800,14 @@ def create_app() -> FastAPI:
         payload: AlbumPhotoUploadRequest = Body(...),
         session: Session = Depends(db.get_session),
     ) -> dict[str, list[int]]:
+        # Header-only EXIF reads, fanned out over a thread pool for batches.
+        metadata = exif.metadata_for_urls(payload.photo)
         try:
             photos = db.add_album_photos(
                 session,
                 album_id=album_id,
                 photo_urls=payload.photo,
+                metadata=metadata,
             )
         except SQLAlchemyError as exc:  # pragma: no cover - defensive
             raise HTTPException(
@@ -696,7 +877,12 @@ def create_app() -> FastAPI:
         session: Session = Depends(db.get_session),
     ) -> list[FriendSearchResult]:
         try:
-            matches = db.search_users(session, input_text=payload.input_text)
+            if payload.user_id is None:
+                matches = db.search_users(session, input_text=payload.input_text)
+            else:
+                matches = db.search_friends_typeahead(
+                    session, user_id=payload.user_id, input_text=payload.input_text
+                )
         except SQLAlchemyError as exc:  # pragma: no cover - defensive
             raise HTTPException(
                 status_code=503, detail="Database temporarily unavailable"
@@ -745,27 +931,36 @@ def create_app() -> FastAPI:
 
     @app.post("/api/user/match-face", response_model=FaceMatchResponse, tags=["user"])
     async def match_face(
+        request: Request,
         file: UploadFile = File(...),
         session: Session = Depends(db.get_session),
     ) -> FaceMatchResponse:
-        try:
-            embedding = await ai_service.generate_embedding_from_image(file)
-            if embedding is None:
-                # 顔が検出されなかった場合
-                return FaceMatchResponse(user_id=None, display_name=None, match_confidence=0.0)
-        except RuntimeError as exc:
-            raise HTTPException(status_code=503, detail=str(exc)) from exc
-
-        try:
-            # The find_user_by_face_embedding function needs to be implemented in db.py
-            # It should take the embedding and return the user with the closest match.
-            # For now, we'll assume it returns a tuple (user, confidence) or (None, None).
-            matched_user, confidence = await db.find_user_by_face_embedding(session, embedding)
+        started = time.monotonic()
+        # Detection, embedding and the per-user lookups share one time budget.
+        with ai_service.request_deadline():
+            try:
+                embedding = await _cancel_on_disconnect(
+                    request, ai_service.generate_embedding_from_image(file)
+                )
+                if embedding is None:
+                    # 顔が検出されなかった場合
+                    return FaceMatchResponse(user_id=None, display_name=None, match_confidence=0.0)
+            except RuntimeError as exc:
+                raise HTTPException(status_code=503, detail=str(exc)) from exc
 
-        except SQLAlchemyError as exc: # pragma: no cover - defensive
-            raise HTTPException(
-                status_code=503, detail="Database temporarily unavailable"
-            ) from exc
+            try:
+                # The find_user_by_face_embedding function needs to be implemented in db.py
+                # It should take the embedding and return the user with the closest match.
+                # For now, we'll assume it returns a tuple (user, confidence) or (None, None).
+                matched_user, confidence = await _cancel_on_disconnect(
+                    request, db.find_user_by_face_embedding(session, embedding)
+                )
+
+            except SQLAlchemyError as exc: # pragma: no cover - defensive
+                raise HTTPException(
+                    status_code=503, detail="Database temporarily unavailable"
+                ) from exc
+        ai_service.record_match_latency(time.monotonic() - started)
 
         if matched_user:
             return FaceMatchResponse(
@@ -795,17 +990,18 @@ def create_app() -> FastAPI:
         face_image: UploadFile = File(...),
         session: Session = Depends(db.get_session),
     ) -> CreateUserResponse:
-        icon_image_url = await ai_service.upload_image(icon_image) if icon_image else None
-        face_image_url = await ai_service.upload_image(face_image)
+        icon_asset = await _store_upload(icon_image) if icon_image else None
+        face_asset = await _store_upload(face_image)
 
         try:
             user_id = db.create_user(
                 session,
                 account_id=account_id,
                 display_name=display_name,
-                icon_image=icon_image_url,
-                face_image=face_image_url,
+                icon_image=icon_asset.url if icon_asset else None,
+                face_image=face_asset.url,
                 profile_text=profile_text,
+                assets=[a for a in (icon_asset, face_asset) if a],
             )
         except SQLAlchemyError as exc:  # pragma: no cover - defensive
             raise HTTPException(
@@ -823,8 +1019,8 @@ def create_app() -> FastAPI:
         face_image: UploadFile | None = File(None),
         session: Session = Depends(db.get_session),
     ) -> None:
-        icon_image_url = await ai_service.upload_image(icon_image) if icon_image else None
-        face_image_url = await ai_service.upload_image(face_image) if face_image else None
+        icon_asset = await _store_upload(icon_image) if icon_image else None
+        face_asset = await _store_upload(face_image) if face_image else None
 
         try:
             db.update_user(
@@ -832,9 +1028,10 @@ def create_app() -> FastAPI:
                 user_id=user_id,
                 account_id=account_id,
                 display_name=display_name,
-                icon_image=icon_image_url,
-                face_image=face_image_url,
+                icon_image=icon_asset.url if icon_asset else None,
+                face_image=face_asset.url if face_asset else None,
                 profile_text=profile_text,
+                assets=[a for a in (icon_asset, face_asset) if a],
             )
         except ValueError as exc:
             raise HTTPException(status_code=404, detail=str(exc)) from exc
@@ -843,6 +1040,92 @@ def create_app() -> FastAPI:
                 status_code=503, detail="Database temporarily unavailable"
             ) from exc
 
+    # Assets ----------------------------------------------------------------
+
+    @app.post("/api/asset", response_model=AssetUploadResponse, tags=["asset"])
+    async def upload_asset(
+        user_id: int = Form(...),
+        file: UploadFile = File(...),
+        session: Session = Depends(db.get_session),
+    ) -> AssetUploadResponse:
+        stored = await _store_upload(file)
+        try:
+            db.record_assets(session, owner_id=user_id, assets=[stored])
+        except SQLAlchemyError as exc:  # pragma: no cover - defensive
+            raise HTTPException(
+                status_code=503, detail="Database temporarily unavailable"
+            ) from exc
+        return AssetUploadResponse(
+            url=stored.url,
+            thumbnail_url=thumbnails.thumbnail_url_for(stored.url),
+        )
+
+    @app.api_route(
+        "/assets/images/{sha256}",
+        methods=["GET", "HEAD"],
+        response_class=Response,
+        tags=["asset"],
+    )
+    async def get_asset(
+        request: Request,
+        sha256: str = Path(..., pattern="^[0-9a-f]{64}$"),
+        session: Session = Depends(db.get_session),
+    ) -> Response:
+        etag = asset_response.etag_for(sha256)
+        # The URL names the content, so a cached copy is always current.
+        if asset_response.etag_matches(request.headers.get("if-none-match"), etag):
+            return asset_response.not_modified(etag)
+        # Blocking query: keep it off the event loop.
+        record = await run_in_threadpool(session.get, db.Asset, sha256)
+        # Rows written before uploads were sniffed may hold a client-supplied type.
+        raster = record is not None and record.content_type in assets.RASTER_CONTENT_TYPES
+        media_type = record.content_type if raster else assets.DEFAULT_CONTENT_TYPE
+        try:
+            return await asset_response.serve(
+                request,
+                assets.path_for(sha256),
+                etag=etag,
+                media_type=media_type,
+                headers=asset_response.content_headers(inline=raster),
+            )
+        except FileNotFoundError as exc:
+            raise HTTPException(status_code=404, detail="Asset not found") from exc
+
+    @app.api_route(
+        "/assets/thumbs/{sha256}/{size}.{extension}",
+        methods=["GET", "HEAD"],
+        response_class=Response,
+        tags=["asset"],
+    )
+    async def get_thumbnail(
+        request: Request,
+        sha256: str = Path(..., pattern="^[0-9a-f]{64}$"),
+        size: int = Path(...),
+        extension: str = Path(...),
+    ) -> Response:
+        if size not in config.THUMBNAIL_SIZES or extension not in thumbnails.FORMATS:
+            raise HTTPException(status_code=404, detail="Unknown thumbnail variant")
+        etag = asset_response.etag_for(f"{sha256}-{size}.{extension}")
+        if asset_response.etag_matches(request.headers.get("if-none-match"), etag):
+            return asset_response.not_modified(etag)
+        path = thumbnails.variant_path(sha256, size, extension)
+        if not path.exists():
+            if not assets.path_for(sha256).exists():
+                raise HTTPException(status_code=404, detail="Asset not found")
+            # Not rendered yet (or rendering failed earlier): render on demand.
+            try:
+                await thumbnails.ensure_thumbnails(sha256)
+            except Exception as exc:
+                raise HTTPException(status_code=404, detail="Thumbnail unavailable") from exc
+        media_type = thumbnails.FORMATS[extension][1]
+        return await asset_response.serve(
+            request,
+            path,
+            etag=etag,
+            media_type=media_type,
+            headers=asset_response.content_headers(inline=True),
+        )
+
     return app
 
 
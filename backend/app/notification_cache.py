@@ -0,0 +1,115 @@
+"""Per-user cache of the badge counts served by ``/api/notification``.
+
+Entries are dropped by the write helpers in db.py that change a user's
+counts, so a cached value is normally exact. Each user has a version that
+every invalidation bumps; a value computed while an invalidation happened is
+not stored, which keeps a slow read from caching counts that a concurrent
+write has already made stale. ``NOTIFICATION_CACHE_TTL`` bounds how long an
+entry may live, which covers writes made by other processes.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Iterable, TypeVar
+
+from . import config
+
+
+V = TypeVar("V")
+
+# Separate count queries /api/notification used to run on every poll.
+_STATEMENTS_PER_UNCACHED_POLL = 3
+
+
+class CounterCache(Generic[V]):
+    """LRU map of user id -> value with precise invalidation and hit statistics."""
+
+    def __init__(self, *, max_entries: int, ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, V]] = OrderedDict()
+        self._versions: dict[int, int] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int) -> tuple[V | None, tuple[int, int]]:
+        """Return the cached value (or None) and a token for :meth:`put`."""
+        now = time.monotonic()
+        with self._lock:
+            token = (self._generation, self._versions.get(user_id, 0))
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1], token
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None, token
+
+    def put(self, user_id: int, value: V, token: tuple[int, int]) -> None:
+        """Store *value* unless the user was invalidated since *token* was taken."""
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            if token != (self._generation, self._versions.get(user_id, 0)):
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            for user_id in user_ids:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+                self._entries.pop(user_id, None)
+                self.invalidations += 1
+            # Versions are only compared against tokens of in-flight reads,
+            # so they can be forgotten once the table grows.
+            if len(self._versions) > 4 * max(self.max_entries, 1):
+                self._versions.clear()
+                self._generation += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+counts: CounterCache = CounterCache(
+    max_entries=config.NOTIFICATION_CACHE_MAX_ENTRIES, ttl=config.NOTIFICATION_CACHE_TTL
+)
+
+
+def invalidate(*user_ids: int) -> None:
+    counts.invalidate(user_ids)
+
+
+def stats() -> dict[str, object]:
+    """Cache statistics plus the statements saved against three counts per poll."""
+    result = counts.stats()
+    polls = result["hits"] + result["misses"]
+    # A miss runs the one combined statement; a hit runs none.
+    result["statements"] = result["misses"]
+    result["statements_saved"] = polls * _STATEMENTS_PER_UNCACHED_POLL - result["misses"]
+    return result
@@ -0,0 +1,230 @@
+"""Precomputed AI proposal suggestions.
+
+Suggestions are generated ahead of time and stored as ``vlm_observations``
+rows (with the generation latency), so ``/api/proposal/ai`` answers from one
+indexed read. A stored suggestion older than ``AI_SUGGESTION_TTL_SECONDS`` is
+still served while a replacement is generated in the background
+(stale-while-revalidate); only a user without any stored suggestion waits for
+the AI server.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.orm import Session
+
+from . import ai_service, config, db, jobs
+
+
+MODEL_VERSION = "generate-proposal"
+
+logger = logging.getLogger(__name__)
+
+_refreshing: dict[int, asyncio.Task] = {}
+_producer: asyncio.Task | None = None
+_hits = 0
+_stale = 0
+_misses = 0
+_generated = 0
+_failures = 0
+_generation_ms = 0
+
+
+def prompt_for(user_id: int) -> str:
+    return f"Create a proposal for user {user_id}"
+
+
+def _is_stale(suggestion: db.AIProposalSuggestion) -> bool:
+    if suggestion.generated_at is None:
+        return True
+    age = datetime.now(timezone.utc) - suggestion.generated_at
+    return age.total_seconds() > config.AI_SUGGESTION_TTL_SECONDS
+
+
+def _store(
+    user_id: int, prompt: str, result: dict, latency_ms: int
+) -> db.AIProposalSuggestion:
+    event_date = result.get("event_date")
+    if isinstance(event_date, str):
+        event_date = datetime.fromisoformat(event_date)
+    session = db.SessionLocal()
+    try:
+        return db.store_ai_proposal_suggestion(
+            session,
+            user_id=user_id,
+            prompt=prompt,
+            title=result["title"],
+            event_date=event_date,
+            location=result.get("location"),
+            participant_ids=result.get("participant_ids") or [],
+            source=result.get("source"),
+            latency_ms=latency_ms,
+            model_version=MODEL_VERSION,
+            keep=config.AI_SUGGESTION_HISTORY,
+        )
+    finally:
+        session.close()
+
+
+async def generate(user_id: int) -> db.AIProposalSuggestion:
+    """Ask the AI server for a suggestion and store it.
+
+    Raises RuntimeError if the AI server cannot be reached.
+    """
+    global _generated, _failures, _generation_ms
+    prompt = prompt_for(user_id)
+    started = time.monotonic()
+    try:
+        result = await ai_service.get_ai_proposal_suggestion(prompt)
+    except RuntimeError:
+        _failures += 1
+        raise
+    latency_ms = int((time.monotonic() - started) * 1000)
+    suggestion = await asyncio.to_thread(_store, user_id, prompt, result, latency_ms)
+    _generated += 1
+    _generation_ms += latency_ms
+    return suggestion
+
+
+def refresh(user_id: int) -> asyncio.Task:
+    """Regenerate a user's suggestion in the background; one refresh per user at a time.
+
+    With ``JOBS_ENABLED`` this only enqueues a job for the worker.
+    """
+    task = _refreshing.get(user_id)
+    if task is not None and not task.done():
+        return task
+
+    async def run() -> None:
+        try:
+            if config.JOBS_ENABLED:
+                await asyncio.to_thread(
+                    jobs.submit,
+                    "suggestions.generate",
+                    {"user_id": user_id},
+                    queue="ai",
+                    dedup_key=f"suggestions:{user_id}",
+                )
+            else:
+                await generate(user_id)
+        except Exception as exc:
+            logger.warning("Refreshing the AI suggestion of user %s failed: %s", user_id, exc)
+
+    task = asyncio.ensure_future(run())
+    _refreshing[user_id] = task
+
+    def _done(done: asyncio.Task) -> None:
+        if _refreshing.get(user_id) is done:
+            del _refreshing[user_id]
+
+    task.add_done_callback(_done)
+    return task
+
+
+async def get_suggestion(session: Session, user_id: int) -> db.AIProposalSuggestion:
+    """Return the stored suggestion, generating one only if none exists yet."""
+    global _hits, _stale, _misses
+    stored = db.fetch_stored_ai_proposal_suggestion(session, user_id)
+    if stored is None:
+        _misses += 1
+        return await generate(user_id)
+    _hits += 1
+    if _is_stale(stored):
+        _stale += 1
+        refresh(user_id)
+    return stored
+
+
+def _users_needing_refresh() -> list[int]:
+    stale_before = datetime.now(timezone.utc) - timedelta(
+        seconds=config.AI_SUGGESTION_TTL_SECONDS
+    )
+    session = db.SessionLocal()
+    try:
+        return db.users_needing_ai_suggestion(
+            session,
+            stale_before=stale_before,
+            limit=config.AI_SUGGESTION_BATCH,
+            model_version=MODEL_VERSION,
+        )
+    finally:
+        session.close()
+
+
+async def produce_once() -> int:
+    """Refresh one batch of users with a missing or stale suggestion.
+
+    Returns the number of users processed.
+    """
+    user_ids = await asyncio.to_thread(_users_needing_refresh)
+    limit = asyncio.Semaphore(max(1, config.AI_SUGGESTION_CONCURRENCY))
+
+    async def one(user_id: int) -> None:
+        async with limit:
+            await refresh(user_id)
+
+    await asyncio.gather(*(one(user_id) for user_id in user_ids))
+    return len(user_ids)
+
+
+async def tick() -> None:
+    """One producer run.
+
+    With ``JOBS_ENABLED`` every API process only submits one deduplicated
+    ``suggestions.produce`` job, so however many processes are running, a
+    single worker scans for users at a time (and ``refresh`` dedups per user).
+    """
+    if config.JOBS_ENABLED:
+        await asyncio.to_thread(
+            jobs.submit, "suggestions.produce", {}, dedup_key="suggestions.produce"
+        )
+    else:
+        await produce_once()
+
+
+async def _produce_forever() -> None:
+    while True:
+        await asyncio.sleep(config.AI_SUGGESTION_PRODUCER_INTERVAL)
+        try:
+            await tick()
+        except Exception:
+            logger.exception("AI suggestion producer tick failed")
+
+
+def start() -> None:
+    """Start the periodic producer (called on application startup)."""
+    global _producer
+    if config.AI_SUGGESTION_PRODUCER_INTERVAL <= 0:
+        return
+    if _producer is None or _producer.done():
+        _producer = asyncio.ensure_future(_produce_forever())
+
+
+async def stop() -> None:
+    """Stop the producer and any refresh still in flight."""
+    global _producer
+    tasks = [task for task in (_producer, *_refreshing.values()) if task is not None]
+    _producer = None
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def stats() -> dict[str, object]:
+    """Return how often requests were answered from stored suggestions."""
+    served = _hits + _misses
+    return {
+        "hits": _hits,
+        "stale": _stale,
+        "misses": _misses,
+        "hit_ratio": round(_hits / served, 3) if served else 0.0,
+        "generated": _generated,
+        "failures": _failures,
+        "refreshing": len(_refreshing),
+        "avg_generation_ms": round(_generation_ms / _generated) if _generated else None,
+        "producer": _producer is not None and not _producer.done(),
+    }
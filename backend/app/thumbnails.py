@@ -0,0 +1,227 @@
+"""Fixed-size JPEG and WebP thumbnails of stored images.
+
+Variants live next to the originals under ``thumbs/ab/cd/<sha256>/`` and are
+named after their size and format, so rendering is idempotent per content
+hash: a variant already on disk is never rendered again. Rendering runs in a
+process pool to keep image decoding off the event loop and out of the GIL.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from . import assets, config
+
+
+THUMBNAIL_URL_PREFIX = "/assets/thumbs/"
+
+# Extension -> (Pillow format, content type).
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpg": ("JPEG", "image/jpeg"),
+}
+
+logger = logging.getLogger(__name__)
+
+_executor: ProcessPoolExecutor | None = None
+_in_flight: dict[str, asyncio.Future] = {}
+_background: set[asyncio.Task] = set()
+_images_rendered = 0
+_variants_written = 0
+_cpu_seconds = 0.0
+_failures = 0
+
+
+def variant_key(sha256: str, size: int, extension: str) -> str:
+    return f"thumbs/{sha256[:2]}/{sha256[2:4]}/{sha256}/{size}.{extension}"
+
+
+def variant_path(sha256: str, size: int, extension: str) -> Path:
+    return assets.storage_root() / variant_key(sha256, size, extension)
+
+
+def thumbnail_url(sha256: str, size: int | None = None, extension: str = "webp") -> str:
+    size = min(config.THUMBNAIL_SIZES) if size is None else size
+    return f"{THUMBNAIL_URL_PREFIX}{sha256}/{size}.{extension}"
+
+
+def thumbnail_url_for(image_url: str | None) -> str | None:
+    """Return the grid thumbnail URL of a local asset URL, or None for other URLs."""
+    digest = assets.digest_from_url(image_url)
+    return thumbnail_url(digest) if digest else None
+
+
+def render_variants(
+    source: str,
+    root: str,
+    sha256: str,
+    sizes: tuple[int, ...],
+    jpeg_quality: int,
+    webp_quality: int,
+) -> tuple[int, float]:
+    """Render the missing variants of one image; runs inside a pool worker.
+
+    The image is decoded once, at reduced scale where the codec supports it,
+    and each smaller size is resized from the previous one. Returns the number
+    of files written and the CPU time spent.
+    """
+    started = time.process_time()
+    root_path = Path(root)
+    missing = {
+        (size, extension)
+        for size in sizes
+        for extension in FORMATS
+        if not (root_path / variant_key(sha256, size, extension)).exists()
+    }
+    if not missing:
+        return 0, time.process_time() - started
+
+    largest = max(size for size, _ in missing)
+    with Image.open(source) as raw:
+        # JPEG can decode straight to 1/2, 1/4 or 1/8 scale.
+        raw.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(raw).convert("RGB")
+
+    written = 0
+    for size in sorted({size for size, _ in missing}, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        for extension in FORMATS:
+            if (size, extension) not in missing:
+                continue
+            target = root_path / variant_key(sha256, size, extension)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_name = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    pil_format = FORMATS[extension][0]
+                    quality = webp_quality if pil_format == "WEBP" else jpeg_quality
+                    image.save(out, format=pil_format, quality=quality)
+                os.replace(temp_name, target)
+            except BaseException:
+                if os.path.exists(temp_name):
+                    os.unlink(temp_name)
+                raise
+            written += 1
+    return written, time.process_time() - started
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: forking a process that already runs an event loop and
+        # threadpool threads is not safe.
+        _executor = ProcessPoolExecutor(
+            max_workers=config.THUMBNAIL_WORKERS or os.cpu_count() or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown() -> None:
+    """Stop the worker pool (called on application shutdown)."""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _record(future: asyncio.Future) -> None:
+    global _images_rendered, _variants_written, _cpu_seconds, _failures
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        _failures += 1
+        logger.warning("Thumbnail rendering failed: %s", future.exception())
+        return
+    written, cpu_seconds = future.result()
+    if written:
+        _images_rendered += 1
+        _variants_written += written
+        _cpu_seconds += cpu_seconds
+
+
+async def ensure_thumbnails(sha256: str) -> None:
+    """Render any missing variants of a stored image; concurrent calls share one job."""
+    loop = asyncio.get_running_loop()
+    future = _in_flight.get(sha256)
+    if future is None or future.get_loop() is not loop:
+        future = loop.run_in_executor(
+            _get_executor(),
+            render_variants,
+            str(assets.path_for(sha256)),
+            str(assets.storage_root()),
+            sha256,
+            tuple(config.THUMBNAIL_SIZES),
+            config.THUMBNAIL_JPEG_QUALITY,
+            config.THUMBNAIL_WEBP_QUALITY,
+        )
+        _in_flight[sha256] = future
+
+        def _done(done: asyncio.Future) -> None:
+            if _in_flight.get(sha256) is done:
+                del _in_flight[sha256]
+            _record(done)
+
+        future.add_done_callback(_done)
+    await asyncio.shield(future)
+
+
+def schedule(stored: assets.StoredAsset) -> None:
+    """Queue thumbnail rendering for a freshly stored image without waiting for it.
+
+    With ``JOBS_ENABLED`` the work goes to the job queue instead of this
+    process's pool.
+    """
+    if not stored.content_type.startswith("image/"):
+        return
+
+    async def run() -> None:
+        if config.JOBS_ENABLED:
+            # Imported here: jobs pulls in db, which the spawned render processes
+            # (they import this module) must not need.
+            from . import jobs
+
+            try:
+                await asyncio.to_thread(
+                    jobs.submit,
+                    "thumbnails.render",
+                    {"sha256": stored.sha256},
+                    queue="thumbnails",
+                    dedup_key=f"thumbnails:{stored.sha256}",
+                )
+            except Exception as exc:
+                logger.warning("Could not enqueue thumbnails of %s: %s", stored.sha256, exc)
+            return
+        try:
+            await ensure_thumbnails(stored.sha256)
+        except Exception:
+            # Already counted and logged by _record.
+            pass
+
+    task = asyncio.ensure_future(run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def stats() -> dict[str, object]:
+    """Return rendering throughput, in images per CPU-second of worker time."""
+    return {
+        "workers": config.THUMBNAIL_WORKERS or os.cpu_count() or 1,
+        "sizes": list(config.THUMBNAIL_SIZES),
+        "images": _images_rendered,
+        "variants": _variants_written,
+        "failures": _failures,
+        "in_flight": len(_in_flight),
+        "images_per_core_second": round(_images_rendered / _cpu_seconds, 2)
+        if _cpu_seconds
+        else None,
+    }
@@ -0,0 +1,335 @@
+"""In-process typeahead index of users for friend search.
+
+Names are matched after NFKC normalization and case folding, with katakana
+folded to hiragana. Prefixes of the account id, the display name and each of
+its words come from one sorted ``array("I")`` of entry codes (slot << 3 |
+field): a flattened trie in which every key sharing a prefix is contiguous, so
+a prefix is a single bisect range. Japanese names have no word breaks, so
+names containing non-ASCII characters also get character unigram and bigram
+postings (sorted ``array("I")`` of slots) for substring matches. Only the
+normalized keys are kept per user; db loads the result rows by primary key.
+
+Results are ranked by friendship proximity to the caller: friends, then
+friends of friends, then everyone else. Within a tier, prefix matches come
+before substring matches. The index is loaded at startup and kept current by
+``db.create_user`` / ``db.update_user``; until it is loaded, db falls back to
+``search_users``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import Callable, Iterable, Iterator, Mapping
+
+from . import config
+from .notification_cache import CounterCache
+
+
+logger = logging.getLogger(__name__)
+
+_KATAKANA_TO_HIRAGANA = str.maketrans(
+    {chr(code): chr(code - 0x60) for code in range(0x30A1, 0x30F7)}
+)
+_END = "\U0010ffff"
+# Entry fields: the account id, the whole display name, then up to six words.
+_ACCOUNT, _NAME, _FIRST_WORD, _FIELDS = 0, 1, 2, 8
+
+
+def normalize(text: str) -> str:
+    """Fold width, case and kana so that typed input matches stored names."""
+    return unicodedata.normalize("NFKC", text).casefold().translate(_KATAKANA_TO_HIRAGANA).strip()
+
+
+def _grams(account: str, name: str) -> set[str]:
+    grams: set[str] = set()
+    for text in (name, account):
+        if text.isascii():
+            continue
+        grams.update(char for char in text if not char.isspace())
+        grams.update(text[index : index + 2] for index in range(len(text) - 1))
+    return grams
+
+
+class TypeaheadIndex:
+    """Prefix and n-gram index over user account ids and display names.
+
+    Not thread-safe on its own; the module-level functions serialize access.
+    """
+
+    def __init__(self) -> None:
+        self._slots: dict[int, int] = {}
+        self._user_ids = array("q")
+        self._accounts: list[str] = []
+        self._names: list[str] = []
+        self._entries = array("I")
+        self._postings: dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @classmethod
+    def build(cls, rows: Iterable[tuple[int, str, str]]) -> "TypeaheadIndex":
+        """Index unique (user_id, account_id, display_name) rows in bulk."""
+        index = cls()
+        codes: list[int] = []
+        for user_id, account_id, display_name in rows:
+            slot = index._append(user_id, account_id, display_name)
+            codes.extend(index._codes(slot))
+            # Slots only grow here, so appending keeps every posting sorted.
+            for gram in _grams(index._accounts[slot], index._names[slot]):
+                index._postings.setdefault(gram, array("I")).append(slot)
+        index._entries = array("I", sorted(codes, key=index._key))
+        return index
+
+    def _append(self, user_id: int, account_id: str, display_name: str) -> int:
+        slot = len(self._user_ids)
+        self._slots[user_id] = slot
+        self._user_ids.append(user_id)
+        self._accounts.append(normalize(account_id or ""))
+        # Display names repeat across users; share one string per name.
+        self._names.append(sys.intern(normalize(display_name or "")))
+        return slot
+
+    def _codes(self, slot: int) -> list[int]:
+        base = slot * _FIELDS
+        codes = [base + _ACCOUNT] if self._accounts[slot] else []
+        words = self._names[slot].split()
+        if words:
+            codes.append(base + _NAME)
+        if len(words) > 1:
+            codes.extend(base + _FIRST_WORD + i for i in range(min(len(words), _FIELDS - 2)))
+        return codes
+
+    def _key(self, code: int) -> str:
+        slot, field = divmod(code, _FIELDS)
+        if field == _ACCOUNT:
+            return self._accounts[slot]
+        if field == _NAME:
+            return self._names[slot]
+        return self._names[slot].split()[field - _FIRST_WORD]
+
+    def put(self, user_id: int, account_id: str, display_name: str) -> None:
+        """Add a user or update an indexed one."""
+        slot = self._slots.get(user_id)
+        if slot is None:
+            slot = self._append(user_id, account_id, display_name)
+            old_grams: set[str] = set()
+        else:
+            old_grams = _grams(self._accounts[slot], self._names[slot])
+            for code in self._codes(slot):
+                position = bisect_left(self._entries, self._key(code), key=self._key)
+                while self._entries[position] != code:
+                    position += 1
+                del self._entries[position]
+            self._accounts[slot] = normalize(account_id or "")
+            self._names[slot] = sys.intern(normalize(display_name or ""))
+        for code in self._codes(slot):
+            self._entries.insert(bisect_left(self._entries, self._key(code), key=self._key), code)
+
+        new_grams = _grams(self._accounts[slot], self._names[slot])
+        for gram in old_grams - new_grams:
+            posting = self._postings[gram]
+            del posting[bisect_left(posting, slot)]
+            if not posting:
+                del self._postings[gram]
+        for gram in new_grams - old_grams:
+            posting = self._postings.setdefault(gram, array("I"))
+            if not posting or posting[-1] < slot:
+                posting.append(slot)
+            else:
+                posting.insert(bisect_left(posting, slot), slot)
+
+    def _prefix_range(self, prefix: str) -> range:
+        start = bisect_left(self._entries, prefix, key=self._key)
+        return range(start, bisect_left(self._entries, prefix + _END, start, key=self._key))
+
+    def _substring_posting(self, query: str) -> array:
+        grams = [query] if len(query) == 1 else [query[i : i + 2] for i in range(len(query) - 1)]
+        postings = [self._postings.get(gram) for gram in grams]
+        if any(posting is None for posting in postings):
+            return array("I")
+        return min(postings, key=len)
+
+    def _candidates(self, query: str, substring: bool) -> Iterator[int]:
+        """Slots that may match, prefix matches first in key order."""
+        slots = (self._entries[position] // _FIELDS for position in self._prefix_range(query))
+        if substring:
+            slots = chain(slots, self._substring_posting(query))
+        return slots
+
+    def _match(self, slot: int, query: str, substring: bool) -> int | None:
+        """0 for a prefix match, 1 for a substring match, None otherwise."""
+        name = self._names[slot]
+        if self._accounts[slot].startswith(query) or any(
+            key.startswith(query) for key in (name, *name.split())
+        ):
+            return 0
+        if substring and (query in name or query in self._accounts[slot]):
+            return 1
+        return None
+
+    def search(
+        self,
+        text: str,
+        *,
+        proximity: Mapping[int, int],
+        exclude: int | None = None,
+        limit: int = 20,
+    ) -> list[int]:
+        """Return the ids of up to *limit* users matching *text*, nearest first.
+
+        *proximity* maps user ids to their distance from the caller (1 for
+        friends, 2 for friends of friends); everyone else ranks after them.
+        """
+        query = normalize(text)
+        if not query or limit <= 0:
+            return []
+        # ASCII input matches word prefixes; Japanese input also matches anywhere.
+        substring = not query.isascii()
+        candidates = len(self._prefix_range(query))
+        if substring:
+            candidates += len(self._substring_posting(query))
+
+        if candidates <= len(proximity):
+            # Few candidates: rank each of them directly.
+            ranked: dict[int, tuple[int, int, str]] = {}
+            for slot in self._candidates(query, substring):
+                user_id = self._user_ids[slot]
+                quality = self._match(slot, query, substring)
+                if user_id != exclude and quality is not None and user_id not in ranked:
+                    ranked[user_id] = (proximity.get(user_id, 3), quality, self._names[slot])
+            return sorted(ranked, key=ranked.__getitem__)[:limit]
+
+        ranked_near = []
+        for user_id, distance in proximity.items():
+            slot = self._slots.get(user_id)
+            if slot is None or user_id == exclude:
+                continue
+            quality = self._match(slot, query, substring)
+            if quality is not None:
+                ranked_near.append((distance, quality, self._names[slot], user_id))
+        ranked_near.sort()
+        found = [user_id for *_, user_id in ranked_near[:limit]]
+
+        if len(found) < limit:
+            seen = set(found)
+            for slot in self._candidates(query, substring):
+                user_id = self._user_ids[slot]
+                if user_id in seen or user_id in proximity or user_id == exclude:
+                    continue
+                if self._match(slot, query, substring) is None:
+                    continue
+                seen.add(user_id)
+                found.append(user_id)
+                if len(found) == limit:
+                    break
+        return found
+
+    def stats(self) -> dict[str, int]:
+        postings = sum(len(posting) for posting in self._postings.values())
+        return {
+            "users": len(self._slots),
+            "prefix_entries": len(self._entries),
+            "grams": len(self._postings),
+            "postings": postings,
+            "array_bytes": (len(self._entries) + postings) * 4 + len(self._user_ids) * 8,
+        }
+
+
+# Friends (1) and friends of friends (2) of each recent caller.
+proximity: CounterCache[dict[int, int]] = CounterCache(
+    max_entries=config.TYPEAHEAD_PROXIMITY_MAX_ENTRIES, ttl=config.TYPEAHEAD_PROXIMITY_TTL
+)
+
+_lock = threading.Lock()
+_index: TypeaheadIndex | None = None
+# Writes seen while the index is loading, replayed once it is built.
+_pending: list[tuple[int, str, str]] | None = None
+_loader: asyncio.Task | None = None
+_searches = 0
+_fallbacks = 0
+
+
+def ready() -> bool:
+    return _index is not None
+
+
+def put(user_id: int, account_id: str, display_name: str) -> None:
+    """Record a created or updated user (called by db after commit)."""
+    with _lock:
+        if _index is not None:
+            _index.put(user_id, account_id, display_name)
+        if _pending is not None:
+            _pending.append((user_id, account_id, display_name))
+
+
+def load(rows: Iterable[tuple[int, str, str]]) -> int:
+    """Replace the index with one built from *rows*; returns the number of users."""
+    global _index, _pending
+    with _lock:
+        _pending = []
+    index = TypeaheadIndex.build(rows)
+    with _lock:
+        for row in _pending or ():
+            index.put(*row)
+        _pending = None
+        _index = index
+    return len(index)
+
+
+def search(
+    text: str, *, proximity: Mapping[int, int], exclude: int | None, limit: int
+) -> list[int] | None:
+    """Search the index, or return None if it is not loaded yet."""
+    global _searches, _fallbacks
+    with _lock:
+        if _index is None:
+            _fallbacks += 1
+            return None
+        _searches += 1
+        return _index.search(text, proximity=proximity, exclude=exclude, limit=limit)
+
+
+def start(loader: Callable[[], int]) -> None:
+    """Load the index in the background (called on application startup)."""
+    global _loader
+    if not config.TYPEAHEAD_ENABLED or (_loader is not None and not _loader.done()):
+        return
+
+    async def run() -> None:
+        try:
+            users = await asyncio.to_thread(loader)
+            logger.info("Typeahead index loaded with %s users", users)
+        except Exception:
+            logger.exception("Loading the typeahead index failed")
+
+    _loader = asyncio.ensure_future(run())
+
+
+def reset() -> None:
+    """Drop the index; searches fall back to SQL until the next load."""
+    global _index, _pending
+    with _lock:
+        _index = None
+        _pending = None
+    proximity.clear()
+
+
+def stats() -> dict[str, object]:
+    with _lock:
+        result: dict[str, object] = {
+            "ready": _index is not None,
+            "searches": _searches,
+            "fallbacks": _fallbacks,
+            "proximity": proximity.stats(),
+        }
+        if _index is not None:
+            result.update(_index.stats())
+    return result
@@ -0,0 +1,75 @@
+"""Background job worker: ``python -m backend.app.worker [--queues ai:2,thumbnails:2]``.
+
+Registers the handlers for the work the API process enqueues when
+``JOBS_ENABLED`` is set and runs them until SIGINT/SIGTERM.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import signal
+
+from . import ai_service, config, db, jobs, suggestions, thumbnails
+
+
+@jobs.handler("thumbnails.render")
+async def render_thumbnails(payload: dict) -> None:
+    await thumbnails.ensure_thumbnails(payload["sha256"])
+
+
+@jobs.handler("suggestions.generate")
+async def generate_suggestion(payload: dict) -> None:
+    await suggestions.generate(int(payload["user_id"]))
+
+
+@jobs.handler("suggestions.produce")
+async def produce_suggestions(payload: dict) -> None:
+    await suggestions.produce_once()
+
+
+@jobs.handler("chat.repair_unread_counts")
+async def repair_unread_counts(payload: dict) -> None:
+    def repair() -> int:
+        session = db.SessionLocal()
+        try:
+            return db.repair_unread_counts(session, chat_ids=payload.get("chat_ids"))
+        finally:
+            session.close()
+
+    repaired = await asyncio.to_thread(repair)
+    if repaired:
+        logging.getLogger(__name__).warning("Repaired %s drifted unread counters", repaired)
+
+
+async def run(queues: dict[str, int]) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    worker = jobs.Worker(queues)
+    await ai_service.open_client()
+    try:
+        logging.getLogger(__name__).info("Worker %s serving %s", worker.worker_id, queues)
+        await worker.run(stop)
+    finally:
+        await ai_service.close_client()
+        thumbnails.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--queues",
+        default=",".join(config.JOB_QUEUES),
+        help="Comma-separated name:concurrency pairs (default: JOB_QUEUES).",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    asyncio.run(run(jobs.parse_queues(args.queues.split(","))))
+
+
+if __name__ == "__main__":
+    main()
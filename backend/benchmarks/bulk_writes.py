@@ -0,0 +1,109 @@
+"""Measure the batched write paths: chat message batches and album photo uploads.
+
+    python -m backend.benchmarks.bulk_writes --messages 50 --photos 200 --rounds 20
+
+Runs ``create_chat_messages`` with a batch of messages and ``add_album_photos``
+with a batch of photo URLs against a scratch SQLite database (or
+``--database-url``). Reports the median milliseconds per batch and the number
+of SQL statements each batch issues.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+
+def _measure(db, session, rounds: int, batch: Callable[[int], object]) -> tuple[float, int]:
+    from sqlalchemy import event
+
+    statements = 0
+
+    def count(*_args) -> None:
+        nonlocal statements
+        statements += 1
+
+    timings = []
+    for index in range(rounds):
+        statements = 0
+        event.listen(db.engine, "before_cursor_execute", count)
+        started = time.perf_counter()
+        try:
+            batch(index)
+        finally:
+            elapsed = time.perf_counter() - started
+            event.remove(db.engine, "before_cursor_execute", count)
+        timings.append(elapsed * 1000)
+    return statistics.median(timings), statements
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--photos", type=int, default=200)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--database-url", help="default: a temporary SQLite file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tmp}/bench.sqlite3"
+        from backend.app import db
+
+        db.Base.metadata.create_all(bind=db.engine)
+        session = db.SessionLocal()
+        try:
+            member_ids = []
+            for index in range(args.members):
+                user = db.User(
+                    assets_id=f"bench-{index}",
+                    account_id=f"bench_{index}",
+                    display_name=f"Bench {index}",
+                )
+                session.add(user)
+                session.flush()
+                member_ids.append(user.id)
+            session.commit()
+            sender_id = member_ids[0]
+            chat_id = db.create_chat_group(session, title="Bench", member_ids=member_ids)
+            album_id = db.create_album(session, user_id=sender_id, title="Bench")
+
+            messages = [db.NewChatMessage(body=f"message {n}") for n in range(args.messages)]
+            chat_ms, chat_statements = _measure(
+                db,
+                session,
+                args.rounds,
+                lambda _: db.create_chat_messages(session, chat_id, sender_id, messages),
+            )
+            photo_ms, photo_statements = _measure(
+                db,
+                session,
+                args.rounds,
+                lambda round_: db.add_album_photos(
+                    session,
+                    album_id=album_id,
+                    photo_urls=[
+                        f"https://example.com/{round_}/{n}.jpg" for n in range(args.photos)
+                    ],
+                ),
+            )
+        finally:
+            session.close()
+
+        print(f"{db.engine.url.get_backend_name()}, median of {args.rounds} rounds")
+        print(
+            f"create_chat_messages x{args.messages}: "
+            f"{chat_ms:8.2f} ms/batch {chat_statements:5d} statements"
+        )
+        print(
+            f"add_album_photos     x{args.photos}: "
+            f"{photo_ms:8.2f} ms/batch {photo_statements:5d} statements"
+        )
+
+
+if __name__ == "__main__":
+    main()
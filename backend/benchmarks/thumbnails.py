@@ -0,0 +1,92 @@
+"""Measure thumbnail rendering throughput.
+
+    python -m backend.benchmarks.thumbnails --images 64 --size 4032x3024 --workers 1,2,4
+
+Synthetic camera-sized JPEGs are stored in a temporary asset store and
+rendered through a process pool for each worker count. Reports wall-clock
+images/sec, images/sec per worker, and images per CPU-second of worker time.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from backend.app import assets, config, thumbnails
+
+
+def _synthetic_photo(width: int, height: int, seed: int) -> bytes:
+    image = Image.radial_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for index in range(40):
+        x = (seed * 97 + index * 211) % width
+        y = (seed * 53 + index * 137) % height
+        draw.ellipse((x, y, x + width // 8, y + height // 8), fill=(index * 6, seed % 255, 120))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _run(root: Path, digests: list[str], workers: int, sizes: tuple[int, ...]) -> dict[str, float]:
+    thumbs = root / "thumbs"
+    if thumbs.exists():
+        for path in sorted(thumbs.rglob("*"), reverse=True):
+            path.unlink() if path.is_file() else path.rmdir()
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(
+            pool.map(
+                thumbnails.render_variants,
+                [str(root / assets.storage_key(digest)) for digest in digests],
+                [str(root)] * len(digests),
+                digests,
+                [sizes] * len(digests),
+                [config.THUMBNAIL_JPEG_QUALITY] * len(digests),
+                [config.THUMBNAIL_WEBP_QUALITY] * len(digests),
+            )
+        )
+    elapsed = time.perf_counter() - started
+    cpu_seconds = sum(cpu for _, cpu in results)
+    return {
+        "images_per_sec": len(digests) / elapsed,
+        "images_per_sec_per_worker": len(digests) / elapsed / workers,
+        "images_per_cpu_second": len(digests) / cpu_seconds if cpu_seconds else 0.0,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--size", default="4032x3024", help="source image WxH")
+    parser.add_argument("--workers", default=str(os.cpu_count() or 1), help="comma-separated")
+    args = parser.parse_args(argv)
+    width, height = (int(value) for value in args.size.split("x"))
+    sizes = tuple(config.THUMBNAIL_SIZES)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.ASSET_STORAGE_DIR = tmp
+        digests = []
+        for seed in range(args.images):
+            photo = io.BytesIO(_synthetic_photo(width, height, seed))
+            digests.append(assets.store_stream(photo).sha256)
+        formats = list(thumbnails.FORMATS)
+        print(f"{args.images} images {width}x{height} -> sizes {list(sizes)} x {formats}")
+        print(f"{'workers':>7} {'img/s':>8} {'img/s/worker':>13} {'img/cpu-s':>10}")
+        for workers in (int(value) for value in args.workers.split(",")):
+            result = _run(Path(tmp), digests, workers, sizes)
+            print(
+                f"{workers:>7} {result['images_per_sec']:>8.1f} "
+                f"{result['images_per_sec_per_worker']:>13.1f} "
+                f"{result['images_per_cpu_second']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
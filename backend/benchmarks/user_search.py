@@ -0,0 +1,116 @@
+"""Measure ``search_users`` with and without the trigram index.
+
+    python -m backend.benchmarks.user_search --users 1000000 --rounds 5
+
+Fills a scratch SQLite database (or ``--database-url``) with users whose
+display names mix Japanese and Latin names, then reports the median
+milliseconds per search for a set of inputs. The baseline is the same query
+with the trigram path turned off: the FTS5 table is skipped on SQLite, and
+index scans are disabled on PostgreSQL.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+SURNAMES = [
+    ("山田", "yamada"), ("田中", "tanaka"), ("佐藤", "sato"), ("鈴木", "suzuki"),
+    ("高橋", "takahashi"), ("伊藤", "ito"), ("渡辺", "watanabe"), ("中村", "nakamura"),
+    ("小林", "kobayashi"), ("加藤", "kato"), ("吉田", "yoshida"), ("山本", "yamamoto"),
+    ("松本", "matsumoto"), ("井上", "inoue"), ("木村", "kimura"), ("林", "hayashi"),
+]
+GIVEN_NAMES = [
+    ("太郎", "taro"), ("花子", "hanako"), ("一郎", "ichiro"), ("美咲", "misaki"),
+    ("翔太", "shota"), ("さくら", "sakura"), ("健", "ken"), ("ゆい", "yui"),
+    ("大輔", "daisuke"), ("陽菜", "hina"), ("蓮", "ren"), ("葵", "aoi"),
+]
+LATIN_NAMES = ["Alice", "Bob", "Carol", "Dave", "Emma", "Liam", "Noah", "Olivia"]
+QUERIES = ["田太郎", "山本さくら", "kobayashi.ren", "Olivia", "ゆい", "zzzz"]
+
+
+def _rows(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    for index in range(count):
+        (surname, surname_romaji), (given, given_romaji) = (
+            rng.choice(SURNAMES),
+            rng.choice(GIVEN_NAMES),
+        )
+        if index % 5 == 0:
+            latin = rng.choice(LATIN_NAMES)
+            display_name = f"{latin} {surname_romaji.title()}"
+        else:
+            display_name = f"{surname}{given}"
+        yield {
+            "assets_id": "",
+            "account_id": f"{surname_romaji}.{given_romaji}{index}",
+            "display_name": display_name,
+        }
+
+
+def _fill(db, session, count: int, chunk: int = 20_000) -> None:
+    from sqlalchemy import insert
+
+    batch = []
+    for row in _rows(count):
+        batch.append(row)
+        if len(batch) == chunk:
+            session.execute(insert(db.User.__table__), batch)
+            session.commit()
+            batch = []
+    if batch:
+        session.execute(insert(db.User.__table__), batch)
+        session.commit()
+
+
+def _set_indexed(db, session, indexed: bool) -> None:
+    from sqlalchemy import text
+
+    if session.get_bind().dialect.name == "postgresql":
+        value = "on" if indexed else "off"
+        session.execute(text(f"SET enable_bitmapscan = {value}"))
+        session.execute(text(f"SET enable_indexscan = {value}"))
+    else:
+        db._SQLITE_USER_SEARCH = indexed
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--database-url", help="default: a temporary SQLite file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tmp}/bench.sqlite3"
+        from backend.app import db
+
+        db.Base.metadata.create_all(bind=db.engine)
+        session = db.SessionLocal()
+        try:
+            started = time.perf_counter()
+            _fill(db, session, args.users)
+            print(f"inserted {args.users} users in {time.perf_counter() - started:.1f} s")
+            print(f"{'input':<16}{'matches':>8}{'indexed ms':>12}{'scan ms':>10}")
+            for text in QUERIES:
+                timings = {}
+                for indexed in (True, False):
+                    _set_indexed(db, session, indexed)
+                    samples = []
+                    for _ in range(args.rounds):
+                        begin = time.perf_counter()
+                        found = db.search_users(session, input_text=text)
+                        samples.append((time.perf_counter() - begin) * 1000)
+                    timings[indexed] = statistics.median(samples)
+                print(f"{text:<16}{len(found):>8}{timings[True]:>12.2f}{timings[False]:>10.2f}")
+        finally:
+            _set_indexed(db, session, True)
+            session.close()
+
+
+if __name__ == "__main__":
+    main()
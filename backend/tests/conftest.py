@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import importlib
 import os
+import shutil
+import sqlite3
 import sys
 from contextlib import contextmanager
 from typing import Generator, Tuple
@@ -29,8 +31,25 @@ def _override_env(values: dict[str, str]) -> Generator[None, None, None]:
 
 
 def _reload_backend_modules() -> Tuple[object, object]:
-    for module_name in ("backend.app.main", "backend.app.db", "backend.app.config"):
+    for module_name in (
+        "backend.app.main",
+        "backend.app.db",
+        "backend.app.notification_cache",
+        "backend.app.typeahead",
+        "backend.app.backfills",
+        "backend.app.worker",
+        "backend.app.suggestions",
+        "backend.app.jobs",
+        "backend.app.thumbnails",
+        "backend.app.exif",
+        "backend.app.assets",
+        "backend.app.config",
+    ):
         sys.modules.pop(module_name, None)
+        # `from . import x` prefers the package attribute over sys.modules.
+        package, _, name = module_name.rpartition(".")
+        if package in sys.modules:
+            vars(sys.modules[package]).pop(name, None)
 
     config_module = importlib.import_module("backend.app.config")
     config_module = importlib.reload(config_module)
@@ -50,6 +69,38 @@ def app_with_db(tmp_path_factory) -> Generator[Tuple[object, object], None, None
         "DB_DRIVER": "sqlite",
         "DB_NAME": str(db_path),
         "DATABASE_ECHO": "0",
+        "ASSET_STORAGE_DIR": str(db_dir / "assets"),
+    }
+    with _override_env(env):
+        app_module, db_module = _reload_backend_modules()
+        try:
+            yield app_module, db_module
+        finally:
+            db_module.engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def legacy_app_with_db(
+    tmp_path_factory, legacy_rows
+) -> Generator[Tuple[object, object], None, None]:
+    """Boot the app on a copy of the committed database, whose tables predate
+    the current models, after inserting ``legacy_rows`` (SQL statements)."""
+    db_dir = tmp_path_factory.mktemp("legacy_backend_tests")
+    db_path = db_dir / "legacy.sqlite3"
+    shutil.copyfile(os.path.join(ROOT_DIR, "ng_2512.sqlite3"), db_path)
+    connection = sqlite3.connect(db_path)
+    try:
+        for statement in legacy_rows:
+            connection.execute(statement)
+        connection.commit()
+    finally:
+        connection.close()
+    env = {
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "DB_DRIVER": "sqlite",
+        "DB_NAME": str(db_path),
+        "DATABASE_ECHO": "0",
+        "ASSET_STORAGE_DIR": str(db_dir / "assets"),
     }
     with _override_env(env):
         app_module, db_module = _reload_backend_modules()
@@ -0,0 +1,175 @@
+"""Tests for client-side routing across AI-server replicas."""
+
+from __future__ import annotations
+
+import asyncio
+import importlib
+import time
+
+import httpx
+import pytest
+
+
+@pytest.fixture(scope="module")
+def ai_routing(app_with_db):
+    return importlib.import_module("backend.app.ai_routing")
+
+
+@pytest.fixture(scope="module")
+def ai_service(app_with_db):
+    return importlib.import_module("backend.app.ai_service")
+
+
+def test_pick_prefers_least_outstanding(ai_routing) -> None:
+    pool = ai_routing.ReplicaPool("detection", ["http://a", "http://b"])
+    busy, idle = pool.replicas
+    with pool.track(busy):
+        assert pool.pick() is idle
+        with pool.track(idle), pool.track(idle):
+            assert pool.pick() is busy
+
+
+def test_failing_replica_is_ejected_and_readmitted(ai_routing) -> None:
+    pool = ai_routing.ReplicaPool(
+        "detection", ["http://a", "http://b"], max_failures=2, ejection_seconds=0.05
+    )
+    bad, good = pool.replicas
+    pool.record_failure(bad)
+    pool.record_failure(bad)
+    assert all(pool.pick() is good for _ in range(10))
+
+    time.sleep(0.06)
+    with pool.track(good):
+        assert pool.pick() is bad
+    assert bad.consecutive_failures == 0
+
+
+def test_slow_replica_is_ejected(ai_routing) -> None:
+    pool = ai_routing.ReplicaPool("generation", ["http://a", "http://b"], slow_seconds=1.0)
+    slow, fast = pool.replicas
+    pool.record_success(slow, 5.0)
+    assert not slow.is_available(time.monotonic())
+    assert pool.pick() is fast
+
+
+def test_all_ejected_still_routes(ai_routing) -> None:
+    pool = ai_routing.ReplicaPool("detection", ["http://a"], max_failures=1)
+    only = pool.replicas[0]
+    pool.record_failure(only)
+    assert pool.pick() is only
+
+
+def test_endpoint_kinds_use_dedicated_replicas(ai_routing, monkeypatch) -> None:
+    monkeypatch.setattr(ai_routing.config, "AI_DETECTION_SERVER_URLS", ["http://vision"])
+    monkeypatch.setattr(ai_routing.config, "AI_GENERATION_SERVER_URLS", ["http://llm"])
+    ai_routing.reset_pools()
+    try:
+        assert ai_routing.pool_for_path("/embedding").replicas[0].url == "http://vision"
+        assert ai_routing.pool_for_path("/generate-proposal").replicas[0].url == "http://llm"
+    finally:
+        ai_routing.reset_pools()
+
+
+def test_connect_error_retries_on_other_replica(ai_routing, ai_service, monkeypatch) -> None:
+    monkeypatch.setattr(ai_routing.config, "AI_DETECTION_SERVER_URLS", ["http://down", "http://up"])
+    ai_routing.reset_pools()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "down":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={"faces": [{"box": [1, 2, 3, 4]}]})
+
+    monkeypatch.setattr(
+        ai_service, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    try:
+        for _ in range(4):
+            faces = asyncio.run(ai_service.detect_faces_from_image_content(b"jpeg"))
+            assert faces == [{"box": [1, 2, 3, 4]}]
+        stats = {entry["url"]: entry for entry in ai_routing.stats()["detection"]}
+        assert stats["http://up"]["requests_total"] == 4
+    finally:
+        ai_routing.reset_pools()
+
+
+def test_circuit_breaker_opens_and_half_open_probe_closes(ai_routing) -> None:
+    breaker = ai_routing.CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, open_seconds=0.05)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_success(0.01)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(ai_routing.CircuitOpen):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == breaker.HALF_OPEN
+    with pytest.raises(ai_routing.CircuitOpen):
+        breaker.before_call()
+    breaker.record_success(0.01)
+    assert breaker.state == breaker.CLOSED
+
+
+def test_circuit_breaker_trips_on_slow_calls(ai_routing) -> None:
+    breaker = ai_routing.CircuitBreaker(window=2, min_calls=2, slow_seconds=1.0, slow_rate=0.5)
+    breaker.before_call()
+    breaker.record_success(0.1)
+    breaker.before_call()
+    breaker.record_success(3.0)
+    assert breaker.state == breaker.OPEN
+
+
+def test_open_circuit_fails_fast_without_traffic(ai_routing, ai_service, monkeypatch) -> None:
+    ai_routing.reset_pools()
+    calls: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        return httpx.Response(500)
+
+    monkeypatch.setattr(
+        ai_service, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    try:
+        breaker = ai_routing.get_endpoint("/generate-proposal").breaker
+        breaker.min_calls = 2
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                asyncio.run(ai_service._post_ai("/generate-proposal", json={"prompt": "x"}))
+        with pytest.raises(ai_routing.CircuitOpen):
+            asyncio.run(ai_service._post_ai("/generate-proposal", json={"prompt": "x"}))
+        assert len(calls) == 2
+    finally:
+        ai_routing.reset_pools()
+
+
+def test_slow_primary_is_hedged_to_second_replica(ai_routing, ai_service, monkeypatch) -> None:
+    monkeypatch.setattr(ai_routing.config, "AI_DETECTION_SERVER_URLS", ["http://slow", "http://fast"])
+    monkeypatch.setattr(ai_routing.config, "AI_HEDGE_ENDPOINTS", ["/detect-faces"])
+    monkeypatch.setattr(ai_routing.config, "AI_HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(ai_routing.config, "AI_HEDGE_MIN_DELAY", 0.01)
+    ai_routing.reset_pools()
+    monkeypatch.setattr(ai_routing.random, "shuffle", lambda items: None)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "slow":
+            await asyncio.sleep(1.0)
+        return httpx.Response(200, json={"faces": [{"box": [0, 0, 1, 1]}]})
+
+    monkeypatch.setattr(
+        ai_service, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+    try:
+        endpoint = ai_routing.get_endpoint("/detect-faces")
+        endpoint.latencies.append(0.02)
+        started = time.monotonic()
+        faces = asyncio.run(ai_service.detect_faces_from_image_content(b"jpeg"))
+        assert faces == [{"box": [0, 0, 1, 1]}]
+        assert time.monotonic() - started < 0.5
+        assert endpoint.hedges_sent == 1
+        assert endpoint.hedges_won == 1
+    finally:
+        ai_routing.reset_pools()
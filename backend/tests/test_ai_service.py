@@ -0,0 +1,420 @@
+"""Tests for the backend's AI-server client helpers."""
+
+from __future__ import annotations
+
+import asyncio
+import importlib
+import json
+from datetime import timedelta
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def ai_service(app_with_db):
+    return importlib.import_module("backend.app.ai_service")
+
+
+@pytest.fixture
+def mock_ai_server(ai_service, monkeypatch):
+    """Route the shared AI client through an in-process handler."""
+
+    def install(handler) -> None:
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(ai_service, "_client", client)
+
+    return install
+
+
+def test_request_deadline_nesting_keeps_tighter_budget(ai_service) -> None:
+    with ai_service.request_deadline(0.5) as outer:
+        with ai_service.request_deadline(30.0) as inner:
+            assert inner == outer
+            assert ai_service.remaining_budget() <= 0.5
+
+
+def test_remaining_budget_raises_after_deadline(ai_service) -> None:
+    with ai_service.request_deadline(0.0):
+        with pytest.raises(ai_service.DeadlineExceeded):
+            ai_service.remaining_budget()
+
+
+def test_post_ai_sends_budget_header(ai_service, mock_ai_server) -> None:
+    seen: dict[str, str] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen["budget"] = request.headers[ai_service.BUDGET_HEADER]
+        return httpx.Response(200, json={"ok": True})
+
+    mock_ai_server(handler)
+
+    async def run() -> None:
+        with ai_service.request_deadline(5.0):
+            await ai_service._post_ai("/generate-proposal", json={"prompt": "x"})
+
+    asyncio.run(run())
+    assert 0 < int(seen["budget"]) <= 5000
+
+
+def test_post_ai_maps_gateway_timeout_to_deadline(ai_service, mock_ai_server) -> None:
+    mock_ai_server(lambda request: httpx.Response(504, json={"detail": "Deadline exceeded"}))
+
+    with pytest.raises(ai_service.DeadlineExceeded):
+        asyncio.run(ai_service._post_ai("/embedding"))
+
+
+
+def test_spent_budget_does_not_count_against_the_circuit(ai_service, mock_ai_server) -> None:
+    mock_ai_server(lambda request: httpx.Response(504, json={"detail": "Deadline exceeded"}))
+    breaker = ai_service.ai_routing.get_endpoint("/embedding").breaker
+    breaker.outcomes.clear()
+
+    async def run() -> None:
+        with ai_service.request_deadline(0.0):
+            await ai_service._post_ai("/embedding")
+
+    with pytest.raises(ai_service.DeadlineExceeded):
+        asyncio.run(run())
+    assert list(breaker.outcomes) == []
+
+    with pytest.raises(ai_service.DeadlineExceeded):
+        asyncio.run(ai_service._post_ai("/embedding"))
+    assert list(breaker.outcomes) == [(False, False)]
+    breaker.outcomes.clear()
+
+@pytest.mark.parametrize("failure", ["connect", "gateway_timeout", "circuit_open"])
+def test_face_detection_returns_no_faces_when_the_ai_server_fails(
+    ai_service, mock_ai_server, monkeypatch, failure
+) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        if failure == "connect":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(504, json={"detail": "Deadline exceeded"})
+
+    mock_ai_server(handler)
+    if failure == "circuit_open":
+
+        async def open_circuit(*args, **kwargs):
+            raise ai_service.ai_routing.CircuitOpen("AI server circuit is open")
+
+        monkeypatch.setattr(ai_service, "_post_ai", open_circuit)
+
+    assert asyncio.run(ai_service.detect_faces_from_image_content(_jpeg(64, 48))) == []
+
+
+def test_proposal_suggestion_requests_title_only(ai_service, mock_ai_server) -> None:
+    seen: dict[str, object] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen["payload"] = json.loads(request.content)
+        return httpx.Response(200, json={"title": "カフェの会", "description": "", "source": "template"})
+
+    mock_ai_server(handler)
+
+    suggestion = asyncio.run(ai_service.get_ai_proposal_suggestion("カフェ"))
+    assert seen["payload"]["title_only"] is True
+    assert suggestion["title"] == "カフェの会"
+    assert suggestion["source"] == "template"
+
+
+def test_shared_client_follows_app_lifespan(ai_service, app_with_db) -> None:
+    app_module, _ = app_with_db
+    with TestClient(app_module.app) as client:
+        assert ai_service._client is not None
+        stats = client.get("/health/ai").json()["pool"]
+        assert stats["open"] is True
+        assert stats["max_connections"] > 0
+    assert ai_service._client is None
+
+
+def test_identical_concurrent_calls_share_one_upstream_request(ai_service, mock_ai_server) -> None:
+    calls: list[bytes] = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.content)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"faces": [{"box": [0, 0, 5, 5]}]})
+
+    mock_ai_server(handler)
+    before = ai_service.singleflight_stats()
+
+    async def run() -> list[list[dict]]:
+        return await asyncio.gather(
+            *(ai_service.detect_faces_from_image_content(b"same-image") for _ in range(5)),
+            ai_service.detect_faces_from_image_content(b"other-image"),
+        )
+
+    results = asyncio.run(run())
+    assert all(result == [{"box": [0, 0, 5, 5]}] for result in results)
+    assert len(calls) == 2
+    after = ai_service.singleflight_stats()
+    assert after["coalesced"] - before["coalesced"] == 4
+    assert after["in_flight"] == 0
+
+
+def test_single_flight_survives_one_cancelled_waiter(ai_service) -> None:
+    started: list[int] = []
+
+    async def upstream() -> str:
+        started.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def run() -> str:
+        first = asyncio.ensure_future(ai_service._single_flight("key", upstream))
+        second = asyncio.ensure_future(ai_service._single_flight("key", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "done"
+    assert started == [1]
+
+
+def _jpeg(width: int, height: int) -> bytes:
+    from PIL import Image
+
+    images = importlib.import_module("backend.app.images")
+    return images.encode_jpeg(Image.new("RGB", (width, height), (200, 120, 80)), 90)
+
+
+def test_prepare_for_detection_downscales_and_boxes_map_back() -> None:
+    images = importlib.import_module("backend.app.images")
+    prepared = images.prepare_for_detection(_jpeg(2560, 1280), max_side=640, quality=85)
+    assert prepared.scale == 4.0
+    assert images.decode(prepared.payload).size == (640, 320)
+    assert images.scale_box([10, 20, 30, 40], prepared.scale, prepared.size) == [40, 80, 120, 160]
+    assert images.scale_box([630, 310, 30, 30], prepared.scale, prepared.size) == [2520, 1240, 40, 40]
+    assert images.prepare_for_detection(b"not an image", max_side=640, quality=85) is None
+
+
+
+def test_prepare_for_detection_rejects_decompression_bombs(monkeypatch) -> None:
+    from PIL import Image
+
+    images = importlib.import_module("backend.app.images")
+    content = _jpeg(64, 48)
+    # Pillow refuses images over twice the limit.
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 64 * 48 // 4)
+    assert images.decode(content) is None
+    assert images.prepare_for_detection(content, max_side=640, quality=85) is None
+
+def test_embedding_sends_downscaled_image_and_face_crop(ai_service, mock_ai_server) -> None:
+    images = importlib.import_module("backend.app.images")
+    original = _jpeg(2560, 1920)
+    sizes: dict[str, tuple[int, int]] = {}
+    bodies: dict[str, bytes] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        bodies[request.url.path] = body
+        payload = body.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+        sizes[request.url.path] = images.decode(payload).size
+        if request.url.path == "/detect-faces":
+            return httpx.Response(200, json={"faces": [{"box": [100, 100, 200, 200]}]})
+        return httpx.Response(200, json={"embedding": [0.5]})
+
+    mock_ai_server(handler)
+    before = ai_service.image_stats()
+
+    embedding = asyncio.run(ai_service._embed_largest_face(original))
+    assert embedding == [0.5]
+    assert sizes["/detect-faces"] == (640, 480)
+    # The 800px face box in original pixels is cropped and shrunk to 256px.
+    assert sizes["/embedding"] == (256, 256)
+    assert b'name="box"' not in bodies["/embedding"]
+    after = ai_service.image_stats()
+    assert after["raw_bytes"] - before["raw_bytes"] == 2 * len(original)
+    assert after["sent_bytes"] - before["sent_bytes"] < len(original)
+
+
+def test_local_replica_receives_large_images_through_shared_memory(
+    ai_service, mock_ai_server, monkeypatch
+) -> None:
+    from multiprocessing import shared_memory
+
+    monkeypatch.setattr(ai_service.config, "AI_SERVER_UDS", "/tmp/ai.sock")
+    monkeypatch.setattr(ai_service.config, "AI_SHM_MIN_BYTES", 16)
+    ai_service.ai_routing.reset_pools()
+    seen: dict[str, object] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen["content_type"] = request.headers["content-type"]
+        form = dict(httpx.QueryParams(request.read().decode()))
+        seen["name"] = form["shm"]
+        segment = shared_memory.SharedMemory(name=form["shm"])
+        seen["payload"] = bytes(segment.buf[: int(form["shm_size"])])
+        segment.close()
+        return httpx.Response(200, json={"faces": []})
+
+    mock_ai_server(handler)
+    try:
+        payload = b"x" * 64
+        files = {"file": ("a.jpg", payload, "image/jpeg")}
+        asyncio.run(ai_service._post_ai("/detect-faces", files=files))
+    finally:
+        ai_service.ai_routing.reset_pools()
+
+    assert seen["content_type"] == "application/x-www-form-urlencoded"
+    assert seen["payload"] == payload
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=seen["name"])
+
+
+def test_unix_socket_transport_only_serves_the_local_ai_server(
+    ai_service, monkeypatch, tmp_path
+) -> None:
+    socket_path = str(tmp_path / "ai.sock")
+    monkeypatch.setattr(ai_service.config, "AI_SERVER_URL", "http://ai-local:8000")
+    monkeypatch.setattr(ai_service.config, "AI_SERVER_UDS", socket_path)
+    requests: list[bytes] = []
+    stats: dict[str, object] = {}
+
+    async def run() -> int:
+        finished = asyncio.Event()
+
+        async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            requests.append(await reader.readuntil(b"\r\n\r\n"))
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}")
+            await writer.drain()
+            # Keep the connection open so it stays in the pool.
+            await finished.wait()
+            writer.close()
+
+        server = await asyncio.start_unix_server(serve, path=socket_path)
+        client = ai_service._build_client()
+        monkeypatch.setattr(ai_service, "_client", client)
+        try:
+            response = await client.get("http://ai-local:8000/")
+            assert client._transport_for_url(httpx.URL("http://example.com/")) is client._transport
+            stats.update(ai_service.pool_stats())
+            return response.status_code
+        finally:
+            finished.set()
+            await client.aclose()
+            server.close()
+            await server.wait_closed()
+
+    assert asyncio.run(run()) == 200
+    assert requests[0].startswith(b"GET / HTTP/1.1")
+    # Connections of the socket transport are counted too.
+    assert stats["connections"] == 1 and stats["idle_connections"] == 1
+    assert stats["transports"] == {
+        "default": {"connections": 0, "idle_connections": 0},
+        "all://ai-local:8000": {"connections": 1, "idle_connections": 1},
+    }
+
+
+def test_ai_proposal_is_generated_once_then_served_from_storage(
+    client, ai_service, mock_ai_server
+) -> None:
+    calls: list[bytes] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.content)
+        return httpx.Response(200, json={"title": "花見", "source": "model"})
+
+    mock_ai_server(handler)
+
+    first = client.get("/api/proposal/ai", params={"user_id": 9101})
+    second = client.get("/api/proposal/ai", params={"user_id": 9101})
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert first.json()["title"] == "花見"
+    assert first.json()["source"] == "model"
+    assert len(calls) == 1
+
+    stats = client.get("/health/ai").json()["suggestions"]
+    assert stats["misses"] >= 1 and stats["hits"] >= 1
+
+
+def test_stale_suggestion_is_served_while_refreshed(
+    app_with_db, ai_service, mock_ai_server, monkeypatch
+) -> None:
+    _, db_module = app_with_db
+    suggestions = importlib.import_module("backend.app.suggestions")
+    titles = iter(["古い提案", "新しい提案"])
+    mock_ai_server(lambda request: httpx.Response(200, json={"title": next(titles)}))
+
+    async def run() -> tuple[str, str]:
+        await suggestions.generate(9102)
+        monkeypatch.setattr(suggestions.config, "AI_SUGGESTION_TTL_SECONDS", 0.0)
+        session = db_module.SessionLocal()
+        try:
+            served = await suggestions.get_suggestion(session, 9102)
+            await suggestions.refresh(9102)
+            latest = db_module.fetch_stored_ai_proposal_suggestion(session, 9102)
+        finally:
+            session.close()
+        return served.title, latest.title
+
+    assert asyncio.run(run()) == ("古い提案", "新しい提案")
+
+
+def test_producer_fills_missing_suggestions(app_with_db, ai_service, mock_ai_server) -> None:
+    _, db_module = app_with_db
+    suggestions = importlib.import_module("backend.app.suggestions")
+    session = db_module.SessionLocal()
+    try:
+        user_id = db_module.create_user(
+            session,
+            account_id="producer-target",
+            display_name="Producer Target",
+            icon_image=None,
+            face_image="https://example.com/face.jpg",
+            profile_text=None,
+        )
+    finally:
+        session.close()
+    mock_ai_server(lambda request: httpx.Response(200, json={"title": "定例会"}))
+
+    asyncio.run(suggestions.produce_once())
+
+    session = db_module.SessionLocal()
+    try:
+        stored = db_module.fetch_stored_ai_proposal_suggestion(session, user_id)
+        stale_before = stored.generated_at - timedelta(seconds=1)
+        pending = db_module.users_needing_ai_suggestion(
+            session,
+            stale_before=stale_before,
+            limit=1000,
+            model_version=suggestions.MODEL_VERSION,
+        )
+        # Suggestions of an older model version do not count as fresh.
+        after_model_change = db_module.users_needing_ai_suggestion(
+            session, stale_before=stale_before, limit=1000, model_version="next-model"
+        )
+    finally:
+        session.close()
+    assert stored.title == "定例会"
+    assert stored.latency_ms is not None
+    assert user_id not in pending
+    assert user_id in after_model_change
+
+
+def test_producer_ticks_share_one_job_across_processes(app_with_db, monkeypatch) -> None:
+    _, db_module = app_with_db
+    suggestions = importlib.import_module("backend.app.suggestions")
+    monkeypatch.setattr(suggestions.config, "JOBS_ENABLED", True)
+
+    async def never(*args, **kwargs):
+        raise AssertionError("the API process must not scan when jobs are enabled")
+
+    monkeypatch.setattr(suggestions, "produce_once", never)
+
+    # Ticks of two API processes before a worker picks the job up.
+    asyncio.run(suggestions.tick())
+    asyncio.run(suggestions.tick())
+
+    session = db_module.SessionLocal()
+    try:
+        queued = session.query(db_module.Job).filter_by(kind="suggestions.produce").all()
+        assert [job.status for job in queued] == ["queued"]
+        session.delete(queued[0])
+        session.commit()
+    finally:
+        session.close()
+    worker = importlib.import_module("backend.app.worker")
+    assert "suggestions.produce" in worker.jobs._handlers
@@ -0,0 +1,465 @@
+"""Tests for the content-addressed asset store."""
+
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import hashlib
+import importlib
+import io
+import os
+
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.exc import OperationalError
+
+
+@pytest.fixture
+def assets(app_with_db, monkeypatch, tmp_path):
+    module = importlib.import_module("backend.app.assets")
+    monkeypatch.setattr(module.config, "ASSET_STORAGE_DIR", str(tmp_path))
+    return module
+
+
+class _CountingReader(io.BytesIO):
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.reads: list[int] = []
+
+    def read(self, size: int = -1) -> bytes:
+        self.reads.append(size)
+        return super().read(size)
+
+
+def test_store_stream_hashes_in_chunks_under_fan_out_key(assets, monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(assets.config, "ASSET_CHUNK_SIZE", 4)
+    content = b"0123456789abcdef-face"
+    source = _CountingReader(content)
+
+    stored = assets.store_stream(source)
+
+    digest = hashlib.sha256(content).hexdigest()
+    assert stored.sha256 == digest
+    assert stored.size == len(content)
+    assert stored.storage_key == f"{digest[:2]}/{digest[2:4]}/{digest}"
+    assert stored.url == f"/assets/images/{digest}"
+    assert (tmp_path / stored.storage_key).read_bytes() == content
+    assert set(source.reads) == {4}
+    assert list((tmp_path / ".incoming").iterdir()) == []
+
+
+def test_identical_uploads_share_one_file(assets, tmp_path) -> None:
+    first = assets.store_stream(io.BytesIO(b"same"))
+    second = assets.store_stream(io.BytesIO(b"same"))
+    assert first == second
+    assert len([p for p in tmp_path.rglob("*") if p.is_file()]) == 1
+
+
+def test_oversized_upload_is_rejected_and_cleaned_up(assets, monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(assets.config, "ASSET_MAX_BYTES", 8)
+    monkeypatch.setattr(assets.config, "ASSET_CHUNK_SIZE", 4)
+    with pytest.raises(assets.AssetTooLarge):
+        assets.store_stream(io.BytesIO(b"x" * 32))
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == []
+
+
+def test_digest_from_url_only_accepts_local_assets(assets) -> None:
+    digest = hashlib.sha256(b"x").hexdigest()
+    assert assets.digest_from_url(f"/assets/images/{digest}") == digest
+    assert assets.digest_from_url("/assets/images/../../etc/passwd") is None
+    assert assets.digest_from_url(f"https://example.com/assets/images/{digest}") is None
+
+
+@pytest.fixture(scope="module")
+def stored_photo(app_with_db):
+    app_module, db_module = app_with_db
+    content = _photo_bytes(32, 24)
+    stored = app_module.assets.store_stream(io.BytesIO(content))
+    session = db_module.SessionLocal()
+    try:
+        db_module.record_assets(session, owner_id=1, assets=[stored])
+    finally:
+        session.close()
+    return stored, content
+
+
+def test_asset_route_serves_immutable_content_with_strong_etag(client, stored_photo) -> None:
+    stored, content = stored_photo
+    response = client.get(stored.url)
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["etag"] == f'"{stored.sha256}"'
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert response.headers["content-disposition"] == "inline"
+
+    head = client.head(stored.url)
+    assert head.status_code == 200
+    assert head.headers["content-length"] == str(len(content))
+    assert head.content == b""
+
+
+def test_asset_route_queries_the_database_off_the_event_loop(
+    client, app_with_db, stored_photo
+) -> None:
+    app_module, db_module = app_with_db
+    stored, _ = stored_photo
+    on_loop: list[bool] = []
+
+    class _RecordingSession(db_module.Session):
+        def get(self, *args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+            return super().get(*args, **kwargs)
+
+    def _session():
+        session = _RecordingSession(bind=db_module.engine)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app_module.app.dependency_overrides[db_module.get_session] = _session
+    try:
+        assert client.get(stored.url).status_code == 200
+    finally:
+        app_module.app.dependency_overrides.clear()
+    assert on_loop == [False]
+
+
+def test_asset_route_answers_if_none_match_with_304(client, stored_photo) -> None:
+    stored, _ = stored_photo
+    response = client.get(stored.url, headers={"If-None-Match": f'W/"x", "{stored.sha256}"'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == f'"{stored.sha256}"'
+
+
+def test_asset_route_serves_byte_ranges(client, stored_photo) -> None:
+    stored, content = stored_photo
+    partial = client.get(stored.url, headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206
+    assert partial.content == content[10:20]
+    assert partial.headers["content-range"] == f"bytes 10-19/{len(content)}"
+
+    suffix = client.get(stored.url, headers={"Range": "bytes=-5"})
+    assert suffix.content == content[-5:]
+
+    stale = client.get(stored.url, headers={"Range": "bytes=0-1", "If-Range": '"other"'})
+    assert stale.status_code == 200
+
+    beyond = client.get(stored.url, headers={"Range": f"bytes={len(content)}-"})
+    assert beyond.status_code == 416
+    assert beyond.headers["content-range"] == f"bytes */{len(content)}"
+
+
+def test_uploaded_markup_is_never_served_as_markup(client, app_with_db) -> None:
+    app_module, db_module = app_with_db
+    page = b"<html><script>alert(document.cookie)</script></html>"
+    response = client.post(
+        "/api/asset",
+        data={"user_id": "1"},
+        files={"file": ("page.html", page, "text/html")},
+    )
+    assert response.status_code == 200
+
+    served = client.get(response.json()["url"])
+    assert served.content == page
+    assert served.headers["content-type"] == "application/octet-stream"
+    assert served.headers["x-content-type-options"] == "nosniff"
+    assert served.headers["content-disposition"] == "attachment"
+
+    # A row recorded before uploads were sniffed keeps its old type in the DB.
+    svg = app_module.assets.store_stream(io.BytesIO(b"<svg onload='alert(1)'/>"))
+    session = db_module.SessionLocal()
+    try:
+        db_module.record_assets(
+            session, owner_id=1, assets=[dataclasses.replace(svg, content_type="image/svg+xml")]
+        )
+    finally:
+        session.close()
+    served = client.get(svg.url)
+    assert served.headers["content-type"] == "application/octet-stream"
+    assert served.headers["content-disposition"] == "attachment"
+
+
+def test_record_assets_tolerates_a_concurrent_upload_of_the_same_file(app_with_db) -> None:
+    app_module, db_module = app_with_db
+    stored = app_module.assets.store_stream(io.BytesIO(_photo_bytes(12, 12)))
+    raced = []
+
+    def _other_upload_wins(conn, cursor, statement, parameters, context, executemany):
+        # Another request records the same file between our check and insert.
+        if not raced and statement.lstrip().upper().startswith("INSERT INTO ASSETS"):
+            raced.append(True)
+            other = db_module.SessionLocal()
+            try:
+                db_module.record_assets(other, owner_id=2, assets=[stored])
+            finally:
+                other.close()
+
+    event.listen(db_module.engine, "before_cursor_execute", _other_upload_wins)
+    session = db_module.SessionLocal()
+    try:
+        db_module.record_assets(session, owner_id=1, assets=[stored])
+        assert session.get(db_module.Asset, stored.sha256).owner_id == 2
+    finally:
+        session.close()
+        event.remove(db_module.engine, "before_cursor_execute", _other_upload_wins)
+
+
+def test_create_user_is_rolled_back_when_its_assets_cannot_be_recorded(
+    client, app_with_db, monkeypatch
+) -> None:
+    _, db_module = app_with_db
+
+    def _fail(*args, **kwargs):
+        raise OperationalError("INSERT INTO assets", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(db_module, "_insert_assets", _fail)
+    response = client.post(
+        "/api/user/create",
+        data={"account_id": "acct-asset-failure", "display_name": "Asset Failure"},
+        files={"face_image": ("face.jpg", _photo_bytes(16, 16), "image/jpeg")},
+    )
+    assert response.status_code == 503
+
+    session = db_module.SessionLocal()
+    try:
+        assert session.scalars(
+            select(db_module.User).where(db_module.User.account_id == "acct-asset-failure")
+        ).first() is None
+    finally:
+        session.close()
+
+
+def test_store_stream_sniffs_the_image_type(assets) -> None:
+    from PIL import Image
+
+    for image_format, content_type in (("PNG", "image/png"), ("GIF", "image/gif")):
+        buffer = io.BytesIO()
+        Image.new("RGB", (4, 4)).save(buffer, format=image_format)
+        buffer.seek(0)
+        assert assets.store_stream(buffer).content_type == content_type
+    assert assets.store_stream(io.BytesIO(b"not an image")).content_type == (
+        "application/octet-stream"
+    )
+
+
+def test_asset_route_rejects_unknown_and_malformed_digests(client) -> None:
+    assert client.get(f"/assets/images/{'0' * 64}").status_code == 404
+    assert client.get("/assets/images/not-a-digest").status_code == 422
+
+
+def test_asset_response_uses_zerocopy_extension_when_offered(app_with_db, stored_photo) -> None:
+    import asyncio
+
+    asset_response = importlib.import_module("backend.app.asset_response")
+    stored, content = stored_photo
+    app_module, _ = app_with_db
+    response = asset_response.AssetFileResponse(
+        app_module.assets.path_for(stored.sha256),
+        size=len(content),
+        etag=asset_response.etag_for(stored.sha256),
+        media_type="image/jpeg",
+        byte_range=(4, 11),
+    )
+    messages: list[dict] = []
+
+    async def send(message: dict) -> None:
+        if message["type"] == asset_response.ZEROCOPY_EXTENSION:
+            fd = message["file"].fileno()
+            message = {**message, "data": os.pread(fd, message["count"], message["offset"])}
+        messages.append(message)
+
+    extensions = {asset_response.ZEROCOPY_EXTENSION: {}}
+    scope = {"type": "http", "method": "GET", "extensions": extensions}
+    asyncio.run(response(scope, None, send))
+    assert messages[0]["status"] == 206
+    assert messages[1]["type"] == asset_response.ZEROCOPY_EXTENSION
+    assert messages[1]["data"] == content[4:12]
+
+
+def _photo_bytes(width: int, height: int) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (30, 140, 200)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_render_variants_writes_each_size_once(assets, tmp_path) -> None:
+    from PIL import Image
+
+    thumbnails = importlib.import_module("backend.app.thumbnails")
+    stored = assets.store_stream(io.BytesIO(_photo_bytes(1600, 1200)))
+    args = (str(assets.path_for(stored.sha256)), str(tmp_path), stored.sha256, (256, 768), 80, 75)
+
+    written, _ = thumbnails.render_variants(*args)
+    assert written == 4
+    with Image.open(thumbnails.variant_path(stored.sha256, 256, "webp")) as small:
+        assert small.format == "WEBP"
+        assert small.size == (256, 192)
+    with Image.open(thumbnails.variant_path(stored.sha256, 768, "jpg")) as large:
+        assert large.size == (768, 576)
+
+    assert thumbnails.render_variants(*args)[0] == 0
+
+
+def test_render_processes_do_not_import_the_database_layer() -> None:
+    import subprocess
+    import sys
+
+    # What a spawned pool worker imports to unpickle render_variants.
+    check = (
+        "import sys, backend.app.thumbnails; "
+        "sys.exit('backend.app.db' in sys.modules or 'backend.app.jobs' in sys.modules)"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+    result = subprocess.run([sys.executable, "-c", check], cwd=root, env=env)
+    assert result.returncode == 0
+
+
+def test_thumbnail_route_renders_on_demand(client, app_with_db) -> None:
+    app_module, _ = app_with_db
+    upload = client.post(
+        "/api/asset",
+        data={"user_id": "1"},
+        files={"file": ("photo.jpg", _photo_bytes(1200, 900), "image/jpeg")},
+    )
+    assert upload.status_code == 200
+    body = upload.json()
+    digest = app_module.assets.digest_from_url(body["url"])
+    assert body["thumbnail_url"] == f"/assets/thumbs/{digest}/256.webp"
+
+    response = client.get(body["thumbnail_url"])
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert "immutable" in response.headers["cache-control"]
+    assert client.get(f"/assets/thumbs/{digest}/100.webp").status_code == 404
+    assert client.get(f"/assets/thumbs/{'0' * 64}/256.jpg").status_code == 404
+
+
+def test_album_photos_include_thumbnail_urls(client, db_module) -> None:
+    album = client.post("/api/album", json={"user_id": 1, "title": "Trip"}).json()
+    digest = hashlib.sha256(b"album-photo").hexdigest()
+    photo_urls = [f"/assets/images/{digest}", "https://example.com/remote.jpg"]
+    client.post(f"/api/album/{album['albam_id']}", json={"photo": photo_urls}).raise_for_status()
+
+    photos = client.get(f"/api/album/{album['albam_id']}", params={"user_id": 1}).json()
+    thumbs = {photo["image_url"]: photo["thumbnail_url"] for photo in photos}
+    assert thumbs[photo_urls[0]] == f"/assets/thumbs/{digest}/256.webp"
+    assert thumbs[photo_urls[1]] is None
+
+
+def _photo_with_exif(width: int, height: int, taken: str | None, orientation: int = 1) -> bytes:
+    from PIL import ExifTags, Image
+
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = orientation
+    if taken is not None:
+        exif.get_ifd(ExifTags.IFD.Exif)[ExifTags.Base.DateTimeOriginal] = taken
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (90, 90, 90)).save(buffer, format="JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def test_read_metadata_uses_exif_header(tmp_path, app_with_db) -> None:
+    from datetime import datetime, timedelta, timezone
+
+    exif = importlib.import_module("backend.app.exif")
+    path = tmp_path / "rotated.jpg"
+    path.write_bytes(_photo_with_exif(64, 48, "2024:05:03 10:20:30", orientation=6))
+
+    metadata = exif.read_metadata(path)
+    assert metadata.captured_at == datetime(
+        2024, 5, 3, 10, 20, 30, tzinfo=timezone(timedelta(hours=9))
+    )
+    assert (metadata.width, metadata.height, metadata.orientation) == (48, 64, 6)
+    assert exif.parse_exif_datetime("2024:05:03 10:20:30", "-04:00").utcoffset() == timedelta(
+        hours=-4
+    )
+    assert exif.read_metadata(tmp_path / "missing.jpg") is None
+
+
+def test_album_photos_can_be_ordered_by_capture_time(client, app_with_db) -> None:
+    app_module, _ = app_with_db
+    urls = []
+    for taken in ("2023:01:01 09:00:00", None, "2024:06:01 09:00:00", "2022:03:01 09:00:00"):
+        stored = app_module.assets.store_stream(io.BytesIO(_photo_with_exif(40, 30, taken)))
+        urls.append(stored.url)
+    album = client.post("/api/album", json={"user_id": 1, "title": "EXIF"}).json()
+    path = f"/api/album/{album['albam_id']}"
+    client.post(path, json={"photo": urls}).raise_for_status()
+
+    first = client.get(path, params={"user_id": 1, "order": "captured"}).json()
+    assert [photo["image_url"] for photo in first] == [urls[2], urls[0], urls[3], urls[1]]
+    assert first[0]["captured_at"].startswith("2024-06-01T09:00:00")
+    assert (first[0]["width"], first[0]["height"]) == (40, 30)
+
+    _, db_module = app_with_db
+    session = db_module.SessionLocal()
+    try:
+        paged: list[str] = []
+        anchor = None
+        for _ in urls:
+            _, batch = db_module.fetch_album_photos(
+                session,
+                album_id=album["albam_id"],
+                user_id=1,
+                oldest_image_id=anchor,
+                limit=1,
+                order="captured",
+            )
+            paged.append(batch[0].image_url)
+            anchor = batch[0].image_id
+    finally:
+        session.close()
+    assert paged == [urls[2], urls[0], urls[3], urls[1]]
+
+
+def test_photos_without_exif_follow_in_upload_order(client, app_with_db) -> None:
+    from datetime import datetime, timedelta, timezone
+
+    app_module, db_module = app_with_db
+    album = client.post("/api/album", json={"user_id": 1, "title": "No EXIF"}).json()
+    path = f"/api/album/{album['albam_id']}"
+    urls = []
+    for width in (41, 42, 43, 44, 45):
+        stored = app_module.assets.store_stream(io.BytesIO(_photo_with_exif(width, 30, None)))
+        client.post(path, json={"photo": [stored.url]}).raise_for_status()
+        urls.append(stored.url)
+
+    session = db_module.SessionLocal()
+    try:
+        # Ids are random; make the upload order unambiguous regardless of them.
+        base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for index, url in enumerate(urls):
+            photo = session.get(db_module.AlbumPhoto, (album["albam_id"], url))
+            photo.uploaded_at = base + timedelta(minutes=index)
+        session.commit()
+
+        paged: list[str] = []
+        anchor = None
+        while True:
+            _, batch = db_module.fetch_album_photos(
+                session,
+                album_id=album["albam_id"],
+                user_id=1,
+                oldest_image_id=anchor,
+                limit=2,
+                order="captured",
+            )
+            if not batch:
+                break
+            paged.extend(photo.image_url for photo in batch)
+            anchor = batch[-1].image_id
+    finally:
+        session.close()
+    assert paged == urls[::-1]
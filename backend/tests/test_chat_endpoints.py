@@ -2,9 +2,11 @@
 
 from __future__ import annotations
 
+import asyncio
 from datetime import datetime
 
 from fastapi.testclient import TestClient
+from sqlalchemy import select
 
 
 def _create_user(session, db_module, user_id: int, name: str) -> None:
@@ -80,3 +82,124 @@ def test_create_chat_group_adds_creator(client: TestClient, db_module) -> None:
     assert membership_response.status_code == 200
     chats = membership_response.json()
     assert any(chat["title"] == "Creator Group" for chat in chats)
+
+
+def test_chat_list_pages_by_last_message(client: TestClient, db_module) -> None:
+    session = db_module.SessionLocal()
+    try:
+        user_id = 2020
+        other_id = 2021
+        _create_user(session, db_module, user_id, "Pager")
+        _create_user(session, db_module, other_id, "Sender")
+        session.commit()
+        for index in range(5):
+            group_id = db_module.create_chat_group(
+                session, title=f"Paged {index}", member_ids=[user_id, other_id]
+            )
+            if index != 2:
+                db_module.create_chat_messages(
+                    session,
+                    chat_id=group_id,
+                    sender_id=other_id,
+                    messages=[db_module.NewChatMessage(body="x" * 500 + str(index))],
+                )
+    finally:
+        session.close()
+
+    full = client.get("/api/chat", params={"user_id": user_id}).json()
+    assert [chat["title"] for chat in full] == [
+        "Paged 4", "Paged 3", "Paged 1", "Paged 0", "Paged 2"
+    ]
+    assert len(full[0]["last_message"]) == db_module.CHAT_PREVIEW_LENGTH
+
+    pages: list[dict] = []
+    params: dict[str, object] = {"user_id": user_id, "limit": 2}
+    while True:
+        page = client.get("/api/chat", params=params).json()
+        pages.extend(page)
+        if len(page) < 2:
+            break
+        last = page[-1]
+        params["oldest_chat_groupe_id"] = last["chat_groupe_id"]
+        if last["last_message_date"]:
+            params["oldest_message_date"] = last["last_message_date"]
+        else:
+            params.pop("oldest_message_date", None)
+    assert pages == full
+
+
+def test_startup_backfill_gives_old_chat_groups_a_preview(
+    client: TestClient, app_with_db, db_module
+) -> None:
+    app_module, _ = app_with_db
+    session = db_module.SessionLocal()
+    try:
+        user_id = 2040
+        _create_user(session, db_module, user_id, "Old Timer")
+        session.commit()
+        group_id = db_module.create_chat_group(session, title="Before", member_ids=[user_id])
+        db_module.create_chat_messages(
+            session,
+            chat_id=group_id,
+            sender_id=user_id,
+            messages=[db_module.NewChatMessage(body="from the old days")],
+        )
+        group = session.get(db_module.ChatGroup, group_id)
+        group.last_message_id = group.last_message_preview = group.last_message_at = None
+        session.commit()
+    finally:
+        session.close()
+
+    asyncio.run(app_module.backfills.run())
+
+    response = client.get("/api/chat", params={"user_id": user_id})
+    assert response.status_code == 200
+    assert response.json()[0]["last_message"] == "from the old days"
+
+
+def test_startup_repairs_unread_counts_of_existing_members(
+    client: TestClient, app_with_db, db_module, monkeypatch
+) -> None:
+    app_module, _ = app_with_db
+    session = db_module.SessionLocal()
+    try:
+        reader_id, writer_id = 2050, 2051
+        _create_user(session, db_module, reader_id, "Reader")
+        _create_user(session, db_module, writer_id, "Writer")
+        session.commit()
+        group_id = db_module.create_chat_group(
+            session, title="Unread", member_ids=[reader_id, writer_id]
+        )
+        db_module.create_chat_messages(
+            session,
+            chat_id=group_id,
+            sender_id=writer_id,
+            messages=[db_module.NewChatMessage(body=f"unread {n}") for n in range(3)],
+        )
+        # The column's server default on a membership that predates it.
+        session.get(db_module.ChatMember, (group_id, reader_id)).unread_count = 0
+        session.commit()
+    finally:
+        session.close()
+
+    monkeypatch.setattr(app_module.config, "JOBS_ENABLED", True)
+    asyncio.run(app_module.backfills.run())
+    asyncio.run(app_module.backfills.run())
+    session = db_module.SessionLocal()
+    try:
+        queued = session.scalars(
+            select(db_module.Job).where(
+                db_module.Job.kind == "chat.repair_unread_counts",
+                db_module.Job.status == "queued",
+            )
+        ).all()
+        assert len(queued) == 1
+        session.delete(queued[0])
+        session.commit()
+    finally:
+        session.close()
+
+    monkeypatch.setattr(app_module.config, "JOBS_ENABLED", False)
+    asyncio.run(app_module.backfills.run())
+    response = client.get("/api/notification", params={"user_id": reader_id})
+    assert response.json()["new_chat_num"] == 3
@@ -1,6 +1,7 @@
 import importlib
 import itertools
 import os
+import re
 import sys
 import tempfile
 import typing
@@ -9,7 +10,7 @@ from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
 
 import pytest
-from sqlalchemy import create_engine, event
+from sqlalchemy import create_engine, event, update
 from sqlalchemy.engine import URL, make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.util import typing as sa_typing
@@ -259,6 +260,142 @@ def test_notification_and_proposal_queries(session):
     assert participants[bob_id].status == "invited"
 
 
+@pytest.mark.parametrize("upsert", [True, False], ids=["upsert", "update-insert"])
+def test_befriend_all_users_counts_changed_friendships(session, monkeypatch, upsert):
+    from sqlalchemy import func, select
+
+    if not upsert:
+        monkeypatch.setattr(db, "_UPSERT_INSERTS", {})
+    monkeypatch.setattr(db, "BEFRIEND_CHUNK_USERS", 3)
+    ids = [_next_test_id() for _ in range(4)]
+    for user_id in ids:
+        _create_user(session, user_id, f"User {user_id}")
+    now = datetime.now(timezone.utc)
+    # The self-friendship is not part of any pair and must stay untouched.
+    for user_id, friend_user_id, status in (
+        (ids[0], ids[1], "pending"),
+        (ids[2], ids[3], "accepted"),
+        (ids[3], ids[3], "pending"),
+    ):
+        session.add(
+            db.UserFriendship(
+                user_id=user_id, friend_user_id=friend_user_id, status=status, updated_at=now
+            )
+        )
+    session.commit()
+
+    def accepted_pairs() -> int:
+        return session.scalar(
+            select(func.count())
+            .select_from(db.UserFriendship)
+            .where(
+                db.UserFriendship.status == "accepted",
+                db.UserFriendship.user_id != db.UserFriendship.friend_user_id,
+            )
+        )
+
+    user_count = session.scalar(select(func.count()).select_from(db.User))
+    expected = user_count * (user_count - 1) - accepted_pairs()
+
+    assert db.befriend_all_users(session) == expected
+    assert accepted_pairs() == user_count * (user_count - 1)
+    assert session.get(db.UserFriendship, (ids[3], ids[3])).status == "pending"
+    assert db.befriend_all_users(session) == 0
+
+
+def test_notification_counts_are_cached_until_a_write_changes_them(session):
+    alice_id = _next_test_id()
+    bob_id = _next_test_id()
+    _create_user(session, alice_id, "Alice")
+    _create_user(session, bob_id, "Bob")
+    db.update_friend_status(
+        session, user_id=alice_id, friend_user_id=bob_id, updated_status="requested"
+    )
+
+    counts, statements = _count_statements(
+        session, lambda: db.fetch_notification_counts(session, bob_id)
+    )
+    assert counts == db.NotificationCounts(
+        proposal_num=0, friend_request_num=1, new_chat_num=0
+    )
+    assert statements == 1
+    _, statements = _count_statements(
+        session, lambda: db.fetch_notification_counts(session, bob_id)
+    )
+    assert statements == 0
+
+    db.create_proposal(
+        session,
+        user_id=alice_id,
+        title="Picnic",
+        event_date=datetime.now(timezone.utc),
+        location=None,
+        participant_ids=[bob_id],
+    )
+    assert db.fetch_notification_counts(session, bob_id).proposal_num == 1
+
+    group_id = db.create_chat_group(session, title="Cached", member_ids=[alice_id, bob_id])
+    db.create_chat_messages(
+        session, chat_id=group_id, sender_id=alice_id, messages=[db.NewChatMessage(body="hi")]
+    )
+    assert db.fetch_notification_counts(session, bob_id).new_chat_num == 1
+
+    db.update_friend_status(
+        session, user_id=bob_id, friend_user_id=alice_id, updated_status="accepted"
+    )
+    assert db.fetch_notification_counts(session, bob_id) == db.count_notifications(
+        session, bob_id
+    )
+
+
+def test_album_list_pages_by_creation_time_in_one_statement(session):
+    if USE_REAL_DB and not getattr(db, "ALBUM_PHOTOS_AVAILABLE", False):
+        pytest.skip("Album photo tables are not available on the real database.")
+    owner_id = _next_test_id()
+    _create_user(session, owner_id, "Owner")
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    # Ids and creation times deliberately disagree, and two albums share a timestamp.
+    offsets = [3, 1, 2, 2, 0]
+    album_ids = []
+    for index, offset in enumerate(offsets):
+        album_id = db.create_album(session, user_id=owner_id, title=f"Album {index}")
+        session.get(db.Album, album_id).created_at = base + timedelta(days=offset)
+        album_ids.append(album_id)
+    session.commit()
+    db.add_album_photos(
+        session,
+        album_id=album_ids[0],
+        photo_urls=["https://example.com/first.jpg", "https://example.com/second.jpg"],
+    )
+
+    expected = [album_ids[i] for i in (0, 3, 2, 1, 4)]
+    seen: list[int] = []
+    cursor = None
+    statement_counts = set()
+    while True:
+        page, statements = _count_statements(
+            session,
+            lambda: db.fetch_albums(
+                session, user_id=owner_id, oldest_album_id=cursor, limit=2
+            ),
+        )
+        statement_counts.add(statements)
+        seen.extend(album.album_id for album in page)
+        if len(page) < 2:
+            break
+        cursor = page[-1].album_id
+    assert seen == expected
+    assert statement_counts == {1}
+
+    first = db.fetch_albums(session, user_id=owner_id, oldest_album_id=None, limit=1)[0]
+    assert first.image_num == 2
+    assert first.shared_user_num == 1
+    assert first.last_uploaded_image_url in {
+        "https://example.com/first.jpg",
+        "https://example.com/second.jpg",
+    }
+
+
 def test_ai_proposal_suggestion(session):
     initiator_id = _next_test_id()
     member_one = _next_test_id()
@@ -329,9 +466,10 @@ def test_chat_workflow(session):
     assert created[0].body == "Hello"
     assert created[1].image_url is not None
 
-    member = session.get(db.ChatMember, (group_id, bob_id))
-    member.last_viewed_message_id = created[0].id
-    session.commit()
+    assert db.count_unread_messages(session, user_id=bob_id) == 2
+    assert db.mark_chat_read(
+        session, chat_id=group_id, user_id=bob_id, message_id=created[0].id
+    ) == 1
 
     messages = db.fetch_chat_messages(session, chat_id=group_id, oldest_chat_id=None)
     assert len(messages) == 2
@@ -347,6 +485,389 @@ def test_chat_workflow(session):
 
     db.add_chat_member(session, chat_id=group_id, user_id=new_member_id)
     assert session.get(db.ChatMember, (group_id, new_member_id)) is not None
+    assert db.count_unread_messages(session, user_id=new_member_id) == 2
+
+    assert db.mark_chat_read(session, chat_id=group_id, user_id=bob_id) == 0
+    assert db.count_unread_messages(session, user_id=bob_id) == 0
+
+
+def test_repair_unread_counts_fixes_drift(session):
+    alice_id = _next_test_id()
+    bob_id = _next_test_id()
+    _create_user(session, alice_id, "Alice")
+    _create_user(session, bob_id, "Bob")
+    group_id = db.create_chat_group(session, title="Drift", member_ids=[alice_id, bob_id])
+    db.create_chat_messages(
+        session,
+        chat_id=group_id,
+        sender_id=alice_id,
+        messages=[db.NewChatMessage(body="one"), db.NewChatMessage(body="two")],
+    )
+    assert db.repair_unread_counts(session, chat_ids=[group_id]) == 0
+
+    member = session.get(db.ChatMember, (group_id, bob_id))
+    member.unread_count = 7
+    session.commit()
+
+    assert db.repair_unread_counts(session, chat_ids=[group_id]) == 1
+    assert db.count_unread_messages(session, user_id=bob_id) == 2
+
+
+
+def test_mark_chat_read_clamps_to_the_newest_message(session):
+    alice_id = _next_test_id()
+    bob_id = _next_test_id()
+    _create_user(session, alice_id, "Alice")
+    _create_user(session, bob_id, "Bob")
+    group_id = db.create_chat_group(session, title="Clamp", member_ids=[alice_id, bob_id])
+    (first,) = db.create_chat_messages(
+        session, chat_id=group_id, sender_id=alice_id, messages=[db.NewChatMessage(body="one")]
+    )
+
+    assert db.mark_chat_read(
+        session, chat_id=group_id, user_id=bob_id, message_id=first.id + 1000
+    ) == 0
+    assert session.get(db.ChatMember, (group_id, bob_id)).last_viewed_message_id == first.id
+
+    db.create_chat_messages(
+        session, chat_id=group_id, sender_id=alice_id, messages=[db.NewChatMessage(body="two")]
+    )
+    assert db.count_unread_messages(session, user_id=bob_id) == 1
+    assert db.repair_unread_counts(session, chat_ids=[group_id]) == 0
+    with pytest.raises(ValueError):
+        db.mark_chat_read(session, chat_id=group_id, user_id=_next_test_id())
+
+
+def test_mark_chat_read_keeps_a_concurrent_increment(session):
+    alice_id = _next_test_id()
+    bob_id = _next_test_id()
+    _create_user(session, alice_id, "Alice")
+    _create_user(session, bob_id, "Bob")
+    group_id = db.create_chat_group(session, title="Race", member_ids=[alice_id, bob_id])
+    db.create_chat_messages(
+        session, chat_id=group_id, sender_id=alice_id, messages=[db.NewChatMessage(body="one")]
+    )
+    raced: list[bool] = []
+
+    def _message_arrives(conn, cursor, statement, parameters, context, executemany):
+        # Alice posts between Bob's read of the chat and his write of the counter.
+        if not raced and statement.lstrip().upper().startswith("UPDATE CHAT_MEMBERS"):
+            raced.append(True)
+            other = db.SessionLocal()
+            try:
+                db.create_chat_messages(
+                    other,
+                    chat_id=group_id,
+                    sender_id=alice_id,
+                    messages=[db.NewChatMessage(body="two")],
+                )
+            finally:
+                other.close()
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", _message_arrives)
+    try:
+        assert db.mark_chat_read(session, chat_id=group_id, user_id=bob_id) == 1
+    finally:
+        event.remove(engine, "before_cursor_execute", _message_arrives)
+    assert db.repair_unread_counts(session, chat_ids=[group_id]) == 0
+
+def _count_statements(session, func):
+    statements: list[str] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return result, len(statements)
+
+
+def test_chat_group_list_uses_constant_statement_count(session):
+    reader_id = _next_test_id()
+    writer_id = _next_test_id()
+    _create_user(session, reader_id, "Reader")
+    _create_user(session, writer_id, "Writer")
+
+    def join_groups(count: int) -> list[int]:
+        group_ids = []
+        for index in range(count):
+            group_id = db.create_chat_group(
+                session, title=f"Group {index}", member_ids=[reader_id, writer_id]
+            )
+            db.create_chat_messages(
+                session,
+                chat_id=group_id,
+                sender_id=writer_id,
+                messages=[db.NewChatMessage(body=f"hello {index}")],
+            )
+            group_ids.append(group_id)
+        return group_ids
+
+    join_groups(2)
+    session.expire_all()
+    few, few_statements = _count_statements(
+        session, lambda: db.fetch_chat_groups(session, user_id=reader_id)
+    )
+    newest = join_groups(20)[-1]
+    db.create_chat_group(session, title="Silent", member_ids=[reader_id])
+    session.expire_all()
+    many, many_statements = _count_statements(
+        session, lambda: db.fetch_chat_groups(session, user_id=reader_id)
+    )
+
+    assert len(few) == 2 and len(many) == 23
+    assert few_statements == many_statements == 1
+    assert many[0].chat_groupe_id == newest
+    assert many[0].last_message == "hello 19"
+    assert many[-1].title == "Silent" and many[-1].last_message_date is None
+    assert all(item.new_chat_num == 1 for item in many[:-1])
+
+
+def test_backfill_fills_chat_groups_created_before_last_message_columns(session):
+    member_id = _next_test_id()
+    _create_user(session, member_id, "Backfill")
+    group_ids = []
+    for index in range(3):
+        group_id = db.create_chat_group(session, title=f"Old {index}", member_ids=[member_id])
+        db.create_chat_messages(
+            session,
+            chat_id=group_id,
+            sender_id=member_id,
+            messages=[db.NewChatMessage(body=f"old {index}-{n}") for n in range(2)],
+        )
+        group_ids.append(group_id)
+    silent_id = db.create_chat_group(session, title="Old silent", member_ids=[member_id])
+    # Rows as they were before the columns existed.
+    session.execute(
+        update(db.ChatGroup)
+        .where(db.ChatGroup.id.in_(group_ids))
+        .values(last_message_id=None, last_message_preview=None, last_message_at=None)
+    )
+    session.commit()
+
+    assert db.backfill_chat_group_last_messages(session, batch_size=2) >= 3
+    session.expire_all()
+    for index, group_id in enumerate(group_ids):
+        group = session.get(db.ChatGroup, group_id)
+        assert group.last_message_preview == f"old {index}-1"
+        assert group.last_message_id is not None and group.last_message_at is not None
+    assert session.get(db.ChatGroup, silent_id).last_message_id is None
+    # Groups without messages stay NULL and are not picked up again.
+    assert db.backfill_chat_group_last_messages(session) == 0
+
+
+def test_batched_writes_preserve_input_order(session):
+    sender_id = _next_test_id()
+    other_id = _next_test_id()
+    _create_user(session, sender_id, "Sender", icon_key="icons/sender.png")
+    _create_user(session, other_id, "Other")
+    chat_id = db.create_chat_group(
+        session, title="Batch", member_ids=[sender_id, other_id, sender_id]
+    )
+
+    payloads = [db.NewChatMessage(body=f"line {n}") for n in range(12)]
+    payloads.append(db.NewChatMessage(image="https://example.com/last.jpg"))
+    created = db.create_chat_messages(session, chat_id, sender_id, payloads)
+
+    assert [message.body for message in created[:-1]] == [f"line {n}" for n in range(12)]
+    assert created[-1].image_url == "https://example.com/last.jpg"
+    assert [message.id for message in created] == sorted(message.id for message in created)
+    assert {(m.sender_name, m.sender_icon_url) for m in created} == {
+        ("Sender", "icons/sender.png")
+    }
+    stored = db.fetch_chat_messages(session, chat_id=chat_id, oldest_chat_id=None)
+    assert {m.id: m.body for m in stored} == {m.id: m.body for m in created}
+    assert db.count_unread_messages(session, other_id) == 13
+
+    if USE_REAL_DB and not getattr(db, "ALBUM_PHOTOS_AVAILABLE", False):
+        return
+    album_id = db.create_album(session, user_id=sender_id, title="Upload")
+    urls = [f"https://example.com/upload/{n}.jpg" for n in range(30)]
+    added, statements = _count_statements(
+        session, lambda: db.add_album_photos(session, album_id=album_id, photo_urls=urls)
+    )
+    assert [photo.image_url for photo in added] == urls
+    assert statements == 1
+    _, photos = db.fetch_album_photos(
+        session, album_id=album_id, user_id=sender_id, oldest_image_id=None
+    )
+    assert {photo.image_id for photo in photos} <= {photo.image_id for photo in added}
+
+
+def _query_plans(session, func) -> list[str]:
+    """Run *func* and return the query plan lines of every SELECT it issued."""
+    queries: list[tuple[str, typing.Any]] = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            queries.append((statement, parameters))
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        func()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    connection = session.connection()
+    dialect = connection.dialect.name
+    lines: list[str] = []
+    for statement, parameters in queries:
+        if dialect == "sqlite":
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            lines.extend(row[-1] for row in rows)
+        elif dialect == "postgresql":
+            # Tiny test tables are cheaper to scan; ask whether an index path exists at all.
+            connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+            lines.extend(row[0] for row in rows)
+        else:
+            pytest.skip(f"No query plan check for {dialect}.")
+    return lines
+
+
+def _full_table_scans(lines: list[str]) -> list[str]:
+    tables = set(db.Base.metadata.tables)
+    scans = []
+    for line in lines:
+        match = re.search(r"^SCAN (\w+)|Seq Scan on (\w+)", line.strip())
+        if match and (match.group(1) or match.group(2)) in tables:
+            scans.append(line.strip())
+    return scans
+
+
+_HOT_QUERIES = {
+    "count_notifications": lambda s, ids: db.count_notifications(s, ids["member"]),
+    "count_unread_messages": lambda s, ids: db.count_unread_messages(s, ids["member"]),
+    "fetch_active_proposals": lambda s, ids: db.fetch_active_proposals(s, ids["member"]),
+    "fetch_friend_overview": lambda s, ids: db.fetch_friend_overview(s, ids["member"]),
+    "fetch_chat_groups": lambda s, ids: db.fetch_chat_groups(s, ids["member"], limit=10),
+    "fetch_chat_messages": lambda s, ids: db.fetch_chat_messages(
+        s, chat_id=ids["chat"], oldest_chat_id=None
+    ),
+    "fetch_chat_messages_older": lambda s, ids: db.fetch_chat_messages(
+        s, chat_id=ids["chat"], oldest_chat_id=ids["message"]
+    ),
+    "mark_chat_read": lambda s, ids: db.mark_chat_read(
+        s, chat_id=ids["chat"], user_id=ids["member"]
+    ),
+    "fetch_albums": lambda s, ids: db.fetch_albums(
+        s, user_id=ids["member"], oldest_album_id=ids["album"]
+    ),
+    "fetch_album_photos": lambda s, ids: db.fetch_album_photos(
+        s, album_id=ids["album"], user_id=ids["member"], oldest_image_id=None
+    ),
+    "fetch_album_photos_captured": lambda s, ids: db.fetch_album_photos(
+        s, album_id=ids["album"], user_id=ids["member"], oldest_image_id=None, order="captured"
+    ),
+    "fetch_stored_ai_proposal_suggestion": lambda s, ids: db.fetch_stored_ai_proposal_suggestion(
+        s, ids["member"]
+    ),
+    "search_users": lambda s, ids: db.search_users(s, input_text="Member"),
+}
+
+
+@pytest.mark.parametrize("name", sorted(_HOT_QUERIES))
+def test_hot_queries_use_indexes(session, name):
+    owner_id = _next_test_id()
+    member_id = _next_test_id()
+    _create_user(session, owner_id, "Owner")
+    _create_user(session, member_id, "Member")
+    session.add(
+        db.UserFriendship(
+            user_id=owner_id,
+            friend_user_id=member_id,
+            status="requested",
+            updated_at=datetime.now(timezone.utc),
+        )
+    )
+    session.commit()
+    chat_id = db.create_chat_group(session, title="Plans", member_ids=[owner_id, member_id])
+    messages = db.create_chat_messages(
+        session, chat_id, owner_id, [db.NewChatMessage(body="hello")] * 3
+    )
+    db.create_proposal(
+        session,
+        user_id=owner_id,
+        title="Plans",
+        event_date=datetime.now(timezone.utc),
+        location=None,
+        participant_ids=[member_id],
+    )
+    ids = {"member": member_id, "chat": chat_id, "message": messages[-1].id}
+    if name.startswith(("fetch_album", "fetch_albums")):
+        if USE_REAL_DB and not getattr(db, "ALBUM_PHOTOS_AVAILABLE", False):
+            pytest.skip("Album photo tables are not available on the real database.")
+        ids["album"] = db.create_album(session, user_id=owner_id, title="Plans")
+        db.add_album_photos(
+            session, album_id=ids["album"], photo_urls=["https://example.com/plan.jpg"]
+        )
+        db.update_album(session, album_id=ids["album"], title="Plans", shared_user_ids=[member_id])
+
+    plan = _query_plans(session, lambda: _HOT_QUERIES[name](session, ids))
+
+    assert plan
+    assert _full_table_scans(plan) == []
+
+
+def test_search_users_matches_substrings_in_japanese_and_latin_names(session, monkeypatch):
+    names = {
+        "yamada_taro": "山田太郎",
+        "yamada_hanako": "山田花子",
+        "tanaka": "田中一郎",
+        "alice": "Alice Smith",
+        "bob": "ボブ・スミス",
+    }
+    ids = {}
+    for account, name in names.items():
+        ids[account] = db.create_user(
+            session,
+            account_id=f"{account}_{_next_test_id()}",
+            display_name=name,
+            icon_image=None,
+            face_image="",
+            profile_text=None,
+        )
+
+    def found(text: str) -> set[int]:
+        return {entry.user_id for entry in db.search_users(session, input_text=text)} & set(
+            ids.values()
+        )
+
+    queries = {
+        "山田太": {ids["yamada_taro"]},
+        "田太郎": {ids["yamada_taro"]},
+        "山田": {ids["yamada_taro"], ids["yamada_hanako"]},
+        "田": {ids["yamada_taro"], ids["yamada_hanako"], ids["tanaka"]},
+        "ALICE S": {ids["alice"]},
+        "・スミ": {ids["bob"]},
+        "yamada_": {ids["yamada_taro"], ids["yamada_hanako"]},
+        "花子様": set(),
+    }
+    for text, expected in queries.items():
+        assert found(text) == expected, text
+    # The trigram index narrows the candidates but never changes the result.
+    monkeypatch.setattr(db, "_SQLITE_USER_SEARCH", False)
+    for text, expected in queries.items():
+        assert found(text) == expected, text
+    monkeypatch.undo()
+
+    db.update_user(
+        session,
+        user_id=ids["tanaka"],
+        account_id="tanaka_renamed",
+        display_name="佐藤次郎",
+        icon_image=None,
+        face_image=None,
+        profile_text=None,
+    )
+    assert found("田中一") == set()
+    assert found("佐藤次") == {ids["tanaka"]}
 
 
 def test_album_flow(session):
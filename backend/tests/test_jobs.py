@@ -0,0 +1,101 @@
+"""Tests for the database-backed job queue."""
+
+from __future__ import annotations
+
+import asyncio
+import importlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def jobs(app_with_db):
+    return importlib.import_module("backend.app.jobs")
+
+
+@pytest.fixture
+def session(app_with_db):
+    _, db_module = app_with_db
+    session = db_module.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_enqueue_reuses_pending_job_with_same_dedup_key(jobs, session) -> None:
+    first = jobs.enqueue(session, "noop", {"n": 1}, queue="dedup", dedup_key="same")
+    second = jobs.enqueue(session, "noop", {"n": 2}, queue="dedup", dedup_key="same")
+    other = jobs.enqueue(session, "noop", {"n": 3}, queue="dedup", dedup_key="other")
+    assert first == second != other
+
+
+def test_leased_job_is_invisible_until_the_lease_expires(jobs, session) -> None:
+    job_id = jobs.enqueue(session, "noop", queue="lease")
+
+    claimed = jobs.claim(session, "lease", "worker-a", 5, lease_seconds=60)
+    assert [job.id for job in claimed] == [job_id]
+    assert claimed[0].attempts == 1
+    assert jobs.claim(session, "lease", "worker-b", 5) == []
+
+    # Simulate a crashed worker whose lease has run out.
+    row = session.get(jobs.db.Job, job_id)
+    row.locked_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+    session.commit()
+
+    reclaimed = jobs.claim(session, "lease", "worker-b", 5)
+    assert [job.id for job in reclaimed] == [job_id]
+    assert reclaimed[0].attempts == 2
+
+    # The first worker lost its lease, so its completion is ignored.
+    jobs.complete(session, claimed[0], "worker-a")
+    session.expire_all()
+    assert session.get(jobs.db.Job, job_id).locked_by == "worker-b"
+
+
+def test_failed_job_is_retried_with_backoff_then_given_up(jobs, session, monkeypatch) -> None:
+    monkeypatch.setattr(jobs.config, "JOB_RETRY_BASE_SECONDS", 10.0)
+    job_id = jobs.enqueue(session, "noop", queue="retry", max_attempts=2)
+
+    [job] = jobs.claim(session, "retry", "worker", 1)
+    before = datetime.now(timezone.utc)
+    assert jobs.fail(session, job, "worker", "boom") == jobs.QUEUED
+    session.expire_all()
+    row = session.get(jobs.db.Job, job_id)
+    run_at = row.run_at if row.run_at.tzinfo else row.run_at.replace(tzinfo=timezone.utc)
+    assert run_at >= before + timedelta(seconds=5)
+    assert jobs.claim(session, "retry", "worker", 1) == []
+
+    row.run_at = before
+    session.commit()
+    [job] = jobs.claim(session, "retry", "worker", 1)
+    assert jobs.fail(session, job, "worker", "boom again") == jobs.FAILED
+    assert jobs.queue_depths(session)["retry"] == {jobs.FAILED: 1}
+
+
+def test_worker_respects_per_queue_concurrency(jobs, session) -> None:
+    running: list[int] = []
+    peak: list[int] = []
+
+    @jobs.handler("test.sleep")
+    async def sleep(payload: dict) -> None:
+        running.append(payload["n"])
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.remove(payload["n"])
+
+    for n in range(5):
+        jobs.enqueue(session, "test.sleep", {"n": n}, queue="limited")
+
+    async def run() -> None:
+        worker = jobs.Worker({"limited": 2}, worker_id="limited-worker")
+        assert await worker.run_once() == 2
+        assert await worker.run_once() == 0
+        while jobs.queue_depths(session)["limited"].get(jobs.DONE, 0) < 5:
+            await worker.drain()
+            await worker.run_once()
+        assert worker.counts["succeeded"] == 5
+
+    asyncio.run(run())
+    assert max(peak) == 2
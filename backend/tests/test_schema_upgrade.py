@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect
+
+
+READER_ID, WRITER_ID, CHAT_ID, ALBUM_ID = 1, 2, 1, 1
+
+
+@pytest.fixture(scope="module")
+def legacy_rows() -> list[str]:
+    """Rows written by the baseline schema, before the app first starts."""
+    return [
+        "INSERT INTO users (id, assets_id, account_id, display_name) VALUES "
+        f"({READER_ID}, 'a1', 'reader', 'Reader'), ({WRITER_ID}, 'a2', 'writer', 'Writer')",
+        "INSERT INTO chat_groupes (id, title, created_at) VALUES "
+        f"({CHAT_ID}, 'Old chat', '2024-01-01 00:00:00')",
+        "INSERT INTO chat_members (chat_groupe_id, user_id, last_viewed_message_id) VALUES "
+        f"({CHAT_ID}, {READER_ID}, 1), ({CHAT_ID}, {WRITER_ID}, 3)",
+        "INSERT INTO chat_messages (id, chat_id, sender_id, body, posted_at) VALUES "
+        f"(1, {CHAT_ID}, {WRITER_ID}, 'first', '2024-01-01 00:01:00'), "
+        f"(2, {CHAT_ID}, {WRITER_ID}, 'second', '2024-01-01 00:02:00'), "
+        f"(3, {CHAT_ID}, {WRITER_ID}, 'third', '2024-01-01 00:03:00')",
+        "INSERT INTO albums (id, title, creator_id, created_at) VALUES "
+        f"({ALBUM_ID}, 'Old album', {READER_ID}, '2024-01-01 00:00:00')",
+        "INSERT INTO album_photos (album_id, photo_url, id, captured_at, uploaded_at) VALUES "
+        f"({ALBUM_ID}, 'https://example.com/old.jpg', 1, '2023-12-24 18:00:00', "
+        "'2024-01-01 00:00:00')",
+    ]
+
+
+@pytest.fixture(scope="module")
+def legacy_client(legacy_app_with_db) -> TestClient:
+    app_module, _ = legacy_app_with_db
+    with TestClient(app_module.app) as client:
+        # Let the startup backfills finish before asserting on their results.
+        asyncio.run(app_module.backfills.run())
+        yield client
+
+
+def test_upgrade_adds_unread_counts_to_existing_memberships(
+    legacy_client: TestClient,
+) -> None:
+    response = legacy_client.get("/api/notification", params={"user_id": READER_ID})
+    assert response.status_code == 200
+    assert response.json()["new_chat_num"] == 2
+
+
+def test_upgrade_gives_existing_chat_groups_their_last_message(
+    legacy_client: TestClient,
+) -> None:
+    response = legacy_client.get("/api/chat", params={"user_id": READER_ID})
+    assert response.status_code == 200
+    (summary,) = response.json()
+    assert summary["chat_groupe_id"] == CHAT_ID
+    assert summary["last_message"] == "third"
+    assert summary["new_chat_num"] == "2"
+
+    page = legacy_client.get(
+        "/api/chat",
+        params={
+            "user_id": READER_ID,
+            "limit": 1,
+            "oldest_chat_groupe_id": CHAT_ID,
+            "oldest_message_date": summary["last_message_date"],
+        },
+    )
+    assert page.status_code == 200
+    assert page.json() == []
+
+
+def test_upgrade_creates_indexes_of_altered_tables(legacy_app_with_db) -> None:
+    _, db_module = legacy_app_with_db
+    inspector = inspect(db_module.engine)
+    assert "ix_chat_groupes_last_message_at" in {
+        index["name"] for index in inspector.get_indexes("chat_groupes")
+    }
+    assert {"ix_album_photos_album_captured", "ix_album_photos_album_uploaded"} <= {
+        index["name"] for index in inspector.get_indexes("album_photos")
+    }
+
+
+def test_upgrade_keeps_existing_albums_usable(legacy_client: TestClient) -> None:
+    path = f"/api/album/{ALBUM_ID}"
+    upload = legacy_client.post(path, json={"photo": ["https://example.com/new.jpg"]})
+    assert upload.status_code == 201
+
+    response = legacy_client.get(path, params={"user_id": READER_ID, "order": "captured"})
+    assert response.status_code == 200
+    photos = response.json()
+    assert [photo["image_url"] for photo in photos] == [
+        "https://example.com/old.jpg",
+        "https://example.com/new.jpg",
+    ]
+    assert photos[0]["width"] is None
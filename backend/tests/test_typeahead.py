@@ -0,0 +1,154 @@
+"""Tests for the in-process friend search typeahead index."""
+
+from __future__ import annotations
+
+import importlib
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def typeahead(app_with_db):
+    return importlib.import_module("backend.app.typeahead")
+
+
+@pytest.fixture
+def session(app_with_db):
+    _, db_module = app_with_db
+    session = db_module.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def test_index_matches_word_prefixes_and_japanese_substrings(typeahead) -> None:
+    index = typeahead.TypeaheadIndex.build(
+        [
+            (1, "alice.smith", "Alice Smith"),
+            (2, "yamada_taro", "山田太郎"),
+            (3, "tanaka", "田中ハナコ"),
+            (4, "smithers", "Waylon Smithers"),
+        ]
+    )
+
+    assert index.search("smi", proximity={}) == [1, 4]
+    assert index.search("ＡＬＩＣＥ", proximity={}) == [1]
+    assert index.search("田太", proximity={}) == [2]
+    assert index.search("田", proximity={}) == [3, 2]
+    # Katakana and hiragana are interchangeable.
+    assert index.search("はなこ", proximity={}) == [3]
+    assert index.search("mith", proximity={}) == []
+
+    index.put(2, "yamada_taro", "佐藤太郎")
+    index.put(5, "sato_jiro", "佐藤次郎")
+    index.put(4, "waylon", "Waylon Smithers")
+    assert index.search("山田", proximity={}) == []
+    assert sorted(index.search("佐藤", proximity={})) == [2, 5]
+    assert index.search("smithers", proximity={}) == [4]
+    assert index.search("way", proximity={}) == [4]
+    assert index.stats()["users"] == 5
+
+
+def test_index_ranks_friends_then_friends_of_friends(typeahead) -> None:
+    index = typeahead.TypeaheadIndex.build(
+        [(user_id, f"sato{user_id}", f"佐藤 {user_id}") for user_id in range(1, 8)]
+    )
+    proximity = {6: 1, 3: 2, 7: 1}
+
+    found = index.search("佐藤", proximity=proximity, exclude=1)
+
+    assert found[:3] == [6, 7, 3]
+    assert sorted(found[3:]) == [2, 4, 5]
+    assert index.search("sato", proximity=proximity, limit=2) == [6, 7]
+    # Ranking does not depend on whether candidates or friends are scanned first.
+    assert index.search("sato", proximity={6: 1}, exclude=1)[:2] == [6, 2]
+    assert index.search("佐藤 5", proximity=proximity) == [5]
+
+
+def test_friend_search_uses_index_and_follows_profile_updates(
+    app_with_db, typeahead, session
+) -> None:
+    _, db = app_with_db
+    typeahead.reset()
+
+    def create(account: str, name: str) -> int:
+        return db.create_user(
+            session,
+            account_id=account,
+            display_name=name,
+            icon_image=None,
+            face_image="",
+            profile_text=None,
+        )
+
+    me = create("ta_me", "Typeahead Me")
+    friend = create("ta_friend", "Typeahead 鈴木")
+    friend_of_friend = create("ta_fof", "Typeahead 鈴木二郎")
+    stranger = create("ta_stranger", "Typeahead 鈴木三郎")
+    db.update_friend_status(session, user_id=me, friend_user_id=friend, updated_status="accepted")
+    db.update_friend_status(
+        session, user_id=friend_of_friend, friend_user_id=friend, updated_status="accepted"
+    )
+
+    # Before the index is loaded the SQL search answers.
+    fallback = db.search_friends_typeahead(session, user_id=me, input_text="鈴木")
+    assert {entry.user_id for entry in fallback} >= {friend, friend_of_friend, stranger}
+    assert typeahead.stats()["fallbacks"] == 1
+
+    assert db.load_typeahead_index() >= 4
+    found = db.search_friends_typeahead(session, user_id=me, input_text="鈴木")
+    assert [entry.user_id for entry in found][:3] == [friend, friend_of_friend, stranger]
+    assert me not in {entry.user_id for entry in found}
+
+    late = create("ta_late", "Typeahead 鈴木四郎")
+    db.update_user(
+        session,
+        user_id=stranger,
+        account_id="ta_stranger",
+        display_name="Typeahead 高橋",
+        icon_image=None,
+        face_image=None,
+        profile_text=None,
+    )
+    found = db.search_friends_typeahead(session, user_id=me, input_text="鈴木")
+    assert late in {entry.user_id for entry in found}
+    assert stranger not in {entry.user_id for entry in found}
+
+    # Unfriending drops the cached proximity of both users.
+    db.update_friend_status(session, user_id=me, friend_user_id=friend, updated_status="remove")
+    assert typeahead.proximity.get(me)[0] is None
+    db.search_friends_typeahead(session, user_id=me, input_text="鈴木")
+    assert typeahead.proximity.get(me)[0] == {}
+
+
+def test_friend_search_endpoint_ranks_for_the_caller(client, app_with_db, typeahead) -> None:
+    _, db = app_with_db
+    session = db.SessionLocal()
+    try:
+        me, friend = (
+            db.create_user(
+                session,
+                account_id=account,
+                display_name=name,
+                icon_image=None,
+                face_image="",
+                profile_text=None,
+            )
+            for account, name in (("ep_me", "Endpoint Me"), ("ep_zz_friend", "Endpoint Zz"))
+        )
+        db.update_friend_status(
+            session, user_id=me, friend_user_id=friend, updated_status="accepted"
+        )
+    finally:
+        session.close()
+    db.load_typeahead_index()
+
+    response = client.post(
+        "/api/friend/search", json={"input_text": "endpoint", "user_id": me}
+    )
+
+    assert response.status_code == 200
+    assert response.json()[0]["user_id"] == friend
+    assert me not in {item["user_id"] for item in response.json()}
+    assert client.get("/health/typeahead").json()["ready"] is True
@@ -2,9 +2,15 @@
 
 from __future__ import annotations
 
+import hashlib
+
 from fastapi.testclient import TestClient
 
 
+def _asset_url(content: bytes) -> str:
+    return f"/assets/images/{hashlib.sha256(content).hexdigest()}"
+
+
 def test_create_user_endpoint(client: TestClient, db_module) -> None:
     response = client.post(
         "/api/user/create",
@@ -14,8 +20,8 @@ def test_create_user_endpoint(client: TestClient, db_module) -> None:
             "profile_text": "Hello!",
         },
         files={
-            "icon_image": ("icon.png", b"PNGDATA", "image/png"),
-            "face_image": ("face.png", b"PNGDATA", "image/png"),
+            "icon_image": ("icon.png", b"ICONDATA", "image/png"),
+            "face_image": ("face.png", b"FACEDATA", "image/png"),
         },
     )
 
@@ -30,8 +36,13 @@ def test_create_user_endpoint(client: TestClient, db_module) -> None:
         assert user.account_id == "acct-create"
         assert user.display_name == "Test User"
         assert user.profile_text == "Hello!"
-        assert user.icon_asset_url == "/assets/images/icon.png"
-        assert user.face_asset_url == "/assets/images/face.png"
+        assert user.icon_asset_url == _asset_url(b"ICONDATA")
+        assert user.face_asset_url == _asset_url(b"FACEDATA")
+        asset = session.get(db_module.Asset, hashlib.sha256(b"FACEDATA").hexdigest())
+        assert asset is not None
+        assert asset.owner_id == user_id
+        # The bytes are not an image, whatever the client labelled them.
+        assert asset.content_type == "application/octet-stream"
     finally:
         session.close()
 
@@ -61,8 +72,8 @@ def test_update_user_endpoint(client: TestClient, db_module) -> None:
             "profile_text": "Updated profile",
         },
         files={
-            "icon_image": ("updated-icon.png", b"PNGDATA", "image/png"),
-            "face_image": ("updated-face.png", b"PNGDATA", "image/png"),
+            "icon_image": ("updated-icon.png", b"UPDATED-ICON", "image/png"),
+            "face_image": ("updated-face.png", b"UPDATED-FACE", "image/png"),
         },
     )
 
@@ -75,7 +86,7 @@ def test_update_user_endpoint(client: TestClient, db_module) -> None:
         assert user is not None
         assert user.display_name == "Updated User"
         assert user.profile_text == "Updated profile"
-        assert user.icon_asset_url == "/assets/images/updated-icon.png"
-        assert user.face_asset_url == "/assets/images/updated-face.png"
+        assert user.icon_asset_url == _asset_url(b"UPDATED-ICON")
+        assert user.face_asset_url == _asset_url(b"UPDATED-FACE")
     finally:
         session.close()